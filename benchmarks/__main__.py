@@ -0,0 +1,133 @@
+from benchmarks import common
+from benchmarks.routing import bench_routing, bench_snapping, bench_geometry
+from benchmarks.simulation import bench_tick, bench_fleet
+from benchmarks.http import bench_http
+from benchmarks.memory import bench_memory
+from simulator import route_handler as rh
+from simulator import landmarks as lm
+from simulator import contraction as ch
+import numpy as np
+import scipy
+import platform
+import argparse
+import json
+import time
+import os
+import sys
+
+SUITES = ("routing", "snapping", "geometry", "tick", "fleet", "http", "memory")
+
+# metric name suffix -> True if higher is better
+HIGHER_IS_BETTER = ("_per_s",)
+LOWER_IS_BETTER = ("_ms", "_nodes", "_mb")
+
+# {"a": {"b": 1}} -> {"a.b": 1}, numbers only
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+# return rows of (metric, baseline, current, change) and the metrics that got worse than threshold
+def compare(baseline, current, threshold):
+    base = flatten(baseline["results"])
+    curr = flatten(current["results"])
+    rows = []
+    regressions = []
+    for name in sorted(base.keys() & curr.keys()):
+        if name.endswith(HIGHER_IS_BETTER):
+            higher_is_better = True
+        elif name.endswith(LOWER_IS_BETTER):
+            higher_is_better = False
+        else:
+            continue
+        if base[name] == 0 or ".max_" in name: # single worst samples are too noisy to compare
+            continue
+        change = (curr[name] - base[name]) / base[name]
+        rows.append((name, base[name], curr[name], change))
+        worse = -change if higher_is_better else change
+        if worse > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark routing, snapping, ticking and the HTTP endpoints")
+    parser.add_argument("--graph", default=common.DEFAULT_GRAPH_PATH, help="graph .pkl file or graph store directory")
+    parser.add_argument("--seed", type=int, default=42, help="seed for origin/destination pairs and points")
+    parser.add_argument("--pairs", type=int, default=200, help="number of random origin/destination pairs")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"comma separated subset of {','.join(SUITES)}")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results json")
+    parser.add_argument("--compare", help="baseline results json to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    for suite in suites:
+        if suite not in SUITES:
+            parser.error(f"unknown suite: {suite}")
+
+    graph = common.load_graph(args.graph)
+    if os.path.exists(lm.landmarks_path(args.graph)):
+        lm.load_landmarks(graph, lm.landmarks_path(args.graph))
+    if os.path.exists(ch.ch_path(args.graph)):
+        ch.load_ch(graph, ch.ch_path(args.graph))
+    pairs = common.od_pairs(graph, args.pairs, args.seed)
+    routes = [r for r in (rh.calculate_route(graph, s, e) for s, e in pairs[:50]) if r and len(r) >= 2]
+
+    results = {}
+    started = time.time()
+    for suite in suites:
+        suite_start = time.time()
+        if suite == "routing":
+            results[suite] = bench_routing(graph, pairs)
+        elif suite == "snapping":
+            results[suite] = bench_snapping(graph, args.pairs * 5, args.seed)
+        elif suite == "geometry":
+            results[suite] = bench_geometry(graph, routes)
+        elif suite == "tick":
+            results[suite] = {
+                "auto": bench_tick(graph, routes),
+                "manual_junctions": bench_tick(graph, routes, manual_junctions=True)
+            }
+        elif suite == "fleet":
+            results[suite] = bench_fleet(graph, routes)
+        elif suite == "http":
+            results[suite] = bench_http(graph, args.graph, pairs[:20])
+        elif suite == "memory":
+            results[suite] = bench_memory(args.graph)
+        print(f"{suite}: {time.time() - suite_start:.1f}s", file=sys.stderr)
+
+    output = {
+        "meta": {
+            "graph": args.graph,
+            "seed": args.seed,
+            "pairs": args.pairs,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+            "timestamp": started,
+            "duration_s": time.time() - started
+        },
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results saved to: {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        rows, regressions = compare(baseline, output, args.threshold)
+        for name, base, curr, change in rows:
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:<60} {base:>12.4g} {curr:>12.4g} {change:>+8.1%}{flag}")
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed more than {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import random
+import time
+import numpy as np
+from simulator import graph_store as gs
+from simulator import route_handler as rh
+
+DEFAULT_GRAPH_PATH = "graphs/Manhattan_New_York_USA_drive.pkl"
+
+def load_graph(path=DEFAULT_GRAPH_PATH):
+    graph = gs.load_graph(path)
+    rh.get_compiled_graph(graph)
+    return graph
+
+# seeded random origin/destination node pairs
+def od_pairs(graph, count, seed):
+    rng = random.Random(seed)
+    nodes = sorted(rh.get_compiled_graph(graph).node_ids.tolist())
+    return [tuple(rng.sample(nodes, 2)) for _ in range(count)]
+
+# seeded random (lon, lat) points inside the graph's bounding box
+def random_points(graph, count, seed):
+    cg = rh.get_compiled_graph(graph)
+    rng = np.random.default_rng(seed)
+    lons = rng.uniform(cg.lon.min(), cg.lon.max(), count)
+    lats = rng.uniform(cg.lat.min(), cg.lat.max(), count)
+    return list(zip(lons.tolist(), lats.tolist()))
+
+# return (result, elapsed ms) of fn(*args)
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+# mean/percentiles of samples, keys end in the samples' unit (e.g. "_ms")
+def summarize(samples, unit="ms"):
+    samples = np.asarray(samples, dtype=np.float64)
+    if len(samples) == 0:
+        return {"count": 0}
+    return {
+        "count": int(len(samples)),
+        f"mean_{unit}": float(samples.mean()),
+        f"p50_{unit}": float(np.percentile(samples, 50)),
+        f"p90_{unit}": float(np.percentile(samples, 90)),
+        f"p99_{unit}": float(np.percentile(samples, 99)),
+        f"max_{unit}": float(samples.max())
+    }
@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+from simulator import geo_utils as gu
+from benchmarks.common import timed, summarize
+
+# /start -> (/tick -> /state) * ticks -> /reset cycles through the Flask test client
+# addresses resolve through an offline DictGeocoder file, so no network is involved
+def bench_http(graph, graph_path, pairs, ticks=50):
+    addresses = {}
+    for i, (start, end) in enumerate(pairs):
+        addresses[f"start {i}"] = list(gu.get_node_coords(graph, start))
+        addresses[f"end {i}"] = list(gu.get_node_coords(graph, end))
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(addresses, f)
+    os.environ["GEOCODER_FILE"] = f.name
+    os.environ["GRAPH_PATH"] = graph_path
+    os.environ.setdefault("SESSION_STORE", "memory")
+    import server # reads the environment on import
+
+    client = server.app.test_client()
+    latencies = {"start": [], "tick": [], "state": [], "route": [], "reset": []}
+    failed = 0
+    try:
+        for i in range(len(pairs)):
+            response, ms = timed(client.post, "/start", json={"start_address": f"start {i}", "end_address": f"end {i}"})
+            latencies["start"].append(ms)
+            if response.status_code != 200:
+                failed += 1
+                continue
+            route_id = response.get_json()["route_id"]
+            latencies["route"].append(timed(client.post, "/route", json={"route_id": route_id, "encoding": "polyline", "tolerance": 1})[1])
+            client.post("/set_speed", json={"route_id": route_id, "speed": 15})
+            for _ in range(ticks):
+                latencies["tick"].append(timed(client.post, "/tick", json={"route_id": route_id})[1])
+                latencies["state"].append(timed(client.post, "/state", json={"route_id": route_id})[1])
+            latencies["reset"].append(timed(client.post, "/reset", json={"route_id": route_id})[1])
+    finally:
+        os.remove(f.name)
+
+    results = {name: summarize(samples) for name, samples in latencies.items()}
+    results["failed_starts"] = failed
+    return results
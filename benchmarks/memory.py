@@ -0,0 +1,60 @@
+import subprocess
+import tempfile
+import json
+import sys
+import gc
+from simulator import graph_store as gs
+from simulator import route_handler as rh
+
+# networkx: the pickled osmnx graph (plus routing arrays and index) as served without compaction
+# compacted: gs.compact_graph of the pickle in the same process (its freed heap stays resident)
+# store: the compact graph store (what GRAPH_COMPACT serves), memory-mapped and fully paged in
+VARIANTS = ("networkx", "compacted", "store")
+
+def _rss_bytes():
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+# run in a fresh interpreter: resident memory added by loading path as variant
+def _measure(variant, path):
+    gc.collect()
+    before = _rss_bytes()
+    graph = gs.load_graph(path)
+    if variant == "compacted":
+        graph = gs.compact_graph(graph)
+    cg = rh.get_compiled_graph(graph)
+    rh.get_spatial_index(graph)
+    if cg.has_edge_attributes(): # touch every page a running server reads
+        float(cg.geometry_coords.sum() + cg.name_ids.sum() + cg.length.sum())
+    gc.collect()
+    return _rss_bytes() - before
+
+def _run_variant(variant, path):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.memory", variant, path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)["rss_bytes"]
+
+# resident memory of one loaded graph per variant (Linux /proc), each measured in its own process
+def bench_memory(graph_path):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = graph_path if gs.is_graph_store(graph_path) else gs.store_path(tmp + "/graph.pkl")
+        if store != graph_path:
+            gs.export_graph(gs.load_graph(graph_path), store)
+            paths = {"networkx": graph_path, "compacted": graph_path, "store": store}
+        else:
+            paths = {"store": store}
+        for variant, path in paths.items():
+            results[variant] = {"rss_mb": _run_variant(variant, path) / (1024 * 1024)}
+    if "networkx" in results:
+        for variant in ("compacted", "store"):
+            results[variant]["saved_pct"] = 100.0 * (1 - results[variant]["rss_mb"] / results["networkx"]["rss_mb"])
+    return results
+
+if __name__ == "__main__":
+    print(json.dumps({"rss_bytes": _measure(sys.argv[1], sys.argv[2])}))
@@ -0,0 +1,52 @@
+from simulator import route_handler as rh
+from benchmarks.common import timed, summarize, random_points
+
+# route queries per available search mode: latency and settled node percentiles
+def bench_routing(graph, pairs):
+    cg = rh.get_compiled_graph(graph)
+    modes = ["astar", "tree"]
+    if cg.landmarks is not None:
+        modes.append("alt")
+    if cg.ch is not None:
+        modes.append("ch")
+
+    results = {}
+    for mode in modes:
+        latencies = []
+        expansions = []
+        unreachable = 0
+        for start, end in pairs:
+            stats = {}
+            route, ms = timed(rh.calculate_route, graph, start, end, mode=mode, stats=stats)
+            latencies.append(ms)
+            expansions.append(stats.get("expansions", 0))
+            unreachable += route is None
+        results[mode] = {
+            "latency": summarize(latencies),
+            "expansions": summarize(expansions, unit="nodes"),
+            "unreachable": unreachable
+        }
+    return results
+
+# nearest node snapping, one point per call and one batched call
+def bench_snapping(graph, count, seed):
+    points = random_points(graph, count, seed)
+    rh.coords_to_node(graph, points[0]) # build the spatial index outside the timings
+    rh.coords_to_node(graph, points[0], snap="edge")
+
+    results = {}
+    for snap in rh.SNAP_MODES:
+        latencies = [timed(rh.coords_to_node, graph, p, snap=snap)[1] for p in points]
+        _, batch_ms = timed(rh.coords_to_nodes, graph, points, snap=snap)
+        results[snap] = {"single": summarize(latencies), "batch_ms": batch_ms, "batch_points": len(points)}
+    return results
+
+# full route geometry and the simplified encoded payload /route serves
+def bench_geometry(graph, routes):
+    build = []
+    encode = []
+    for route in routes:
+        coords, ms = timed(rh.get_route_geometry, graph, route)
+        build.append(ms)
+        encode.append(timed(rh.encode_route_geometry, coords, "polyline", 1.0)[1])
+    return {"get_route_geometry": summarize(build), "encode_polyline_1m": summarize(encode)}
@@ -0,0 +1,55 @@
+import time
+import numpy as np
+from simulator.driving_simulator import DrivingSimulator
+from simulator.fleet_simulator import FleetSimulator
+
+SPEEDS_MPS = (5.0, 15.0, 30.0)
+
+def _drive(graph, route, speed, manual_junctions):
+    sim = DrivingSimulator()
+    sim.load_route(graph, route)
+    sim.start()
+    sim.set_speed(speed)
+    sim.stop_at_junctions = manual_junctions
+    ticks = 0
+    start = time.perf_counter()
+    while not sim.finished:
+        sim.tick()
+        ticks += 1
+        if sim.awaiting_junc_choice: # keep to the planned route
+            sim.choose_junction_node(sim.route[sim.current_node_index + 1])
+    return ticks, time.perf_counter() - start
+
+# DrivingSimulator.tick throughput per speed, every route driven to the end
+# one untimed pass fills the polyline/junction caches, the best of repeat passes is kept
+def bench_tick(graph, routes, speeds=SPEEDS_MPS, manual_junctions=False, repeat=3):
+    for route in routes:
+        _drive(graph, route, max(speeds), manual_junctions)
+
+    results = {}
+    for speed in speeds:
+        best = None
+        for _ in range(repeat):
+            runs = [_drive(graph, route, speed, manual_junctions) for route in routes]
+            ticks = sum(r[0] for r in runs)
+            elapsed = sum(r[1] for r in runs)
+            if best is None or elapsed < best[1]:
+                best = (ticks, elapsed)
+        ticks, elapsed = best
+        results[f"{speed:g}_mps"] = {"ticks": ticks, "ticks_per_s": ticks / elapsed if elapsed else 0.0}
+    return results
+
+# FleetSimulator.tick throughput with every route loaded as one vehicle (repeated up to vehicles)
+def bench_fleet(graph, routes, vehicles=1000, ticks=200, speed=15.0):
+    fleet = FleetSimulator(graph)
+    fleet.add_vehicles([routes[i % len(routes)] for i in range(vehicles)], speed=speed)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        fleet.tick()
+    elapsed = time.perf_counter() - start
+    return {
+        "vehicles": vehicles,
+        "tick_ms": elapsed / ticks * 1000,
+        "vehicle_ticks_per_s": vehicles * ticks / elapsed,
+        "finished": int(np.count_nonzero(fleet.finished))
+    }
@@ -1,11 +1,12 @@
 import osmnx as ox
+from simulator import contraction as ch
 import pickle
 import os
 import sys
 
 def main():
     if len(sys.argv) < 2:
-        print("Use format: python download_graph.py \"<REGION_NAME>\"")
+        print("Use format: python download_graph.py \"<REGION_NAME>\" [--ch]")
         sys.exit(1)
 
     os.makedirs("graphs", exist_ok=True)
@@ -13,6 +14,9 @@ def main():
     region_name = sys.argv[1]
     print(f"Downloading graph for: {region_name}")
     graph = ox.graph_from_place(region_name, network_type="drive")
+    ox.add_edge_speeds(graph, hwy_speeds=112, fallback=48)
+    ox.add_edge_travel_times(graph)
+    ox.add_edge_bearings(graph)
 
     base_name = region_name.replace(" ", "_")
     base_name = base_name.replace(",", "")
@@ -23,5 +27,11 @@ def main():
     
     print(f"Graph saved to: {pkl_file_path}")
 
+    if "--ch" in sys.argv[2:]:
+        print("Building contraction hierarchy")
+        ch_file_path = ch.ch_path(pkl_file_path)
+        ch.save_ch(ch.build_ch(graph), ch_file_path)
+        print(f"Contraction hierarchy saved to: {ch_file_path}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,41 @@
+from simulator import landmarks as lm
+from simulator import contraction as ch
+from simulator import graph_store as gs
+import argparse
+import pickle
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Build routing sidecar files for a saved road network graph")
+    parser.add_argument("graph_path", help="path to graph .pkl file")
+    parser.add_argument("--landmarks", type=int, default=lm.DEFAULT_LANDMARK_COUNT,
+                        help="number of ALT landmarks (0 to skip)")
+    parser.add_argument("--ch", action="store_true", help="build a contraction hierarchy (opt-in, pure Python: about 3 s for Manhattan, longer for larger regions)")
+    parser.add_argument("--export", action="store_true", help="export a memory-mapped graph store")
+    args = parser.parse_args()
+
+    with open(args.graph_path, "rb") as f:
+        graph = pickle.load(f)
+
+    if args.export:
+        start = time.time()
+        path = gs.store_path(args.graph_path)
+        gs.export_graph(graph, path)
+        print(f"Graph store saved to: {path} in {time.time() - start:.1f}s")
+
+    if args.landmarks > 0:
+        start = time.time()
+        table = lm.build_landmarks(graph, args.landmarks)
+        path = lm.landmarks_path(args.graph_path)
+        lm.save_landmarks(table, path)
+        print(f"Landmarks ({len(table.landmarks)}) saved to: {path} in {time.time() - start:.1f}s")
+
+    if args.ch:
+        start = time.time()
+        hierarchy = ch.build_ch(graph)
+        path = ch.ch_path(args.graph_path)
+        ch.save_ch(hierarchy, path)
+        print(f"Contraction hierarchy ({hierarchy.num_shortcuts()} shortcuts) saved to: {path} in {time.time() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
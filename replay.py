@@ -0,0 +1,53 @@
+from simulator import replay as rp
+import argparse
+import json
+import time
+import os
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay trips through the driving simulator at simulated time")
+    parser.add_argument("trips_path", help="trips file (.jsonl, or .csv with node or lon/lat columns)")
+    parser.add_argument("--graph", default=os.environ.get("GRAPH_PATH", "graphs/Manhattan_New_York_USA_drive.pkl"),
+                        help="graph .pkl file or graph store (default GRAPH_PATH)")
+    parser.add_argument("--output", default="traces", help="directory for the trace files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (0 = this process)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="trips sent to a worker at once")
+    parser.add_argument("--trips-per-file", type=int, default=rp.TRIPS_PER_FILE, help="trips per trace file")
+    parser.add_argument("--speed", type=float, default=rp.DEFAULT_SPEED_MPS, help="speed (m/s) of trips without one")
+    parser.add_argument("--tick", type=float, default=rp.DEFAULT_TICK_SECONDS, help="simulated seconds per tick")
+    parser.add_argument("--max-seconds", type=float, default=rp.DEFAULT_MAX_SECONDS, help="simulated time a trip is cut off at")
+    parser.add_argument("--junctions", choices=["route", "random"], help="stop at junctions, keep to the route or sometimes take a random branch")
+    parser.add_argument("--detour-rate", type=float, default=rp.DEFAULT_DETOUR_RATE,
+                        help="share of junctions where --junctions random leaves the route")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random junction choices")
+    parser.add_argument("--route-mode", help="route search mode (default: fastest available)")
+    parser.add_argument("--snap", default="node", choices=["node", "edge"], help="how lon/lat endpoints snap to the graph")
+    parser.add_argument("--jsonl", action="store_true", help="print a summary line per trip as it completes")
+    args = parser.parse_args()
+
+    trips = rp.load_trips(args.trips_path)
+    writer = rp.TraceWriter(args.output, trips_per_file=args.trips_per_file)
+    statuses = {}
+    ticks = 0
+    start = time.time()
+    traces = rp.replay(
+        args.graph, trips, workers=args.workers, chunk_size=args.chunk_size, route_mode=args.route_mode,
+        speed=args.speed, tick_interval=args.tick, junctions=args.junctions, detour_rate=args.detour_rate, seed=args.seed,
+        snap=args.snap, max_seconds=args.max_seconds
+    )
+    try:
+        for trace in traces:
+            writer.add(trace)
+            statuses[trace.status] = statuses.get(trace.status, 0) + 1
+            ticks += trace.ticks()
+            if args.jsonl:
+                print(json.dumps(trace.summary()), flush=True)
+    finally:
+        files = writer.close()
+
+    elapsed = time.time() - start
+    print(f"Replayed {len(trips)} trips ({ticks} ticks) in {elapsed:.1f}s, {len(trips) / elapsed:.0f} trips/s: "
+          f"{json.dumps(statuses)}, {len(files)} trace files saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
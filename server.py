@@ -1,90 +1,214 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
 from simulator.driving_simulator import DrivingSimulator
 from simulator import route_handler as rh
-import requests
-from urllib.parse import quote_plus
+from simulator import geocoding as gc
+from simulator import graph_registry as gr
+from simulator.tick_scheduler import TickScheduler
+from simulator import session_store as ss
+from simulator import matrix
+from simulator import route_pool as rp
+from simulator import route_cache as rc
+from simulator import isochrone as iso
+from simulator import metrics
+from simulator.tick_scheduler import SIM_TICK_SECONDS
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
 import os
 from dotenv import load_dotenv
-import pickle
 import uuid
+import hmac
 import time
 
 app = Flask(__name__)
-sims = {} # route_id -> DrivingSimulator
 EXPIRY_SECONDS = 1800
 
 load_dotenv()
 MAPBOX_TOKEN = os.environ.get("MAPBOX_TOKEN")
 GRAPH_PATH = os.environ.get("GRAPH_PATH", "graphs/Manhattan_New_York_USA_drive.pkl")
 
-with open(GRAPH_PATH, "rb") as f:
-    PRELOADED_GRAPH = pickle.load(f)
+# GRAPH_PATH may be a pickled osmnx graph or a memory-mapped graph store directory
+# (python preprocess_graph.py graphs/X.pkl --export -> graphs/X.graph)
+# it is the default region, loaded at startup and never evicted; with GRAPH_DIR every graph in
+# that directory is served too, /start picks the one whose bounding box covers both addresses,
+# graphs load on first use and unpinned ones are dropped (LRU) beyond GRAPH_MEMORY_MB
+# pickled graphs are compacted to the attributes the simulator reads unless GRAPH_COMPACT=0
+GRAPHS = gr.GraphRegistry(
+    memory_budget=int(float(os.environ.get("GRAPH_MEMORY_MB", 0)) * 1024 * 1024),
+    compact=os.environ.get("GRAPH_COMPACT", "1") == "1"
+)
+DEFAULT_REGION = GRAPHS.register(GRAPH_PATH)
+GRAPH_DIR = os.environ.get("GRAPH_DIR")
+if GRAPH_DIR:
+    GRAPHS.scan(GRAPH_DIR)
+GRAPHS.pin(DEFAULT_REGION) # route/matrix workers and sessions without a region use it
+SNAP_MODE = os.environ.get("SNAP_MODE", "node")
+
+# sidecar files are optional (python preprocess_graph.py GRAPH_PATH [--ch])
+# fastest search mode available for the region is used unless ROUTE_MODE is set
+ROUTE_MODE = os.environ.get("ROUTE_MODE")
+
+# GEOCODER_FILE (json of address -> [lon, lat]) replaces Mapbox for offline runs
+GEOCODER_FILE = os.environ.get("GEOCODER_FILE")
+if GEOCODER_FILE:
+    geocoder_backend = gc.DictGeocoder.from_file(GEOCODER_FILE)
+else:
+    geocoder_backend = gc.MapboxGeocoder(MAPBOX_TOKEN, timeout=float(os.environ.get("GEOCODE_TIMEOUT", 10)))
+GEOCODER = gc.CachedGeocoder(
+    geocoder_backend,
+    max_entries=int(os.environ.get("GEOCODE_CACHE_SIZE", 4096)),
+    ttl_seconds=float(os.environ.get("GEOCODE_CACHE_TTL", 86400))
+)
+
+# /matrix fans one-to-many searches out over MATRIX_WORKERS processes (0 = in the request thread)
+MATRIX_WORKERS = int(os.environ.get("MATRIX_WORKERS", 0))
+MATRIX_MAX_CELLS = int(os.environ.get("MATRIX_MAX_CELLS", 1000000))
+MATRIX_EXECUTOR = None
+if MATRIX_WORKERS > 0:
+    MATRIX_EXECUTOR = ProcessPoolExecutor(
+        MATRIX_WORKERS,
+        mp_context=multiprocessing.get_context("fork"), # like RoutePool, independent of the platform default
+        initializer=matrix.init_worker,
+        initargs=(GRAPH_PATH,)
+    )
+    MATRIX_EXECUTOR.submit(os.getpid).result() # fork workers now, before request threads exist
+
+# route searches for /start run on ROUTE_WORKERS processes (0 = in the request thread)
+# a search gets ROUTE_TIMEOUT seconds and /start answers 503 once ROUTE_QUEUE searches are pending
+ROUTE_WORKERS = int(os.environ.get("ROUTE_WORKERS", 0))
+ROUTE_TIMEOUT = float(os.environ.get("ROUTE_TIMEOUT", 5.0))
+ROUTE_POOL = None
+if ROUTE_WORKERS > 0:
+    ROUTE_POOL = rp.RoutePool(GRAPH_PATH, workers=ROUTE_WORKERS, max_pending=int(os.environ.get("ROUTE_QUEUE", 32)), timeout=ROUTE_TIMEOUT)
+    ROUTE_POOL.warm_up()
+
+# /start and junction reroutes reuse routes between the same snapped nodes (and suffixes of cached
+# routes), ROUTE_CACHE_SIZE routes per graph for ROUTE_CACHE_TTL seconds (0 disables the cache)
+rc.configure(
+    max_entries=int(os.environ.get("ROUTE_CACHE_SIZE", 4096)),
+    ttl_seconds=float(os.environ.get("ROUTE_CACHE_TTL", 3600)),
+    suffixes=os.environ.get("ROUTE_CACHE_SUFFIXES", "1") != "0"
+)
+
+# route workers hold the default region only, other regions are searched inline
+def calculate_route(entry, start_node, end_node, mode, stats):
+    if ROUTE_POOL is None or entry.name != DEFAULT_REGION:
+        return rh.calculate_route(entry.graph, start_node, end_node, mode=mode, stats=stats, deadline=time.time() + ROUTE_TIMEOUT)
+    route, worker_stats = ROUTE_POOL.route(start_node, end_node, mode)
+    stats.update(worker_stats)
+    return route
+
+# route_id -> DrivingSimulator, SESSION_STORE=file shares sessions between workers
+# (gunicorn -w N) through SESSION_DIR instead of keeping them in this process
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+if SESSION_STORE == "file":
+    SESSIONS = ss.FileSessionStore(os.environ.get("SESSION_DIR", "sessions"), GRAPHS, DEFAULT_REGION, expiry_seconds=EXPIRY_SECONDS)
+elif SESSION_STORE == "memory":
+    SESSIONS = ss.MemorySessionStore(expiry_seconds=EXPIRY_SECONDS, registry=GRAPHS)
+else:
+    raise ValueError(f"unknown SESSION_STORE: {SESSION_STORE}")
+
+# /isochrone accepts up to ISOCHRONE_MAX_THRESHOLDS thresholds of at most ISOCHRONE_MAX_MINUTES
+ISOCHRONE_MAX_MINUTES = float(os.environ.get("ISOCHRONE_MAX_MINUTES", 60))
+ISOCHRONE_MAX_THRESHOLDS = 10
+
+# sims with an open /stream are ticked server side every TICK_INTERVAL seconds
+TICK_INTERVAL = float(os.environ.get("TICK_INTERVAL", 0.2))
+SCHEDULER = TickScheduler(SESSIONS, interval=TICK_INTERVAL)
+
+# GET /metrics (Prometheus text format), values are per process
+HTTP_SECONDS = metrics.histogram("http_request_seconds", "Request handling time (streams: until the response starts)", ("endpoint", "method", "status"))
+metrics.gauge("sessions_live", "Simulation sessions held by the session store", lambda: len(SESSIONS))
+metrics.gauge("streams_open", "Sims with an open /stream", lambda: len(SCHEDULER.channels))
+metrics.gauge("geocode_cache_entries", "Addresses in the geocoder cache", lambda: GEOCODER.stats()["entries"])
+metrics.gauge("graphs_loaded", "Region graphs currently loaded", lambda: sum(1 for e in GRAPHS.stats() if e["loaded"]))
+metrics.gauge("graph_memory_bytes", "Estimated size of the loaded region graphs", GRAPHS.memory_used)
+
+# PROFILER=1 samples all threads from startup, otherwise toggle it with POST /profiler
+PROFILER = metrics.SamplingProfiler(interval=float(os.environ.get("PROFILER_INTERVAL", 0.01)))
+if os.environ.get("PROFILER", "0") == "1":
+    PROFILER.start()
+
+# /metrics and /profiler need "Authorization: Bearer <ADMIN_TOKEN>" when ADMIN_TOKEN is set,
+# otherwise they only answer direct requests from this host (not ones relayed by a proxy)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
+
+def admin_allowed():
+    if ADMIN_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        return auth.startswith("Bearer ") and hmac.compare_digest(auth[len("Bearer "):].encode(), ADMIN_TOKEN.encode())
+    return request.remote_addr in LOOPBACK_ADDRESSES and "X-Forwarded-For" not in request.headers
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        HTTP_SECONDS.observe(time.perf_counter() - start, request.endpoint or "none", request.method, response.status_code)
+    return response
 
 def geocode(address):
-    qp_address = quote_plus(address)
-    url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{qp_address}.json"
-    params = {
-        "access_token": MAPBOX_TOKEN,
-        "limit": 1
-    }
-    response = requests.get(url, params=params, timeout=60)
-    response.raise_for_status()
-    data = response.json()
-    if not data["features"]:
-        raise ValueError(f"Address not found: {address}")
-    return tuple(data["features"][0]["center"])
+    return GEOCODER.geocode(address)
+
+# region for a request: explicit, located from [lon, lat] points or the default region
+# (node ids can't be located, they need an explicit region outside the default one)
+def find_region(region, points):
+    if region:
+        return region
+    coords = [p for p in points if isinstance(p, (list, tuple))]
+    if len(GRAPHS.entries) < 2 or len(coords) < len(points):
+        return DEFAULT_REGION
+    return GRAPHS.locate(coords)
 
 @app.route('/start', methods=['POST'])
 def start_sim():
     try:
         data = request.json
-        graph = PRELOADED_GRAPH
 
-        start_coords = geocode(data['start_address'])
-        end_coords = geocode(data['end_address'])
-        start_node = rh.coords_to_node(graph, start_coords)
-        end_node = rh.coords_to_node(graph, end_coords)
-        route = rh.calculate_route(graph, start_node, end_node)
+        start_coords, end_coords = GEOCODER.geocode_many([data['start_address'], data['end_address']])
+        region = find_region(data.get('region'), [start_coords, end_coords])
+        with GRAPHS.use(region) as entry:
+            graph = entry.graph
+            snap_start = time.perf_counter()
+            start_node, end_node = rh.coords_to_nodes(graph, [start_coords, end_coords], snap=data.get('snap', SNAP_MODE))
+            snap_ms = (time.perf_counter() - snap_start) * 1000
+            route_mode = data.get('route_mode', ROUTE_MODE or entry.route_mode)
+            route_stats = {"snap_ms": snap_ms}
+            route = rc.cached_route(graph, start_node, end_node, lambda: calculate_route(entry, start_node, end_node, route_mode, route_stats), route_stats)
 
-        # create new sim
-        sim = DrivingSimulator()
-        sim.load_route(graph, route)
-        sim.start()
+            # create new sim
+            sim = DrivingSimulator()
+            sim.tick_interval = TICK_INTERVAL
+            sim.region = region
+            sim.load_route(graph, route)
+            sim.start()
 
-        # generate route_id
-        route_id = str(uuid.uuid4())
-        sim.last_used = time.time()
-        sims[route_id] = sim
+            # generate route_id
+            route_id = str(uuid.uuid4())
+            sim.last_used = time.time()
+            SESSIONS.add(route_id, sim)
 
         ##sim.load_route(graph, route)
         ##sim.start()
-        return jsonify({"message": "simulation started", "route_id": route_id})
+        return jsonify({"message": "simulation started", "route_id": route_id, "region": region, "route_stats": route_stats})
+    except rp.RoutePoolFull as e:
+        return jsonify({"error": str(e)}), 503
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
-def cleanup_sims():
-    now = time.time()
-    for ri in list(sims.keys()):
-        sim = sims[ri]
-        if getattr(sim, "last_used", now) + EXPIRY_SECONDS < now:
-            sims.pop(ri, None)
-
-def get_sim(route_id):
-    cleanup_sims()
-    sim = sims.get(route_id)
-    if sim == None:
-        raise ValueError("invalid route_id")
-    sim.last_used = time.time()
-    return sim
-
 @app.route('/set_speed', methods=['POST'])
 def set_speed():
     try:
         route_id = request.json['route_id']
-        sim = get_sim(route_id)
-
         speed = request.json['speed']
-        sim.set_speed(speed)
+        with SESSIONS.session(route_id) as sim:
+            sim.set_speed(speed)
         return jsonify({"message": "speed set"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -93,9 +217,8 @@ def set_speed():
 def tick():
     try:
         route_id = request.json['route_id']
-        sim = get_sim(route_id)
-
-        sim.tick()
+        with SESSIONS.session(route_id) as sim, SIM_TICK_SECONDS.time("http"):
+            sim.tick()
         return jsonify({"message": "tick executed"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -104,14 +227,22 @@ def tick():
 def route():
     try:
         route_id = request.json['route_id']
-        sim = get_sim(route_id)
+        encoding = request.json.get('encoding', 'coords') # coords | polyline
+        tolerance_m = float(request.json.get('tolerance', 0.0)) # Douglas-Peucker tolerance (meters)
+        with SESSIONS.session(route_id, write=False) as sim:
+            etag, payload = sim.get_route_geometry(encoding, tolerance_m)
+            route_changed = sim.route_changed
+        if route_changed: # the client has the new route now
+            with SESSIONS.session(route_id) as sim:
+                sim.route_changed = False
 
-        geometry = rh.get_route_geometry(sim.graph, sim.route)
-        if (not geometry) and getattr(sim, "current_coords", None):
-            geometry = [sim.current_coords]
-
-        sim.route_changed = False
-        return jsonify({"geometry": geometry})
+        # clients send back the etag of the geometry they have, unchanged routes aren't resent
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(payload)
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -119,24 +250,44 @@ def route():
 def state():
     try:
         route_id = request.json['route_id']
-        sim = get_sim(route_id)
-        return jsonify(sim.get_state())
+        with SESSIONS.session(route_id, write=False) as sim:
+            state = sim.get_state()
+        return jsonify(state)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# server-sent events for one sim, replaces the /tick + /state polling loop
+# events: state (every changed tick), junction, finished, sim_error
+@app.route('/stream/<route_id>')
+def stream(route_id):
+    try:
+        with SESSIONS.session(route_id, write=False):
+            pass
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+
+    def events():
+        for event, payload in SCHEDULER.subscribe(route_id):
+            if event == "ping":
+                yield ": ping\n\n"
+            else:
+                yield f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+
 @app.route('/junction_mode', methods=['POST'])
 def junction_mode():
     try:
         route_id = request.json['route_id']
-        sim = get_sim(route_id)
-
         manual = bool(request.json.get('manual', True))
-        sim.stop_at_junctions = manual
-        if not manual and sim.awaiting_junc_choice:
-            sim.awaiting_junc_choice = False
-            sim.junc_options = []
-            sim.resume()
-        return jsonify({"manual": sim.stop_at_junctions})
+        with SESSIONS.session(route_id) as sim:
+            sim.stop_at_junctions = manual
+            if not manual and sim.awaiting_junc_choice:
+                sim.awaiting_junc_choice = False
+                sim.junc_options = []
+                sim.resume()
+        return jsonify({"manual": manual})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -144,14 +295,43 @@ def junction_mode():
 def choose_junction():
     try:
         route_id = request.json['route_id']
-        sim = get_sim(route_id)
-
         next_node = request.json['next_node']
-        sim.choose_junction_node(next_node)
+        with SESSIONS.session(route_id) as sim:
+            sim.choose_junction_node(next_node)
         return jsonify({"message": "reroute successful"})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+# origin x destination travel times, origins/destinations are node ids or [lon, lat] pairs
+# unreachable pairs are null
+@app.route('/matrix', methods=['POST'])
+def travel_time_matrix():
+    try:
+        data = request.json
+        origins = data['origins']
+        destinations = data['destinations']
+        if len(origins) * len(destinations) > MATRIX_MAX_CELLS:
+            return jsonify({"error": f"matrix larger than {MATRIX_MAX_CELLS} cells"}), 400
+
+        region = find_region(data.get('region'), origins + destinations)
+        with GRAPHS.use(region) as entry:
+            origin_nodes, destination_nodes, travel_time, distance = rh.travel_time_matrix(
+                entry.graph, origins, destinations,
+                distances=bool(data.get('distances', False)),
+                snap=data.get('snap', SNAP_MODE),
+                executor=MATRIX_EXECUTOR if region == DEFAULT_REGION else None # workers hold the default region
+            )
+        result = {
+            "origins": origin_nodes,
+            "destinations": destination_nodes,
+            "travel_time": np.where(np.isfinite(travel_time), travel_time, None).tolist()
+        }
+        if distance is not None:
+            result["distance"] = np.where(np.isfinite(distance), distance, None).tolist()
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route('/')
 def index():
     return render_template('index.html', mapbox_token=MAPBOX_TOKEN)
@@ -160,10 +340,69 @@ def index():
 def reset_sim():
     try:
         route_id = request.json['route_id']
-        sims.pop(route_id, None)
+        SCHEDULER.remove(route_id)
+        SESSIONS.delete(route_id)
         return jsonify({"message": "simulation reset"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# reachability polygons (GeoJSON) around an address, [lon, lat] or node id, one per threshold in
+# minutes, all thresholds come from one bounded search and results are cached per (node, thresholds)
+@app.route('/isochrone', methods=['POST'])
+def isochrone():
+    try:
+        data = request.json
+        minutes = data.get('minutes', [5, 10, 15])
+        if not isinstance(minutes, list):
+            minutes = [minutes]
+        thresholds = sorted({round(float(m) * 60) for m in minutes}) # seconds
+        if not thresholds or thresholds[0] <= 0 or thresholds[-1] > ISOCHRONE_MAX_MINUTES * 60:
+            return jsonify({"error": f"minutes must be in (0, {ISOCHRONE_MAX_MINUTES:g}]"}), 400
+        if len(thresholds) > ISOCHRONE_MAX_THRESHOLDS:
+            return jsonify({"error": f"at most {ISOCHRONE_MAX_THRESHOLDS} thresholds"}), 400
+
+        origin = GEOCODER.geocode(data['address']) if 'address' in data else data['origin']
+        region = find_region(data.get('region'), [origin])
+        with GRAPHS.use(region) as entry:
+            node = origin
+            if isinstance(origin, (list, tuple)):
+                node = rh.coords_to_node(entry.graph, origin, snap=data.get('snap', SNAP_MODE))
+            results = iso.get_isochrones(entry.graph, node, thresholds)
+        result = iso.isochrones_geojson(results)
+        result["origin"] = node
+        result["region"] = region
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+# graphs known to the registry, their bounding boxes and whether they are loaded
+@app.route('/regions')
+def regions():
+    return jsonify({"default": DEFAULT_REGION, "regions": GRAPHS.stats()})
+
+@app.route('/metrics')
+def get_metrics():
+    if not admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+# GET returns folded stacks (?limit=N), POST {"enabled": bool, "reset": bool} toggles sampling
+@app.route('/profiler', methods=['GET', 'POST'])
+def profiler():
+    if not admin_allowed():
+        return jsonify({"error": "forbidden"}), 403
+    if request.method == 'GET':
+        limit = request.args.get('limit', type=int)
+        return Response(PROFILER.folded(limit), mimetype="text/plain")
+    data = request.json or {}
+    if data.get('reset'):
+        PROFILER.reset()
+    if 'enabled' in data:
+        if data['enabled']:
+            PROFILER.start()
+        else:
+            PROFILER.stop()
+    return jsonify({"enabled": PROFILER.running(), "samples": PROFILER.samples, "interval": PROFILER.interval})
+
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    app.run(threaded=True)
\ No newline at end of file
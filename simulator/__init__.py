@@ -1,5 +1,7 @@
 from .driving_simulator import DrivingSimulator
+from .fleet_simulator import FleetSimulator
 from .route_handler import calculate_route, load_graph_from_file
+from .compiled_graph import CompiledGraph, compile_graph, get_compiled_graph
 from .geo_utils import (
     get_node_coords,
     get_edge_geometry_coords,
@@ -0,0 +1,220 @@
+from functools import cached_property
+from collections import OrderedDict
+import weakref
+import numpy as np
+import scipy.sparse as sp
+from simulator import geo_utils as gu
+
+LIST_ITEM_BYTES = 32 # pointer + boxed float/int of the plain list copies (memory estimates)
+
+# array-backed view of a road graph for routing
+# node ids are mapped to contiguous ints and edges are stored in CSR form
+# (offsets[i]:offsets[i + 1] slices targets/travel_time for node i)
+# optional edge attributes: length, interned street names and packed geometries
+# (geometry_offsets[e]:geometry_offsets[e + 1] slices geometry_coords for edge e)
+class CompiledGraph:
+    def __init__(self, node_ids, lon, lat, offsets, targets, travel_time,
+                 length=None, name_ids=None, names=None, geometry_offsets=None, geometry_coords=None):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.travel_time = np.asarray(travel_time, dtype=np.float64)
+
+        self.length = None if length is None else np.asarray(length, dtype=np.float64)
+        self.name_ids = None if name_ids is None else np.asarray(name_ids, dtype=np.int32)
+        self.names = names # list of street names, name_ids index into it (-1 = unnamed)
+        self.geometry_offsets = None if geometry_offsets is None else np.asarray(geometry_offsets, dtype=np.int64)
+        self.geometry_coords = None if geometry_coords is None else np.asarray(geometry_coords, dtype=np.float64)
+
+        # sorted view of node ids for id -> index lookups
+        self._id_order = np.argsort(self.node_ids, kind="stable")
+        self._sorted_ids = self.node_ids[self._id_order]
+
+        self.landmarks = None # LandmarkTable, attached by landmarks.load_landmarks
+        self.ch = None # ContractionHierarchy, attached by contraction.load_ch
+        self.spatial_index = None # SpatialIndex, built by spatial_index.get_spatial_index
+        self.polyline_cache = {} # (u, v) -> gu.EdgePolyline, filled by gu.get_edge_polyline
+        self.junction_cache = {} # node id -> branches, filled by route_handler.get_node_junctions
+        self.route_trees = OrderedDict() # target index -> RouteTree, LRU of route_tree.get_route_tree
+        self.edge_samples = None # isochrone.EdgeSamples, built by isochrone.get_edge_samples
+        self.isochrones = OrderedDict() # (node, thresholds) -> isochrones, LRU of isochrone.get_isochrones
+        self.route_cache = None # route_cache.RouteCache, created by route_cache.get_route_cache
+        self._reverse = None
+
+    # plain list copies, indexing numpy scalars in the search loop is slow
+    # built on first use so memory-mapped graphs stay shared until they route
+    @cached_property
+    def node_id_list(self):
+        return self.node_ids.tolist()
+
+    @cached_property
+    def offset_list(self):
+        return self.offsets.tolist()
+
+    @cached_property
+    def target_list(self):
+        return self.targets.tolist()
+
+    @cached_property
+    def travel_time_list(self):
+        return self.travel_time.tolist()
+
+    @cached_property
+    def lon_rad_list(self):
+        return np.radians(self.lon).tolist()
+
+    @cached_property
+    def lat_rad_list(self):
+        return np.radians(self.lat).tolist()
+
+    @cached_property
+    def cos_lat_list(self):
+        return np.cos(np.radians(self.lat)).tolist()
+
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    def num_edges(self):
+        return len(self.targets)
+
+    def has_edge_attributes(self):
+        return self.geometry_offsets is not None
+
+    # osm node id -> contiguous index
+    def index_of(self, node):
+        i = np.searchsorted(self._sorted_ids, node)
+        if i >= len(self._sorted_ids) or self._sorted_ids[i] != node:
+            raise ValueError(f"node not in graph: {node}")
+        return int(self._id_order[i])
+
+    def has_node(self, node):
+        i = np.searchsorted(self._sorted_ids, node)
+        return bool(i < len(self._sorted_ids) and self._sorted_ids[i] == node)
+
+    # contiguous index -> osm node id
+    def node_of(self, index):
+        return self.node_id_list[index]
+
+    # return indices of the nodes reachable over one edge
+    def successor_indices(self, index):
+        return self.target_list[self.offset_list[index]:self.offset_list[index + 1]]
+
+    # return edge index of index_1 -> index_2 or None
+    def edge_index(self, index_1, index_2):
+        start = self.offset_list[index_1]
+        row = self.target_list[start:self.offset_list[index_1 + 1]]
+        if index_2 not in row:
+            return None
+        return start + row.index(index_2)
+
+    # osm node id -> (lon, lat)
+    def node_coords(self, node):
+        i = self.index_of(node)
+        return (float(self.lon[i]), float(self.lat[i]))
+
+    # return list[(lon, lat)] of edge e (straight line if no stored geometry)
+    def edge_coords(self, e):
+        if self.geometry_offsets is not None:
+            coords = self.geometry_coords[self.geometry_offsets[e]:self.geometry_offsets[e + 1]]
+            if len(coords) >= 2:
+                return [tuple(c) for c in coords.tolist()]
+        u = int(np.searchsorted(self.offsets, e, side="right")) - 1
+        v = self.target_list[e]
+        return [(float(self.lon[u]), float(self.lat[u])), (float(self.lon[v]), float(self.lat[v]))]
+
+    # return street name of edge e or default
+    def edge_name(self, e, default=None):
+        if self.name_ids is None or self.name_ids[e] < 0:
+            return default
+        return self.names[self.name_ids[e]]
+
+    # return (offsets, sources, travel_time) lists of the transposed graph in CSR form
+    def reverse_adjacency(self):
+        if self._reverse is None:
+            sources = np.repeat(np.arange(self.num_nodes(), dtype=np.int32), np.diff(self.offsets))
+            order = np.argsort(self.targets, kind="stable")
+            counts = np.bincount(self.targets, minlength=self.num_nodes())
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            self._reverse = (offsets.tolist(), sources[order].tolist(), self.travel_time[order].tolist())
+        return self._reverse
+
+    # return travel_time adjacency as a scipy sparse matrix (for csgraph searches)
+    def as_sparse_matrix(self):
+        n = self.num_nodes()
+        return sp.csr_matrix((self.travel_time, self.targets, self.offsets), shape=(n, n))
+
+    # return lower bound distance (meters) from every node to node index
+    def haversine_to(self, index):
+        lon = np.radians(self.lon)
+        lat = np.radians(self.lat)
+        a = (np.sin((lat - lat[index]) * 0.5) ** 2
+             + np.cos(lat) * np.cos(lat[index]) * np.sin((lon - lon[index]) * 0.5) ** 2)
+        return 2 * gu.EARTH_RADIUS_MIN_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# of parallel edges u -> v (networkx key -> attributes) the one routing takes, the fastest
+def fastest_edge(edges):
+    return min(edges.values(), key=lambda d: d.get('travel_time', float('inf')))
+
+# build compiled view from an osmnx MultiDiGraph
+# parallel edges collapse to the fastest one (fastest_edge), its travel_time, length, name and
+# geometry describe the edge; edge_attributes=False keeps only the routing columns (travel_time, length)
+def compile_graph(graph, edge_attributes=False):
+    node_ids = list(graph.nodes)
+    node_index = {n: i for i, n in enumerate(node_ids)}
+    lon = [graph.nodes[n]['x'] for n in node_ids]
+    lat = [graph.nodes[n]['y'] for n in node_ids]
+
+    offsets = [0]
+    targets = []
+    travel_time = []
+    length = []
+    name_ids = []
+    names = []
+    name_index = {}
+    geometry_offsets = [0]
+    geometry_coords = []
+    for u in node_ids:
+        for v, edges in graph.adj[u].items():
+            targets.append(node_index[v])
+            edge = fastest_edge(edges)
+            travel_time.append(edge.get('travel_time', float('inf')))
+            length.append(edge.get('length', 0.0))
+            if not edge_attributes:
+                continue
+
+            name = edge.get('name')
+            if name is None:
+                name_ids.append(-1)
+            else:
+                key = tuple(name) if isinstance(name, list) else name
+                if key not in name_index:
+                    name_index[key] = len(names)
+                    names.append(name)
+                name_ids.append(name_index[key])
+            if 'geometry' in edge:
+                geometry_coords.extend(edge['geometry'].coords)
+            geometry_offsets.append(len(geometry_coords))
+        offsets.append(len(targets))
+
+    if not edge_attributes:
+        return CompiledGraph(node_ids, lon, lat, offsets, targets, travel_time, length=length)
+    geometry_coords = np.asarray(geometry_coords, dtype=np.float64).reshape(-1, 2)
+    return CompiledGraph(node_ids, lon, lat, offsets, targets, travel_time,
+                         length=length, name_ids=name_ids, names=names,
+                         geometry_offsets=geometry_offsets, geometry_coords=geometry_coords)
+
+
+_compiled_cache = weakref.WeakKeyDictionary() # graph -> CompiledGraph
+
+# return compiled view of graph (built once per graph object)
+def get_compiled_graph(graph):
+    if isinstance(graph, CompiledGraph):
+        return graph
+    compiled = _compiled_cache.get(graph)
+    if compiled is None:
+        compiled = compile_graph(graph)
+        _compiled_cache[graph] = compiled
+    return compiled
@@ -0,0 +1,260 @@
+from heapq import heappush, heappop
+import os
+import math
+import numpy as np
+from simulator.compiled_graph import get_compiled_graph
+
+# witness searches stop after settling this many nodes or past this many edges from their
+# source; a missed witness only adds a redundant shortcut, so lower limits trade a larger
+# hierarchy for a faster build (queries stay exact)
+WITNESS_SETTLE_LIMIT = 64
+WITNESS_HOP_LIMIT = 8
+# node priorities are only estimates, they are computed with cheaper searches
+PRIORITY_SETTLE_LIMIT = 16
+PRIORITY_HOP_LIMIT = 3
+
+# contraction hierarchy over the travel_time metric
+# up edges go from a node to higher ranked nodes, down edges arrive at a node from higher ranked nodes
+# mid is the contracted node a shortcut bypasses (-1 for original edges)
+class ContractionHierarchy:
+    def __init__(self, node_ids, rank, up_offsets, up_targets, up_weights, up_mids,
+                 down_offsets, down_sources, down_weights, down_mids):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.rank = np.asarray(rank, dtype=np.int32)
+        self.up_offsets = np.asarray(up_offsets, dtype=np.int64)
+        self.up_targets = np.asarray(up_targets, dtype=np.int32)
+        self.up_weights = np.asarray(up_weights, dtype=np.float64)
+        self.up_mids = np.asarray(up_mids, dtype=np.int32)
+        self.down_offsets = np.asarray(down_offsets, dtype=np.int64)
+        self.down_sources = np.asarray(down_sources, dtype=np.int32)
+        self.down_weights = np.asarray(down_weights, dtype=np.float64)
+        self.down_mids = np.asarray(down_mids, dtype=np.int32)
+
+        self._up = (self.up_offsets.tolist(), self.up_targets.tolist(), self.up_weights.tolist())
+        self._down = (self.down_offsets.tolist(), self.down_sources.tolist(), self.down_weights.tolist())
+
+        # (u, v) -> middle node for every shortcut edge u -> v
+        self.shortcut_mid = {}
+        up_sources = np.repeat(np.arange(len(self.rank)), np.diff(self.up_offsets))
+        for u, v, m in zip(up_sources.tolist(), self.up_targets.tolist(), self.up_mids.tolist()):
+            if m >= 0:
+                self.shortcut_mid[(u, v)] = m
+        down_targets = np.repeat(np.arange(len(self.rank)), np.diff(self.down_offsets))
+        for u, v, m in zip(self.down_sources.tolist(), down_targets.tolist(), self.down_mids.tolist()):
+            if m >= 0:
+                self.shortcut_mid[(u, v)] = m
+
+    def num_shortcuts(self):
+        return len(self.shortcut_mid)
+
+    # bidirectional upward dijkstra, returns list of node indices or None
+    def query(self, source, target, stats):
+        stats["expansions"] = 0
+        if source == target:
+            return [source]
+        up_offsets, up_targets, up_weights = self._up
+        down_offsets, down_sources, down_weights = self._down
+
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({}, {})
+        settled = (set(), set())
+        heaps = ([(0.0, source)], [(0.0, target)])
+        adjacency = ((up_offsets, up_targets, up_weights), (down_offsets, down_sources, down_weights))
+        best = math.inf
+        meeting = None
+
+        while heaps[0] or heaps[1]:
+            top_f = heaps[0][0][0] if heaps[0] else math.inf
+            top_r = heaps[1][0][0] if heaps[1] else math.inf
+            if min(top_f, top_r) >= best:
+                break
+            side = 0 if top_f <= top_r else 1
+            other = 1 - side
+            d, u = heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            if u in dist[other] and d + dist[other][u] < best:
+                best = d + dist[other][u]
+                meeting = u
+
+            offsets, heads, weights = adjacency[side]
+            side_dist = dist[side]
+            for e in range(offsets[u], offsets[u + 1]):
+                v = heads[e]
+                dv = d + weights[e]
+                if dv < side_dist.get(v, math.inf):
+                    side_dist[v] = dv
+                    parent[side][v] = u
+                    heappush(heaps[side], (dv, v))
+
+        stats["expansions"] = len(settled[0]) + len(settled[1])
+        if meeting is None:
+            return None
+
+        path = [meeting]
+        current = meeting
+        while current in parent[0]:
+            current = parent[0][current]
+            path.append(current)
+        path.reverse()
+        current = meeting
+        while current in parent[1]:
+            current = parent[1][current]
+            path.append(current)
+        return self.unpack(path)
+
+    # expand shortcut edges of path into original edges
+    def unpack(self, path):
+        route = [path[0]]
+        for i in range(len(path) - 1):
+            stack = [(path[i], path[i + 1])]
+            while stack:
+                u, v = stack.pop()
+                m = self.shortcut_mid.get((u, v))
+                if m is None:
+                    route.append(v)
+                else:
+                    stack.append((m, v))
+                    stack.append((u, m))
+        return route
+
+
+# limited dijkstra from source over remaining graph, skipping node avoid
+# (settles at most settle_limit nodes, doesn't expand nodes hop_limit edges away)
+def _witness_search(out_edges, source, avoid, limit, settle_limit, hop_limit):
+    dist = {source: 0.0}
+    hops = {source: 0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and settled < settle_limit:
+        d, u = heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > limit:
+            break
+        settled += 1
+        if hops[u] >= hop_limit:
+            continue
+        for v, (w, _) in out_edges[u].items():
+            if v == avoid:
+                continue
+            dv = d + w
+            if dv < dist.get(v, math.inf):
+                dist[v] = dv
+                hops[v] = hops[u] + 1
+                heappush(heap, (dv, v))
+    return dist
+
+# return shortcuts [(u, w, weight)] needed to contract node v
+def _find_shortcuts(out_edges, in_edges, v, settle_limit, hop_limit):
+    shortcuts = []
+    for u, (w_in, _) in in_edges[v].items():
+        candidates = {w: w_in + w_out for w, (w_out, _) in out_edges[v].items() if w != u}
+        if not candidates:
+            continue
+        witness = _witness_search(out_edges, u, v, max(candidates.values()), settle_limit, hop_limit)
+        for w, weight in candidates.items():
+            if witness.get(w, math.inf) > weight:
+                shortcuts.append((u, w, weight))
+    return shortcuts
+
+def _priority(out_edges, in_edges, deleted_neighbors, v):
+    shortcuts = _find_shortcuts(out_edges, in_edges, v, PRIORITY_SETTLE_LIMIT, PRIORITY_HOP_LIMIT)
+    return len(shortcuts) - len(out_edges[v]) - len(in_edges[v]) + deleted_neighbors[v]
+
+
+# contract every node of graph in edge-difference order
+def build_ch(graph):
+    cg = get_compiled_graph(graph)
+    n = cg.num_nodes()
+    offsets = cg.offset_list
+    targets = cg.target_list
+    weights = cg.travel_time_list
+
+    out_edges = [dict() for _ in range(n)] # u -> {v: (weight, mid)}
+    in_edges = [dict() for _ in range(n)] # v -> {u: (weight, mid)}
+    for u in range(n):
+        for e in range(offsets[u], offsets[u + 1]):
+            v = targets[e]
+            if u == v or not math.isfinite(weights[e]):
+                continue
+            out_edges[u][v] = (weights[e], -1)
+            in_edges[v][u] = (weights[e], -1)
+
+    deleted_neighbors = [0] * n
+    heap = [(_priority(out_edges, in_edges, deleted_neighbors, v), v) for v in range(n)]
+    heap.sort()
+    rank = [0] * n
+    up = [None] * n
+    down = [None] * n
+
+    next_rank = 0
+    while heap:
+        _, v = heappop(heap)
+        priority = _priority(out_edges, in_edges, deleted_neighbors, v)
+        if heap and priority > heap[0][0]: # lazy update
+            heappush(heap, (priority, v))
+            continue
+
+        for u, w, weight in _find_shortcuts(out_edges, in_edges, v, WITNESS_SETTLE_LIMIT, WITNESS_HOP_LIMIT):
+            if weight < out_edges[u].get(w, (math.inf,))[0]:
+                out_edges[u][w] = (weight, v)
+                in_edges[w][u] = (weight, v)
+
+        rank[v] = next_rank
+        next_rank += 1
+        up[v] = list(out_edges[v].items())
+        down[v] = list(in_edges[v].items())
+        for u in in_edges[v]:
+            del out_edges[u][v]
+            deleted_neighbors[u] += 1
+        for w in out_edges[v]:
+            del in_edges[w][v]
+            deleted_neighbors[w] += 1
+        out_edges[v] = {}
+        in_edges[v] = {}
+
+    up_offsets, up_targets, up_weights, up_mids = _pack(up)
+    down_offsets, down_sources, down_weights, down_mids = _pack(down)
+    return ContractionHierarchy(cg.node_ids, rank, up_offsets, up_targets, up_weights, up_mids,
+                                down_offsets, down_sources, down_weights, down_mids)
+
+# per-node [(neighbor, (weight, mid))] lists -> CSR arrays
+def _pack(adjacency):
+    offsets = [0]
+    heads = []
+    weights = []
+    mids = []
+    for edges in adjacency:
+        for v, (w, m) in edges:
+            heads.append(v)
+            weights.append(w)
+            mids.append(m)
+        offsets.append(len(heads))
+    return offsets, heads, weights, mids
+
+
+# sidecar file stored next to the graph file
+def ch_path(graph_path):
+    return os.path.splitext(graph_path)[0] + ".ch.npz"
+
+def save_ch(ch, path):
+    with open(path, "wb") as f:
+        np.savez(f, node_ids=ch.node_ids, rank=ch.rank,
+                 up_offsets=ch.up_offsets, up_targets=ch.up_targets,
+                 up_weights=ch.up_weights, up_mids=ch.up_mids,
+                 down_offsets=ch.down_offsets, down_sources=ch.down_sources,
+                 down_weights=ch.down_weights, down_mids=ch.down_mids)
+
+# load hierarchy from path and attach it to graph
+def load_ch(graph, path):
+    cg = get_compiled_graph(graph)
+    with np.load(path) as data:
+        ch = ContractionHierarchy(data["node_ids"], data["rank"],
+                                  data["up_offsets"], data["up_targets"], data["up_weights"], data["up_mids"],
+                                  data["down_offsets"], data["down_sources"], data["down_weights"], data["down_mids"])
+    if not np.array_equal(ch.node_ids, cg.node_ids):
+        raise ValueError(f"contraction hierarchy does not match graph: {path}")
+    cg.ch = ch
+    return ch
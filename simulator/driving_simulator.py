@@ -1,11 +1,14 @@
 from simulator import geo_utils as gu
 from simulator import route_handler as rh
-import osmnx as ox
+from simulator import route_cache as rc
+import numpy as np
+import hashlib
 
 class DrivingSimulator:
     def __init__(self):
         self.graph = None
         self.route = None
+        self.region = None # graph registry name of graph, sessions pin it
 
         self.tick_interval = 0.2 
 
@@ -22,13 +25,19 @@ class DrivingSimulator:
         self.geometry_coords = []
         self.segment_index = 0
         self.progress_along_segment = 0 
+        self.edge_polyline = None # gu.EdgePolyline of curr edge
+        self.distance_along_edge = 0.0
 
         self.awaiting_junc_choice = False
         self.junc_options = []
         self.route_changed = False
         self.stop_at_junctions = False
+        self.reroute_mode = "tree" # search mode passed to rh.calculate_route on reroute
 
         self.last_used = 0.0
+        self.tick_owner = None # TickScheduler.owner_id of the scheduler that streams the sim
+        self.last_ticked = 0.0 # time of that scheduler's last tick
+        self.geometry_cache = {} # etag -> route geometry payload, see get_route_geometry
          
     def start(self):
         if self.graph == None or self.route == None:
@@ -49,11 +58,8 @@ class DrivingSimulator:
         self.current_node_index = 0
         self.current_node = self.route[self.current_node_index]
         next_node = self.route[self.current_node_index + 1]
-        self.geometry_coords = gu.get_edge_geometry_coords(self.graph, self.current_node, next_node)
-        self.segment_index = 0
-        self.progress_along_segment = 0
-        self.current_coords = self.geometry_coords[0]
-        self.current_bearing = gu.get_bearing(self.geometry_coords[0], self.geometry_coords[1])
+        self._load_edge(self.current_node, next_node)
+        self.current_bearing = self.edge_polyline.bearings[0]
         self.finished = False
         self.paused = False
 
@@ -71,89 +77,60 @@ class DrivingSimulator:
             raise ValueError("tick and speed must be positive")
 
         distance_to_travel = self.tick_interval * self.current_speed
-        while distance_to_travel > 0: # check if there is a next segment
-            if self.segment_index + 1 >= len(self.geometry_coords):
-                raise IndexError("segment index out of bounds - geometry_coords length")
-
-            segment_start = self.geometry_coords[self.segment_index]
-            segment_end = self.geometry_coords[self.segment_index + 1]
-            segment_length = gu.get_geodesic_distance(segment_start, segment_end)
-            if segment_length == 0:
-                self.segment_index += 1
-                continue
-            remaining_segment_length = segment_length - self.progress_along_segment # calc length left in segment and curr bearing
-            self.current_bearing = ox.bearing.calculate_bearing(segment_start[1], segment_start[0], segment_end[1], segment_end[0])
-
-            if remaining_segment_length > distance_to_travel: # reached segment that can't be fully traveled (reached tick distance)
-                self.progress_along_segment += distance_to_travel
-                self.progress_along_segment = min(self.progress_along_segment, segment_length)
-                self.current_coords = gu.interpolate_position(segment_start, self.progress_along_segment, self.current_bearing)
+        while distance_to_travel > 0:
+            polyline = self.edge_polyline
+            remaining_edge_length = polyline.length - self.distance_along_edge
+            if remaining_edge_length > distance_to_travel: # reached point on edge that can't be passed this tick
+                self.distance_along_edge += distance_to_travel
+                self._set_position_on_edge()
                 break
 
-            else:
-                self.current_coords = segment_end
-                distance_to_travel -= remaining_segment_length
-                self.progress_along_segment = 0
-                self.segment_index += 1
-                if self.segment_index >= len(self.geometry_coords) - 1: # check if at end of curr edge
-                    if self.current_node_index >= len(self.route) - 2:
-                        self.finished = True
-                        self.current_coords = self.geometry_coords[-1]
-                        return
-
-                    self.current_node_index += 1
-                    self.current_node = self.route[self.current_node_index]
-                    if not self.awaiting_junc_choice: # check if at junction
-                        successors = list(self.graph.successors(self.current_node))
-                        if len(successors) >= 2:
-                            options = []
-                            if self.current_node_index > 0:
-                                prev_node = self.route[self.current_node_index - 1]
-                            else:
-                                prev_node = None
-                            for s in successors:
-                                if s == prev_node:
-                                    continue
-                                edge_data = list(self.graph.get_edge_data(self.current_node, s).values())[0]
-                                street = edge_data.get("name", "Unnamed Road")
-                                coords = gu.get_edge_geometry_coords(self.graph, self.current_node, s)
-                                if len(coords) < 2:
-                                    continue
-                                bearing = gu.get_bearing(coords[0], coords[1])
-                                try:
-                                    step_m = 8.0
-                                    hint_coords = gu.interpolate_position(coords[0], step_m, bearing)
-                                except Exception:
-                                    hint_coords = coords[1]
-                                options.append({
-                                    "node_id": s,
-                                    "street": street,
-                                    "bearing": bearing,
-                                    "hint_coords": hint_coords
-                                })
-                            if options:
-                                if self.stop_at_junctions:
-                                    self.awaiting_junc_choice = True
-                                    self.junc_options = options
-                                    self.pause()
-                                    return
-                                else:
-                                    self.awaiting_junc_choice = False
-                                    self.junc_options = []
-
-                    if self.current_node_index + 1 >= len(self.route):
-                        raise IndexError("route ended early. no next node")
-                    
-                    next_node = self.route[self.current_node_index + 1]
-                    self.geometry_coords = gu.get_edge_geometry_coords(self.graph, self.current_node, next_node)
-
-                    if not self.geometry_coords or len(self.geometry_coords) < 2:
-                        raise ValueError("edge geometry must have at least two coords")
-                    
-                    self.segment_index = 0
-                    self.progress_along_segment = 0
-
-                    self.current_coords = self.geometry_coords[0]
+            # travel to end of curr edge
+            distance_to_travel -= remaining_edge_length
+            self.distance_along_edge = polyline.length
+            self.segment_index = len(polyline.coords) - 1
+            self.progress_along_segment = 0
+            self.current_coords = polyline.coords[-1]
+            if remaining_edge_length > 0 and polyline.final_bearing is not None:
+                self.current_bearing = polyline.final_bearing
+
+            if self.current_node_index >= len(self.route) - 2:
+                self.finished = True
+                return
+
+            self.current_node_index += 1
+            self.current_node = self.route[self.current_node_index]
+            if self.current_node_index + 1 >= len(self.route):
+                raise IndexError("route ended early. no next node")
+            self._load_edge(self.current_node, self.route[self.current_node_index + 1])
+
+            if self.stop_at_junctions and not self.awaiting_junc_choice: # check if at junction
+                if self.current_node_index > 0:
+                    prev_node = self.route[self.current_node_index - 1]
+                else:
+                    prev_node = None
+                options = rh.get_junction_options(self.graph, self.current_node, prev_node, self.route[-1])
+                if options:
+                    self.awaiting_junc_choice = True
+                    self.junc_options = options
+                    self.pause()
+                    return
+
+    # set edge node_1 -> node_2 as curr edge and move to its start
+    def _load_edge(self, node_1, node_2):
+        self.edge_polyline = gu.get_edge_polyline(self.graph, node_1, node_2)
+        self.geometry_coords = self.edge_polyline.coords
+        if not self.geometry_coords or len(self.geometry_coords) < 2:
+            raise ValueError("edge geometry must have at least two coords")
+        self.distance_along_edge = 0.0
+        self.segment_index = 0
+        self.progress_along_segment = 0
+        self.current_coords = self.geometry_coords[0]
+
+    # update coords/bearing from distance_along_edge (binary search + linear interpolation)
+    def _set_position_on_edge(self):
+        position = self.edge_polyline.position_at(self.distance_along_edge)
+        self.current_coords, self.current_bearing, self.segment_index, self.progress_along_segment = position
     
      # (m/s)
     def set_speed(self, speed_ms):
@@ -174,7 +151,12 @@ class DrivingSimulator:
         old_speed = self.current_speed
         end_node = self.route[-1]
         if next_node != self.route[self.current_node_index + 1]: # user moves off current route
-            partial_route = rh.calculate_route(self.graph, next_node, end_node)
+            partial_route = rc.cached_route(
+                self.graph, next_node, end_node,
+                lambda: rh.calculate_route(self.graph, next_node, end_node, mode=self.reroute_mode)
+            )
+            if partial_route is None:
+                raise ValueError("no route from chosen node")
             new_route = [self.current_node] + partial_route
             self.load_route(self.graph, new_route)
             self.current_node_index = 0
@@ -184,15 +166,31 @@ class DrivingSimulator:
             self.current_node = self.route[self.current_node_index]
 
         next_edge_node = self.route[self.current_node_index + 1]
-        self.geometry_coords = gu.get_edge_geometry_coords(self.graph, self.current_node, next_edge_node)
-        self.segment_index = 0
-        self.progress_along_segment = 0.0
-        self.current_coords = self.geometry_coords[0]
+        self._load_edge(self.current_node, next_edge_node)
         self.awaiting_junc_choice = False
         self.junc_options = []
         self.set_speed(old_speed)
         self.resume()
 
+    # return (etag, payload) of the current route's geometry, payloads are cached per
+    # (route, encoding, tolerance) and the etag only changes when one of those does
+    def get_route_geometry(self, encoding="coords", tolerance_m=0.0):
+        route = np.asarray(self.route if self.route is not None else [], dtype=np.int64)
+        digest = hashlib.blake2b(route.tobytes(), digest_size=12)
+        digest.update(f"{encoding}:{float(tolerance_m)}".encode())
+        etag = digest.hexdigest()
+
+        payload = self.geometry_cache.get(etag)
+        if payload is None:
+            coords = rh.get_route_geometry(self.graph, self.route)
+            if (not coords) and self.current_coords:
+                coords = [self.current_coords]
+            payload = rh.encode_route_geometry(coords, encoding, tolerance_m)
+            if len(self.geometry_cache) >= 8:
+                self.geometry_cache.clear()
+            self.geometry_cache[etag] = payload
+        return etag, payload
+
     # current status of sim
     def get_state(self):
         return {
@@ -205,6 +203,65 @@ class DrivingSimulator:
             "route_changed": self.route_changed
         }
     
+    # compact picklable snapshot of the sim (route as int array), graph not included
+    def to_state(self):
+        return {
+            "route": None if self.route is None else np.asarray(self.route, dtype=np.int64),
+            "current_node_index": self.current_node_index,
+            "distance_along_edge": self.distance_along_edge,
+            "coords": self.current_coords,
+            "bearing": self.current_bearing,
+            "speed": self.current_speed,
+            "tick_interval": self.tick_interval,
+            "finished": self.finished,
+            "paused": self.paused,
+            "awaiting_junc_choice": self.awaiting_junc_choice,
+            "junc_options": self.junc_options,
+            "route_changed": self.route_changed,
+            "stop_at_junctions": self.stop_at_junctions,
+            "reroute_mode": self.reroute_mode,
+            "region": self.region,
+            "last_used": self.last_used,
+            "tick_owner": self.tick_owner,
+            "last_ticked": self.last_ticked
+        }
+
+    # rebuild a sim on graph from to_state() output
+    @classmethod
+    def from_state(cls, graph, state):
+        sim = cls()
+        sim.tick_interval = state["tick_interval"]
+        sim.current_speed = state["speed"]
+        sim.finished = state["finished"]
+        sim.paused = state["paused"]
+        sim.awaiting_junc_choice = state["awaiting_junc_choice"]
+        sim.junc_options = state["junc_options"]
+        sim.route_changed = state["route_changed"]
+        sim.stop_at_junctions = state["stop_at_junctions"]
+        sim.reroute_mode = state["reroute_mode"]
+        sim.region = state.get("region")
+        sim.last_used = state["last_used"]
+        sim.tick_owner = state.get("tick_owner")
+        sim.last_ticked = state.get("last_ticked", 0.0)
+        if state["route"] is None:
+            return sim
+
+        sim.load_route(graph, state["route"].tolist())
+        sim.current_node_index = state["current_node_index"]
+        sim.current_node = sim.route[sim.current_node_index]
+        if len(sim.route) >= 2:
+            sim._load_edge(sim.current_node, sim.route[sim.current_node_index + 1])
+            sim.distance_along_edge = state["distance_along_edge"]
+            if sim.distance_along_edge >= sim.edge_polyline.length:
+                sim.segment_index = len(sim.geometry_coords) - 1
+            elif sim.distance_along_edge > 0:
+                sim._set_position_on_edge()
+        else:
+            sim.geometry_coords = [state["coords"]]
+        sim.current_coords = state["coords"]
+        sim.current_bearing = state["bearing"]
+        return sim
+
     def reset(self):
         self.graph = None
         self.route = None
@@ -222,6 +279,8 @@ class DrivingSimulator:
         self.geometry_coords = []
         self.segment_index = 0
         self.progress_along_segment = 0
+        self.edge_polyline = None
+        self.distance_along_edge = 0.0
 
         self.awaiting_junc_choice = False
         self.junc_options = []
@@ -0,0 +1,327 @@
+import numpy as np
+from simulator import geo_utils as gu
+from simulator import route_handler as rh
+from simulator.compiled_graph import get_compiled_graph
+
+VERTEX_ARRAYS = ("v_lon", "v_lat", "v_local", "v_cum", "v_bearing")
+MIN_VERTEX_CAPACITY = 1024
+
+# many vehicles advanced together with NumPy
+# every vehicle's route is flattened into one block of vertices (lon, lat, cumulative distance,
+# bearing of the segment starting at the vertex); blocks are stored back to back in global arrays
+# with cumulative distances offset by a per-vehicle base, so one searchsorted positions every vehicle
+# the vertex arrays grow by doubling (only [:vertex_count] is used), blocks replaced by reroutes
+# stay in place until they make up half of the vertices and are compacted away
+class FleetSimulator:
+    def __init__(self, graph, tick_interval=0.2):
+        self.graph = graph
+        self.cg = get_compiled_graph(graph)
+        self.tick_interval = tick_interval
+        self.reroute_mode = "tree" # search mode passed to rh.calculate_route on reroute
+
+        # vertex arrays (all blocks)
+        self.v_lon = np.zeros(0)
+        self.v_lat = np.zeros(0)
+        self.v_local = np.zeros(0) # cumulative distance within the block
+        self.v_cum = np.zeros(0) # v_local + vehicle base
+        self.v_bearing = np.zeros(0)
+        self.vertex_count = 0 # vertices in use, the rest is spare capacity
+        self.garbage_vertices = 0 # vertices of blocks replaced by reroutes
+
+        # per-vehicle arrays
+        self.block_start = np.zeros(0, dtype=np.int64)
+        self.block_end = np.zeros(0, dtype=np.int64)
+        self.base = np.zeros(0)
+        self.total_length = np.zeros(0)
+        self.progress = np.zeros(0) # meters along route
+        self.speed = np.zeros(0) # m/s
+        self.paused = np.zeros(0, dtype=bool)
+        self.finished = np.zeros(0, dtype=bool)
+        self.stop_at_junctions = np.zeros(0, dtype=bool)
+        self.awaiting_junc_choice = np.zeros(0, dtype=bool)
+        self.next_junction = np.zeros(0) # distance of next junction ahead (inf if none)
+        self.lon = np.zeros(0)
+        self.lat = np.zeros(0)
+        self.bearing = np.zeros(0)
+
+        # per-vehicle python state
+        self.routes = []
+        self.node_dist = [] # distance of every route node along route
+        self.junction_dist = [] # distances of route nodes with a choice (indices 1..len-2)
+        self.junction_node = [] # their indices in the route (zero-length edges share distances)
+        self.junction_ptr = [] # index into junction_dist of next junction
+        self.junc_options = []
+        self.route_changed = []
+
+    def num_vehicles(self):
+        return len(self.routes)
+
+    # return (lon, lat, cum, bearing, node_dist, junction_dist, junction_node) of route
+    def _build_block(self, route):
+        if len(route) < 2:
+            lon, lat = gu.get_node_coords(self.graph, route[0])
+            return [lon, lon], [lat, lat], [0.0, 0.0], [0.0, 0.0], np.zeros(1), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        lons = []
+        lats = []
+        cum = []
+        bearings = []
+        node_dist = [0.0]
+        for i in range(len(route) - 1):
+            polyline = gu.get_edge_polyline(self.graph, route[i], route[i + 1])
+            offset = node_dist[-1]
+            for (lon, lat), d in zip(polyline.coords, polyline.cumulative):
+                lons.append(lon)
+                lats.append(lat)
+                cum.append(offset + d)
+            # zero-length segments keep the previous bearing (what DrivingSimulator shows there)
+            for bearing, start, end in zip(polyline.bearings, polyline.cumulative, polyline.cumulative[1:]):
+                bearings.append(bearing if end > start or not bearings else bearings[-1])
+            bearings.append(bearings[-1]) # zero-length jump to the next edge
+            node_dist.append(offset + polyline.length)
+
+        # a node is a junction if it has 2+ successors (rh.get_junction_options is then non-empty)
+        indices = np.fromiter((self.cg.index_of(n) for n in route[1:-1]), dtype=np.int64, count=len(route) - 2)
+        degree = self.cg.offsets[indices + 1] - self.cg.offsets[indices]
+        node_dist = np.asarray(node_dist)
+        junction_node = np.flatnonzero(degree >= 2) + 1
+        return lons, lats, cum, bearings, node_dist, node_dist[junction_node], junction_node
+
+    # make room for count more vertices, doubling the capacity when it runs out
+    def _reserve_vertices(self, count):
+        needed = self.vertex_count + count
+        capacity = len(self.v_cum)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, MIN_VERTEX_CAPACITY)
+        for name in VERTEX_ARRAYS:
+            grown = np.zeros(capacity)
+            grown[:self.vertex_count] = getattr(self, name)[:self.vertex_count]
+            setattr(self, name, grown)
+
+    # append blocks for routes, return their (start, end, base) arrays
+    def _append_blocks(self, blocks):
+        self._reserve_vertices(sum(len(b[0]) for b in blocks))
+        base = (self.v_cum[self.vertex_count - 1] + 1.0) if self.vertex_count else 0.0
+        starts = []
+        ends = []
+        bases = []
+        for lons, lats, cum, bearings, _, _, _ in blocks:
+            start = self.vertex_count
+            end = start + len(lons)
+            self.v_lon[start:end] = lons
+            self.v_lat[start:end] = lats
+            self.v_local[start:end] = cum
+            self.v_cum[start:end] = np.asarray(cum, dtype=np.float64) + base
+            self.v_bearing[start:end] = bearings
+            self.vertex_count = end
+            starts.append(start)
+            ends.append(end)
+            bases.append(base)
+            base += cum[-1] + 1.0 # gap keeps blocks strictly ordered
+        return np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64), np.asarray(bases)
+
+    # add vehicles driving routes, returns their vehicle ids
+    def add_vehicles(self, routes, speed=0.0, stop_at_junctions=False):
+        if not routes:
+            return []
+        for route in routes:
+            if not route:
+                raise ValueError("route missing")
+        blocks = [self._build_block(route) for route in routes]
+        starts, ends, bases = self._append_blocks(blocks)
+        count = len(routes)
+        first_id = self.num_vehicles()
+
+        totals = np.array([b[2][-1] for b in blocks])
+        single = np.array([len(r) < 2 for r in routes])
+        self.block_start = np.concatenate((self.block_start, starts))
+        self.block_end = np.concatenate((self.block_end, ends))
+        self.base = np.concatenate((self.base, bases))
+        self.total_length = np.concatenate((self.total_length, totals))
+        self.progress = np.concatenate((self.progress, np.zeros(count)))
+        self.speed = np.concatenate((self.speed, np.broadcast_to(np.asarray(speed, dtype=np.float64), (count,))))
+        self.paused = np.concatenate((self.paused, np.zeros(count, dtype=bool)))
+        self.finished = np.concatenate((self.finished, single))
+        self.stop_at_junctions = np.concatenate((self.stop_at_junctions, np.full(count, bool(stop_at_junctions))))
+        self.awaiting_junc_choice = np.concatenate((self.awaiting_junc_choice, np.zeros(count, dtype=bool)))
+        next_junction = [b[5][0] if len(b[5]) else np.inf for b in blocks]
+        self.next_junction = np.concatenate((self.next_junction, next_junction))
+        self.lon = np.concatenate((self.lon, np.zeros(count)))
+        self.lat = np.concatenate((self.lat, np.zeros(count)))
+        self.bearing = np.concatenate((self.bearing, np.zeros(count)))
+
+        for route, block in zip(routes, blocks):
+            self.routes.append(list(route))
+            self.node_dist.append(block[4])
+            self.junction_dist.append(block[5])
+            self.junction_node.append(block[6])
+            self.junction_ptr.append(0)
+            self.junc_options.append([])
+            self.route_changed.append(False)
+
+        ids = np.arange(first_id, first_id + count)
+        self._update_positions(ids)
+        return ids.tolist()
+
+    def add_vehicle(self, route, speed=0.0, stop_at_junctions=False):
+        return self.add_vehicles([route], speed, stop_at_junctions)[0]
+
+    # (m/s), vehicles may be an id or array of ids
+    def set_speed(self, vehicles, speed_ms):
+        if np.any(np.asarray(speed_ms) < 0):
+            raise ValueError("speed can't be negative")
+        self.speed[vehicles] = speed_ms
+
+    def pause(self, vehicles):
+        self.paused[vehicles] = True
+
+    def resume(self, vehicles):
+        self.paused[vehicles] = False
+
+    # toggle manual junction choices for vehicles
+    def set_junction_mode(self, vehicles, manual):
+        for v in np.atleast_1d(vehicles).tolist():
+            self.stop_at_junctions[v] = manual
+            if manual:
+                # resync pointer, junctions already reached are behind the vehicle
+                ptr = int(np.searchsorted(self.junction_dist[v], self.progress[v], side="right"))
+                self._set_junction_ptr(v, ptr)
+            elif self.awaiting_junc_choice[v]:
+                self.awaiting_junc_choice[v] = False
+                self.junc_options[v] = []
+                self._set_junction_ptr(v, self.junction_ptr[v] + 1)
+                self.paused[v] = False
+
+    def _set_junction_ptr(self, v, ptr):
+        self.junction_ptr[v] = ptr
+        junctions = self.junction_dist[v]
+        self.next_junction[v] = junctions[ptr] if ptr < len(junctions) else np.inf
+
+    # advance every moving vehicle by one tick
+    def tick(self):
+        if self.tick_interval <= 0:
+            raise ValueError("tick must be positive")
+        moving = ~(self.paused | self.finished)
+        target = self.progress + np.where(moving, self.speed * self.tick_interval, 0.0)
+        progress = target.copy()
+
+        # vehicles stopping at junctions halt on the first junction they reach that offers a
+        # choice, junctions without one are passed and the tick's distance carries on past them
+        stopped = np.zeros(len(progress), dtype=bool)
+        reached = np.flatnonzero(moving & self.stop_at_junctions & (target >= self.next_junction))
+        while len(reached):
+            for v in reached.tolist():
+                node_index = self._junction_node_index(v)
+                route = self.routes[v]
+                options = rh.get_junction_options(self.graph, route[node_index], route[node_index - 1], route[-1])
+                if options:
+                    stopped[v] = True
+                    progress[v] = self.next_junction[v]
+                    self.awaiting_junc_choice[v] = True
+                    self.junc_options[v] = options
+                    self.paused[v] = True
+                else:
+                    self._set_junction_ptr(v, self.junction_ptr[v] + 1)
+            reached = reached[~stopped[reached] & (target[reached] >= self.next_junction[reached])]
+
+        done = moving & ~stopped & (progress >= self.total_length)
+        progress = np.where(done, self.total_length, progress)
+        self.finished |= done
+        self.progress = progress
+        self._update_positions(np.flatnonzero(moving))
+
+    # index in route of the junction vehicle v reaches next (or waits at)
+    def _junction_node_index(self, v):
+        return int(self.junction_node[v][self.junction_ptr[v]])
+
+    # recompute coords/bearing of vehicles from progress (binary search + linear interpolation)
+    def _update_positions(self, vehicles):
+        if len(vehicles) == 0:
+            return
+        g = self.base[vehicles] + self.progress[vehicles]
+        # side="left": a vehicle exactly on a node still faces along the edge it arrived on
+        idx = np.searchsorted(self.v_cum[:self.vertex_count], g, side="left") - 1
+        idx = np.clip(idx, self.block_start[vehicles], self.block_end[vehicles] - 2)
+        segment_length = self.v_cum[idx + 1] - self.v_cum[idx]
+        t = np.where(segment_length > 0, (g - self.v_cum[idx]) / np.where(segment_length > 0, segment_length, 1.0), 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        self.lon[vehicles] = self.v_lon[idx] + (self.v_lon[idx + 1] - self.v_lon[idx]) * t
+        self.lat[vehicles] = self.v_lat[idx] + (self.v_lat[idx + 1] - self.v_lat[idx]) * t
+        self.bearing[vehicles] = self.v_bearing[idx]
+
+    # at junction choose direction to proceed in
+    def choose_junction_node(self, vehicle, next_node):
+        v = vehicle
+        if next_node not in [opt["node_id"] for opt in self.junc_options[v]]:
+            raise ValueError("invalid junc choice")
+        route = self.routes[v]
+        node_index = self._junction_node_index(v)
+        if next_node != route[node_index + 1]: # vehicle moves off current route
+            partial_route = rh.calculate_route(self.graph, next_node, route[-1], mode=self.reroute_mode)
+            if partial_route is None:
+                raise ValueError("no route from chosen node")
+            self._reroute(v, [route[node_index]] + partial_route)
+            self.route_changed[v] = True
+        else:
+            self._set_junction_ptr(v, self.junction_ptr[v] + 1)
+        self.awaiting_junc_choice[v] = False
+        self.junc_options[v] = []
+        self.paused[v] = False
+        self._update_positions(np.array([v]))
+
+    # replace vehicle's route, starting at the beginning of the new route
+    def _reroute(self, v, route):
+        block = self._build_block(route)
+        self.garbage_vertices += int(self.block_end[v] - self.block_start[v])
+        starts, ends, bases = self._append_blocks([block])
+        self.block_start[v] = starts[0]
+        self.block_end[v] = ends[0]
+        self.base[v] = bases[0]
+        self.total_length[v] = block[2][-1]
+        self.progress[v] = 0.0
+        self.routes[v] = list(route)
+        self.node_dist[v] = block[4]
+        self.junction_dist[v] = block[5]
+        self.junction_node[v] = block[6]
+        self._set_junction_ptr(v, 0)
+        if self.garbage_vertices > self.vertex_count // 2:
+            self._compact()
+
+    # drop vertices of replaced blocks, moving the live ones to the front of the arrays
+    def _compact(self):
+        keep = np.concatenate([np.arange(s, e) for s, e in zip(self.block_start.tolist(), self.block_end.tolist())])
+        lengths = self.block_end - self.block_start
+        new_start = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        count = len(keep)
+        for name in ("v_lon", "v_lat", "v_bearing", "v_local"):
+            array = getattr(self, name)
+            array[:count] = array[keep]
+
+        # rebase cumulative distances so blocks stay ordered in their new positions
+        new_base = np.concatenate(([0.0], np.cumsum(self.total_length + 1.0)[:-1]))
+        self.v_cum[:count] = self.v_local[:count] + np.repeat(new_base, lengths)
+        self.vertex_count = count
+        self.block_start = new_start.astype(np.int64)
+        self.block_end = (new_start + lengths).astype(np.int64)
+        self.base = new_base
+        self.garbage_vertices = 0
+
+    # current status of vehicle (same shape as DrivingSimulator.get_state)
+    def get_state(self, vehicle):
+        v = vehicle
+        single = len(self.routes[v]) < 2
+        return {
+            "coords": (float(self.lon[v]), float(self.lat[v])),
+            "bearing": None if single else float(self.bearing[v]),
+            "finished": bool(self.finished[v]),
+            "awaiting_junc_choice": bool(self.awaiting_junc_choice[v]),
+            "junc_options": self.junc_options[v],
+            "paused": bool(self.paused[v]),
+            "route_changed": self.route_changed[v]
+        }
+
+    def get_states(self, vehicles=None):
+        if vehicles is None:
+            vehicles = range(self.num_vehicles())
+        return [self.get_state(v) for v in vehicles]
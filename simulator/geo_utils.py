@@ -1,16 +1,36 @@
 import osmnx as ox
 from geopy.distance import geodesic
+from simulator import compiled_graph as cgm
+from bisect import bisect_right
+import numpy as np
+import math
+
+# smallest radius of curvature of the WGS84 ellipsoid, so haversine never overestimates geodesic
+EARTH_RADIUS_MIN_M = 6335439.0
+EARTH_RADIUS_MEAN_M = 6371008.8
+
+# graph args accept an osmnx MultiDiGraph or a CompiledGraph with edge attributes (graph_store)
 
 # return node's (lon, lat)
 def get_node_coords(graph, node):
+    if isinstance(graph, cgm.CompiledGraph):
+        return graph.node_coords(node)
     lon = graph.nodes[node]['x']
     lat = graph.nodes[node]['y']
     return (lon, lat)
 
+# return compiled edge index of node_1 -> node_2
+def _compiled_edge(graph, node_1, node_2):
+    e = graph.edge_index(graph.index_of(node_1), graph.index_of(node_2))
+    if e is None:
+        raise ValueError(f"no edge between {node_1} and {node_2}")
+    return e
+
 # return list[(lon, lat)] of points in the edge
 def get_edge_geometry_coords(graph, node_1, node_2):
-    edge_data = graph.get_edge_data(node_1, node_2)
-    edge = list(edge_data.values())[0]
+    if isinstance(graph, cgm.CompiledGraph):
+        return graph.edge_coords(_compiled_edge(graph, node_1, node_2))
+    edge = cgm.fastest_edge(graph.get_edge_data(node_1, node_2))
 
     coords = []
     if 'geometry' in edge:
@@ -19,6 +39,57 @@ def get_edge_geometry_coords(graph, node_1, node_2):
         coords = [get_node_coords(graph, node_1), get_node_coords(graph, node_2)]
     return coords
 
+# edge geometry with cumulative segment distances (meters) and segment bearings
+# precomputed once so positions along the edge need no geodesic solves
+class EdgePolyline:
+    __slots__ = ("coords", "cumulative", "bearings", "length", "final_bearing")
+
+    def __init__(self, coords):
+        self.coords = coords
+        self.cumulative = [0.0]
+        self.bearings = []
+        self.final_bearing = None # bearing of the last non zero-length segment
+        for i in range(len(coords) - 1):
+            segment_length = get_geodesic_distance(coords[i], coords[i + 1])
+            self.cumulative.append(self.cumulative[-1] + segment_length)
+            bearing = get_bearing(coords[i], coords[i + 1])
+            self.bearings.append(bearing)
+            if segment_length > 0:
+                self.final_bearing = bearing
+        self.length = self.cumulative[-1]
+
+    # return (coords, bearing, segment_index, progress_along_segment) at distance along the edge
+    def position_at(self, distance):
+        i = min(bisect_right(self.cumulative, distance) - 1, len(self.coords) - 2)
+        i = max(i, 0)
+        progress = distance - self.cumulative[i]
+        segment_length = self.cumulative[i + 1] - self.cumulative[i]
+        (start_lon, start_lat), (end_lon, end_lat) = self.coords[i], self.coords[i + 1]
+        t = progress / segment_length if segment_length > 0 else 0.0
+        coords = (start_lon + (end_lon - start_lon) * t, start_lat + (end_lat - start_lat) * t)
+        return coords, self.bearings[i], i, progress
+
+# return EdgePolyline of the edge (memoized per graph)
+def get_edge_polyline(graph, node_1, node_2):
+    cache = cgm.get_compiled_graph(graph).polyline_cache
+    polyline = cache.get((node_1, node_2))
+    if polyline is None:
+        polyline = EdgePolyline(get_edge_geometry_coords(graph, node_1, node_2))
+        cache[(node_1, node_2)] = polyline
+    return polyline
+
+# return street name of the edge
+def get_edge_name(graph, node_1, node_2, default="Unnamed Road"):
+    if isinstance(graph, cgm.CompiledGraph):
+        return graph.edge_name(_compiled_edge(graph, node_1, node_2), default)
+    return cgm.fastest_edge(graph.get_edge_data(node_1, node_2)).get("name", default)
+
+# return list of nodes reachable from node over one edge
+def get_successors(graph, node):
+    if isinstance(graph, cgm.CompiledGraph):
+        return [graph.node_of(i) for i in graph.successor_indices(graph.index_of(node))]
+    return list(graph.successors(node))
+
 # return bearing between two points
 def get_bearing(start_coords, end_coords): # (lon, lat)
     start_lon = start_coords[0]
@@ -33,16 +104,74 @@ def get_geodesic_distance(*args):
         (start_lon, start_lat), (end_lon, end_lat) = args
     elif len(args) == 3:
         graph, node_1, node_2 = args
-        start_lon = graph.nodes[node_1]['x']
-        start_lat = graph.nodes[node_1]['y']
-        end_lon = graph.nodes[node_2]['x']
-        end_lat = graph.nodes[node_2]['y']
+        start_lon, start_lat = get_node_coords(graph, node_1)
+        end_lon, end_lat = get_node_coords(graph, node_2)
     else:
         raise ValueError("invalid geodesic distance args")
     return geodesic((start_lat, start_lon), (end_lat, end_lon)).meters
 
+# return lower bound on geodesic distance between two coordinates (lon, lat)
+def get_haversine_distance(start_coords, end_coords):
+    start_lon, start_lat = map(math.radians, start_coords)
+    end_lon, end_lat = map(math.radians, end_coords)
+    a = (math.sin((end_lat - start_lat) * 0.5) ** 2
+         + math.cos(start_lat) * math.cos(end_lat) * math.sin((end_lon - start_lon) * 0.5) ** 2)
+    return 2 * EARTH_RADIUS_MIN_M * math.asin(math.sqrt(min(a, 1.0)))
+
 # params: (lon, lat), meters
 def interpolate_position(coords, dist, bear):
     interp_point = geodesic(meters=dist).destination((coords[1], coords[0]), bearing=bear)
     interp_coords = (interp_point.longitude, interp_point.latitude)
-    return interp_coords
\ No newline at end of file
+    return interp_coords
+
+# Douglas-Peucker simplification of [(lon, lat), ...], keeps points deviating more than
+# tolerance meters from the simplified line (local equirectangular projection)
+def simplify_coords(coords, tolerance_m):
+    if tolerance_m <= 0 or len(coords) < 3:
+        return list(coords)
+    points = np.asarray(coords, dtype=np.float64)
+    scale = math.radians(EARTH_RADIUS_MEAN_M)
+    x = points[:, 0] * scale * math.cos(math.radians(points[:, 1].mean()))
+    y = points[:, 1] * scale
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        seg_len_sq = dx * dx + dy * dy
+        if seg_len_sq > 0: # distance to the segment (not the infinite line)
+            t = np.clip((px * dx + py * dy) / seg_len_sq, 0.0, 1.0)
+            dist_sq = (px - t * dx) ** 2 + (py - t * dy) ** 2
+        else:
+            dist_sq = px * px + py * py
+        i = int(np.argmax(dist_sq))
+        if dist_sq[i] > tolerance_m * tolerance_m:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return [tuple(c) for c in points[keep].tolist()]
+
+# encoded polyline string of [(lon, lat), ...] (Google polyline algorithm, lat first)
+def encode_polyline(coords, precision=5):
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lon = 0
+    for lon, lat in coords:
+        lat = int(round(lat * factor))
+        lon = int(round(lon * factor))
+        for value in (lat - prev_lat, lon - prev_lon):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return "".join(output)
@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from urllib.parse import quote_plus
+from requests.adapters import HTTPAdapter
+from simulator import metrics
+import requests
+import threading
+import json
+import time
+import re
+
+GEOCODE_CACHE = metrics.counter("geocode_cache_lookups_total", "Geocoder cache lookups by result (hit, miss)", ("result",))
+GEOCODE_BACKEND_SECONDS = metrics.histogram("geocode_backend_seconds", "Duration of geocoder backend calls (one batch of addresses)")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# shared thread pool for concurrent lookups
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="geocode")
+    return _executor
+
+# cache key for an address ("  123 Main St.,  NY " -> "123 main st, ny")
+def normalize_address(address):
+    address = re.sub(r"\s+", " ", address.strip().lower())
+    address = re.sub(r"\s*,\s*", ", ", address)
+    return address.replace(".", "").strip(" ,")
+
+
+# geocoder backend interface, geocode returns (lon, lat) or raises ValueError if not found
+class Geocoder:
+    def geocode(self, address):
+        raise NotImplementedError
+
+    # geocode several addresses concurrently, results keep input order
+    def geocode_many(self, addresses):
+        if len(addresses) <= 1:
+            return [self.geocode(a) for a in addresses]
+        return list(_get_executor().map(self.geocode, addresses))
+
+
+# Mapbox places API over a pooled keep-alive session
+class MapboxGeocoder(Geocoder):
+    def __init__(self, token, timeout=10, pool_size=8):
+        self.token = token
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def geocode(self, address):
+        qp_address = quote_plus(address)
+        url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{qp_address}.json"
+        params = {
+            "access_token": self.token,
+            "limit": 1
+        }
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if not data["features"]:
+            raise ValueError(f"Address not found: {address}")
+        return tuple(data["features"][0]["center"])
+
+
+# offline geocoder backed by a dict of address -> (lon, lat)
+class DictGeocoder(Geocoder):
+    def __init__(self, entries):
+        self.entries = {normalize_address(a): tuple(c) for a, c in entries.items()}
+
+    # load {"address": [lon, lat], ...} from a json file
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def geocode(self, address):
+        coords = self.entries.get(normalize_address(address))
+        if coords is None:
+            raise ValueError(f"Address not found: {address}")
+        return coords
+
+    # lookups are local, no need for threads
+    def geocode_many(self, addresses):
+        return [self.geocode(a) for a in addresses]
+
+
+# bounded LRU + TTL cache in front of another geocoder, keyed on normalized address
+class CachedGeocoder(Geocoder):
+    def __init__(self, backend, max_entries=4096, ttl_seconds=86400):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict() # key -> (coords, expires_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                GEOCODE_CACHE.inc("hit")
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            GEOCODE_CACHE.inc("miss")
+            return None
+
+    def _put(self, key, coords):
+        with self.lock:
+            self.entries[key] = (coords, time.time() + self.ttl_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def geocode(self, address):
+        return self.geocode_many([address])[0]
+
+    # cached addresses are answered directly, the rest go to the backend concurrently
+    def geocode_many(self, addresses):
+        keys = [normalize_address(a) for a in addresses]
+        results = [self._get(k) for k in keys]
+
+        missing = {}
+        for address, key, coords in zip(addresses, keys, results):
+            if coords is None and key not in missing:
+                missing[key] = address
+        if missing:
+            with GEOCODE_BACKEND_SECONDS.time():
+                fetched = dict(zip(missing, self.backend.geocode_many(list(missing.values()))))
+            for key, coords in fetched.items():
+                self._put(key, coords)
+            results = [coords if coords is not None else fetched[key] for key, coords in zip(keys, results)]
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
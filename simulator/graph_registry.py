@@ -0,0 +1,253 @@
+from contextlib import contextmanager
+import subprocess
+import threading
+import json
+import time
+import os
+import numpy as np
+from simulator.compiled_graph import CompiledGraph, get_compiled_graph, LIST_ITEM_BYTES
+from simulator.spatial_index import get_spatial_index
+from simulator import route_handler as rh
+from simulator import landmarks as lm
+from simulator import contraction as ch
+from simulator import graph_store as gs
+from simulator import route_tree as rt
+from simulator import metrics
+
+META_SUFFIX = ".meta.json" # bbox sidecar of a pickled graph (graph stores keep it in meta.json)
+BBOX_MARGIN_DEG = 0.002 # ~200 m, addresses just off the edge of a network still belong to it
+NETWORKX_EDGE_BYTES = 1600 # heap used by an unpickled osmnx graph per edge (Manhattan: 15 MB / 9896 edges)
+
+GRAPH_LOADS = metrics.counter("graph_loads_total", "Graphs loaded by the registry", ("region",))
+GRAPH_EVICTIONS = metrics.counter("graph_evictions_total", "Graphs dropped by the registry to stay under its memory budget", ("region",))
+
+def meta_path(graph_path):
+    return os.path.splitext(graph_path)[0] + META_SUFFIX
+
+# {"bbox": [min_lon, min_lat, max_lon, max_lat], "num_nodes", "num_edges"} of a graph file
+# pickles are loaded once to compute it, the result is cached in a sidecar next to the file
+def graph_meta(path):
+    if gs.is_graph_store(path):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            return json.load(f)
+
+    sidecar = meta_path(path)
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+        with open(sidecar, "r") as f:
+            return json.load(f)
+    cg = get_compiled_graph(gs.load_graph(path))
+    meta = {
+        "num_nodes": cg.num_nodes(),
+        "num_edges": cg.num_edges(),
+        "bbox": [float(cg.lon.min()), float(cg.lat.min()), float(cg.lon.max()), float(cg.lat.max())]
+    }
+    try:
+        with open(sidecar, "w") as f:
+            json.dump(meta, f)
+    except OSError: # read-only graphs directory, computed again next start
+        pass
+    return meta
+
+# load a graph with its routing arrays, spatial index and optional landmark/CH sidecars
+# returns (graph, fastest available route mode)
+def load_region_graph(path, compact=False):
+    graph = gs.load_graph(path, compact=compact)
+    get_compiled_graph(graph)
+    get_spatial_index(graph)
+    route_mode = rh.DEFAULT_ROUTE_MODE
+    if os.path.exists(lm.landmarks_path(path)):
+        lm.load_landmarks(graph, lm.landmarks_path(path))
+        route_mode = "alt"
+    if os.path.exists(ch.ch_path(path)):
+        ch.load_ch(graph, ch.ch_path(path))
+        route_mode = "ch"
+    return graph, route_mode
+
+def _object_bytes(obj):
+    total = 0
+    for value in vars(obj).values():
+        if isinstance(value, np.ndarray):
+            total += value.nbytes
+        elif isinstance(value, list):
+            total += len(value) * LIST_ITEM_BYTES
+    return total
+
+# rough resident size of a loaded graph: numpy arrays and list copies of the compiled graph and
+# its index/landmark/CH tables, cached route trees and isochrone samples, plus the networkx graph
+# itself if it was unpickled; the caches grow after loading, so it's estimated again when the
+# registry checks its budget
+def estimate_graph_bytes(graph):
+    cg = get_compiled_graph(graph)
+    total = _object_bytes(cg) + rt.route_tree_bytes(cg)
+    for name in ("spatial_index", "landmarks", "ch", "edge_samples"):
+        part = getattr(cg, name, None)
+        if part is not None:
+            total += _object_bytes(part)
+    if not isinstance(graph, CompiledGraph):
+        total += graph.number_of_edges() * NETWORKX_EDGE_BYTES
+    return total
+
+
+# one graph file known to the registry, graph is None until it's loaded
+class GraphEntry:
+    def __init__(self, name, path, meta):
+        self.name = name
+        self.path = path
+        self.bbox = meta["bbox"]
+        self.num_nodes = meta.get("num_nodes")
+        self.num_edges = meta.get("num_edges")
+        self.graph = None
+        self.route_mode = rh.DEFAULT_ROUTE_MODE
+        self.memory_bytes = 0
+        self.pins = 0 # sessions (and requests) using the graph, pinned graphs are never evicted
+        self.last_used = 0.0
+        self.load_lock = threading.Lock()
+
+    def contains(self, lon, lat, margin=BBOX_MARGIN_DEG):
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return min_lon - margin <= lon <= max_lon + margin and min_lat - margin <= lat <= max_lat + margin
+
+    def area(self):
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return (max_lon - min_lon) * (max_lat - min_lat)
+
+
+# region name -> graph file, graphs are loaded on first use and the least recently used unpinned
+# ones are dropped while the loaded graphs' estimated size is over memory_budget (bytes, 0 = no limit)
+# pickled graphs are served from their compact graph store (gs.ensure_graph_store) unless compact=False
+class GraphRegistry:
+    def __init__(self, memory_budget=0, compact=True):
+        self.memory_budget = memory_budget
+        self.compact = compact
+        self.entries = {} # name -> GraphEntry
+        self.paths = {} # realpath -> name
+        self.lock = threading.RLock()
+
+    # add a graph file (.pkl or graph store directory), returns its region name (file name
+    # without extension), a name or path that is already registered is kept
+    def register(self, path, name=None):
+        name = name or os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        real_path = os.path.realpath(path)
+        with self.lock:
+            if real_path in self.paths:
+                return self.paths[real_path]
+            if name in self.entries:
+                return name
+        if self.compact and not gs.is_graph_store(path):
+            try:
+                path = gs.ensure_graph_store(path)
+            except (OSError, subprocess.CalledProcessError): # read-only directory, compacted on load
+                pass
+        entry = GraphEntry(name, path, graph_meta(path))
+        with self.lock:
+            self.entries.setdefault(name, entry)
+            self.paths[real_path] = name
+        return name
+
+    # register every graph in directory, a graph store is preferred over the pickle it was exported from
+    def scan(self, directory):
+        paths = {}
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            base, ext = os.path.splitext(filename)
+            if ext == gs.STORE_SUFFIX and gs.is_graph_store(path):
+                paths[base] = path
+            elif ext == ".pkl":
+                paths.setdefault(base, path)
+        return [self.register(path, name) for name, path in paths.items()]
+
+    def _entry(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            raise ValueError(f"unknown region: {name}")
+        return entry
+
+    # smallest region whose bounding box contains all (lon, lat) coords, ValueError if there's none
+    def locate(self, coords):
+        with self.lock:
+            candidates = [e for e in self.entries.values() if all(e.contains(lon, lat) for lon, lat in coords)]
+        if not candidates:
+            raise ValueError("no graph covers these coordinates")
+        return min(candidates, key=GraphEntry.area).name
+
+    def _load(self, entry):
+        with entry.load_lock:
+            if entry.graph is not None:
+                return
+            graph, route_mode = load_region_graph(entry.path, self.compact)
+            memory_bytes = estimate_graph_bytes(graph)
+            with self.lock:
+                entry.graph = graph
+                entry.route_mode = route_mode
+                entry.memory_bytes = memory_bytes
+            GRAPH_LOADS.inc(entry.name)
+
+    def _refresh_memory(self, entries):
+        for entry in entries:
+            entry.memory_bytes = estimate_graph_bytes(entry.graph)
+
+    # drop least recently used unpinned graphs until the budget is met (or only pinned ones are left)
+    def _evict(self):
+        if not self.memory_budget:
+            return
+        with self.lock:
+            loaded = sorted((e for e in self.entries.values() if e.graph is not None), key=lambda e: e.last_used)
+            self._refresh_memory(loaded)
+            used = sum(e.memory_bytes for e in loaded)
+            for entry in loaded:
+                if used <= self.memory_budget:
+                    break
+                if entry.pins > 0:
+                    continue
+                entry.graph = None
+                used -= entry.memory_bytes
+                GRAPH_EVICTIONS.inc(entry.name)
+
+    # load (if needed) and pin region, returns its graph
+    def pin(self, name):
+        entry = self._entry(name)
+        with self.lock:
+            entry.pins += 1
+            entry.last_used = time.time()
+        try:
+            self._load(entry)
+        except BaseException:
+            self.unpin(name)
+            raise
+        self._evict()
+        return entry.graph
+
+    def unpin(self, name):
+        entry = self._entry(name)
+        with self.lock:
+            entry.pins -= 1
+            entry.last_used = time.time()
+        self._evict()
+
+    # pin region for the duration of the block, yields its (loaded) GraphEntry
+    @contextmanager
+    def use(self, name):
+        self.pin(name)
+        try:
+            yield self.entries[name]
+        finally:
+            self.unpin(name)
+
+    def memory_used(self):
+        with self.lock:
+            loaded = [e for e in self.entries.values() if e.graph is not None]
+            self._refresh_memory(loaded)
+            return sum(e.memory_bytes for e in loaded)
+
+    def stats(self):
+        with self.lock:
+            self._refresh_memory([e for e in self.entries.values() if e.graph is not None])
+            return [{
+                "region": e.name,
+                "bbox": e.bbox,
+                "nodes": e.num_nodes,
+                "edges": e.num_edges,
+                "loaded": e.graph is not None,
+                "pins": e.pins,
+                "memory_bytes": e.memory_bytes if e.graph is not None else 0
+            } for e in self.entries.values()]
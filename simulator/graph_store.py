@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import shutil
+import pickle
+import subprocess
+import numpy as np
+from simulator.compiled_graph import CompiledGraph, compile_graph
+
+STORE_FORMAT_VERSION = 2 # 2: length/name/geometry of the fastest parallel edge
+STORE_SUFFIX = ".graph"
+
+# array name -> dtype of the .npy files in a graph store directory
+STORE_ARRAYS = {
+    "node_ids": np.int64,
+    "lon": np.float64,
+    "lat": np.float64,
+    "offsets": np.int64,
+    "targets": np.int32,
+    "travel_time": np.float64,
+    "length": np.float64,
+    "name_ids": np.int32,
+    "geometry_offsets": np.int64,
+    "geometry_coords": np.float64
+}
+
+# graph store directory stored next to the graph file (graphs/X.pkl -> graphs/X.graph)
+def store_path(graph_path):
+    return os.path.splitext(graph_path)[0] + STORE_SUFFIX
+
+def is_graph_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "meta.json"))
+
+
+# write graph as flat .npy arrays + json string table into directory
+def export_graph(graph, directory):
+    if not isinstance(graph, CompiledGraph) or not graph.has_edge_attributes():
+        graph = compile_graph(graph, edge_attributes=True)
+    os.makedirs(directory, exist_ok=True)
+
+    for name, dtype in STORE_ARRAYS.items():
+        np.save(os.path.join(directory, name + ".npy"), np.ascontiguousarray(getattr(graph, name), dtype=dtype))
+    with open(os.path.join(directory, "names.json"), "w") as f:
+        json.dump(graph.names, f)
+
+    meta = {
+        "format_version": STORE_FORMAT_VERSION,
+        "num_nodes": graph.num_nodes(),
+        "num_edges": graph.num_edges(),
+        "bbox": [float(graph.lon.min()), float(graph.lat.min()), float(graph.lon.max()), float(graph.lat.max())]
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return graph
+
+
+# memory-map a graph store read-only, pages are shared between processes by the OS
+def load_graph_store(directory):
+    with open(os.path.join(directory, "meta.json"), "r") as f:
+        meta = json.load(f)
+    if meta.get("format_version") != STORE_FORMAT_VERSION:
+        raise ValueError(f"unsupported graph store version: {meta.get('format_version')}")
+
+    arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in STORE_ARRAYS}
+    with open(os.path.join(directory, "names.json"), "r") as f:
+        names = json.load(f)
+    return CompiledGraph(names=names, **arrays)
+
+# compiled graph with the columns the simulator reads (travel time, length, interned street
+# names, packed geometries, node lon/lat), every other OSM attribute is dropped together with
+# the networkx graph's per-edge dicts and shapely geometries
+def compact_graph(graph):
+    if isinstance(graph, CompiledGraph) and graph.has_edge_attributes():
+        return graph
+    return compile_graph(graph, edge_attributes=True)
+
+# export the pickled graph at graph_path to its store directory, written next to it and swapped
+# in with renames so processes that have the old store mapped keep reading intact files
+def export_pickle(graph_path):
+    directory = store_path(graph_path)
+    tmp_directory = f"{directory}.tmp-{os.getpid()}"
+    with open(graph_path, "rb") as f:
+        export_graph(pickle.load(f), tmp_directory)
+    old_directory = f"{directory}.old-{os.getpid()}"
+    if os.path.exists(directory):
+        os.rename(directory, old_directory)
+    os.rename(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    return directory
+
+# graph store of a pickled graph, exported once (and again when the pickle is newer or the
+# store was written by another format version)
+# the export unpickles in a child process: the heap of a networkx graph isn't returned to the
+# OS after it is freed, so a process that unpickles it stays that large
+def ensure_graph_store(graph_path):
+    directory = store_path(graph_path)
+    if is_graph_store(directory) and os.path.getmtime(os.path.join(directory, "meta.json")) >= os.path.getmtime(graph_path):
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            if json.load(f).get("format_version") == STORE_FORMAT_VERSION:
+                return directory
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(
+        [sys.executable, "-c", "import sys; from simulator import graph_store as gs; gs.export_pickle(sys.argv[1])", os.path.abspath(graph_path)],
+        cwd=package_root, check=True
+    )
+    return directory
+
+# load path as a graph store directory (memory-mapped) or a pickled osmnx graph
+# compact=True loads a pickle through its graph store (ensure_graph_store), or compacts it in
+# this process if the store can't be written
+def load_graph(path, compact=False):
+    if is_graph_store(path):
+        return load_graph_store(path)
+    if compact:
+        try:
+            return load_graph_store(ensure_graph_store(path))
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    with open(path, "rb") as f:
+        graph = pickle.load(f)
+    return compact_graph(graph) if compact else graph
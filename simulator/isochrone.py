@@ -0,0 +1,233 @@
+import threading
+import numpy as np
+import shapely
+from scipy import ndimage
+from simulator.compiled_graph import get_compiled_graph
+from simulator import route_handler as rh
+from simulator import geo_utils as gu
+from simulator import metrics
+
+CELL_M = 25.0 # raster cell size
+SAMPLE_STEP_M = 12.0 # spacing of the points sampled along every edge (< CELL_M, no gaps)
+BUFFER_CELLS = 2 # road buffer in cells (~50 m)
+MIN_HOLE_CELLS = 32 # smaller holes (e.g. the middle of a block) are filled
+ISOCHRONE_CACHE_SIZE = 128 # (node, thresholds) results kept per graph
+_cache_lock = threading.Lock()
+
+ISOCHRONE_SECONDS = metrics.histogram("isochrone_seconds", "Search and polygon building time of uncached isochrone requests")
+ISOCHRONE_CACHE = metrics.counter("isochrone_cache_lookups_total", "Isochrone cache lookups by result (hit, miss)", ("result",))
+
+# points every SAMPLE_STEP_M along every edge, in meters on an equirectangular projection of the
+# graph's bounding box: edge index, fraction of the edge and x/y of every sample
+class EdgeSamples:
+    def __init__(self, origin, scale, edge, fraction, x, y):
+        self.origin = origin # (lon, lat) at x = y = 0
+        self.scale = scale # (meters per degree lon, meters per degree lat)
+        self.edge = edge
+        self.fraction = fraction
+        self.x = x
+        self.y = y
+
+    def to_lonlat(self, xy):
+        return xy / np.asarray(self.scale) + np.asarray(self.origin)
+
+def build_edge_samples(graph):
+    cg = get_compiled_graph(graph)
+    lon0, lat0 = float(cg.lon.min()), float(cg.lat.min())
+    mid_lat = np.radians((cg.lat.min() + cg.lat.max()) / 2)
+    ky = gu.EARTH_RADIUS_MEAN_M * np.pi / 180
+    kx = ky * np.cos(mid_lat)
+
+    # every edge as a polyline of its geometry (or its end nodes), edges laid end to end on one
+    # distance axis with a 1 m gap between them so samples never interpolate across edges
+    vertex_edge = []
+    vertex_coords = []
+    for e in range(cg.num_edges()):
+        coords = cg.edge_coords(e)
+        vertex_edge.append(np.full(len(coords), e))
+        vertex_coords.append(coords)
+    vertex_edge = np.concatenate(vertex_edge)
+    vertex_coords = np.concatenate([np.asarray(c, dtype=np.float64) for c in vertex_coords])
+    x = (vertex_coords[:, 0] - lon0) * kx
+    y = (vertex_coords[:, 1] - lat0) * ky
+
+    step = np.hypot(np.diff(x), np.diff(y))
+    step[vertex_edge[1:] != vertex_edge[:-1]] = 1.0 # gap between consecutive edges
+    distance = np.concatenate(([0.0], np.cumsum(step)))
+    first = np.concatenate(([0], np.nonzero(vertex_edge[1:] != vertex_edge[:-1])[0] + 1))
+    last = np.concatenate((first[1:] - 1, [len(vertex_edge) - 1]))
+    edge_start = distance[first]
+    edge_length = distance[last] - edge_start
+
+    counts = np.maximum(np.ceil(edge_length / SAMPLE_STEP_M).astype(np.int64), 1) + 1
+    edge = np.repeat(np.arange(cg.num_edges()), counts)
+    position = np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+    fraction = position / np.repeat(counts - 1, counts)
+    at = edge_start[edge] + fraction * edge_length[edge]
+    return EdgeSamples((lon0, lat0), (kx, ky), edge, fraction, np.interp(at, distance, x), np.interp(at, distance, y))
+
+# EdgeSamples of graph, built once and kept on the compiled graph
+def get_edge_samples(graph):
+    cg = get_compiled_graph(graph)
+    if cg.edge_samples is None:
+        cg.edge_samples = build_edge_samples(cg)
+    return cg.edge_samples
+
+
+# arrival time raster around the search: every cell holds the earliest arrival at a road sample
+# within BUFFER_CELLS of it, returns (grid, (col, row) of grid[0, 0]) or None if no road is reached
+def _arrival_grid(samples, reach):
+    cg = reach.graph
+    sources = np.repeat(np.arange(cg.num_nodes(), dtype=np.int32), np.diff(cg.offsets))
+    arrival = reach.arrival[sources[samples.edge]] + samples.fraction * cg.travel_time[samples.edge]
+    reached = np.nonzero(arrival <= reach.max_time)[0]
+    if len(reached) == 0:
+        return None
+    col = (samples.x[reached] // CELL_M).astype(np.int64)
+    row = (samples.y[reached] // CELL_M).astype(np.int64)
+    pad = BUFFER_CELLS + 1
+    col0, row0 = col.min() - pad, row.min() - pad
+    grid = np.full((row.max() - row0 + pad + 1, col.max() - col0 + pad + 1), np.inf)
+    np.minimum.at(grid, (row - row0, col - col0), arrival[reached])
+
+    offsets = np.arange(-BUFFER_CELLS, BUFFER_CELLS + 1)
+    footprint = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= BUFFER_CELLS ** 2
+    grid = ndimage.minimum_filter(grid, footprint=footprint, mode="constant", cval=np.inf)
+    return grid, (col0, row0)
+
+# fill one empty cell of every 2x2 block whose cells touch only diagonally, so the outlines of
+# the mask never pinch to a single corner (rings stay simple)
+def _fill_saddles(mask):
+    mask = mask.copy()
+    while True:
+        sw, se = mask[:-1, :-1], mask[:-1, 1:]
+        nw, ne = mask[1:, :-1], mask[1:, 1:]
+        rising = sw & ne & ~se & ~nw
+        falling = se & nw & ~sw & ~ne
+        if not rising.any() and not falling.any():
+            return mask
+        se |= rising
+        sw |= falling
+
+# outlines of the True cells of a saddle-free mask as closed rings of (col, row) grid corners,
+# interior on the left (counterclockwise outer rings, clockwise holes)
+def _trace_rings(mask):
+    h, w = mask.shape
+    padded = np.zeros((h + 2, w + 2), dtype=bool)
+    padded[1:-1, 1:-1] = mask
+    stride = w + 3 # corner (row, col) -> row * stride + col, in padded coordinates
+
+    # boundary edges between cells that differ, as start corner -> end corner
+    above, below = padded[1:, :], padded[:-1, :]
+    right, left = padded[:, 1:], padded[:, :-1]
+    r, c = np.nonzero(above & ~below)
+    starts, ends = [(r + 1) * stride + c], [(r + 1) * stride + c + 1]
+    r, c = np.nonzero(below & ~above)
+    starts.append((r + 1) * stride + c + 1)
+    ends.append((r + 1) * stride + c)
+    r, c = np.nonzero(right & ~left)
+    starts.append((r + 1) * stride + c + 1)
+    ends.append(r * stride + c + 1)
+    r, c = np.nonzero(left & ~right)
+    starts.append(r * stride + c + 1)
+    ends.append((r + 1) * stride + c + 1)
+    following = dict(zip(np.concatenate(starts).tolist(), np.concatenate(ends).tolist()))
+
+    rings = []
+    while following:
+        first, current = following.popitem()
+        ring = [first, current]
+        while current != first:
+            current = following.pop(current)
+            ring.append(current)
+        corners = np.array(ring)
+        xy = np.column_stack((corners % stride - 1, corners // stride - 1))
+        # keep the corners where the outline turns
+        turn = np.any(xy[1:-1] - xy[:-2] != xy[2:] - xy[1:-1], axis=1)
+        keep = np.concatenate(([True], turn, [True]))
+        rings.append(xy[keep].astype(np.float64))
+    return rings
+
+# (multi)polygon of the True cells of mask in grid coordinates
+def _mask_polygon(mask):
+    shells = []
+    holes = []
+    for ring in _trace_rings(_fill_saddles(mask)):
+        x, y = ring[:, 0], ring[:, 1]
+        area = 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+        if area > 0:
+            shells.append((area, ring))
+        elif -area >= MIN_HOLE_CELLS:
+            holes.append((-area, ring))
+
+    # every hole goes to the smallest outer ring around it
+    shells.sort(key=lambda s: s[0])
+    shell_polygons = [shapely.Polygon(ring) for _, ring in shells]
+    shell_holes = [[] for _ in shells]
+    for _, ring in holes:
+        point = shapely.Point((ring[0] + ring[1]) / 2)
+        for i, polygon in enumerate(shell_polygons):
+            if polygon.covers(point):
+                shell_holes[i].append(ring)
+                break
+    polygons = [shapely.Polygon(ring, h) for (_, ring), h in zip(shells, shell_holes)]
+    return shapely.MultiPolygon(polygons) if len(polygons) != 1 else polygons[0]
+
+# isochrone polygons around start_node, one per threshold (seconds, ascending) from a single
+# bounded search: roads reached within the threshold buffered by ~BUFFER_CELLS * CELL_M
+# returns [(threshold, geometry in lon/lat or None if nothing is reachable, reachable node count)]
+def compute_isochrones(graph, start_node, thresholds):
+    thresholds = sorted(thresholds)
+    samples = get_edge_samples(graph)
+    reach = rh.bounded_search(graph, start_node, thresholds[-1])
+    raster = _arrival_grid(samples, reach)
+    _, node_arrival = reach.nodes()
+
+    results = []
+    for threshold in thresholds:
+        if raster is None:
+            results.append((threshold, None, int(np.sum(node_arrival <= threshold))))
+            continue
+        grid, (col0, row0) = raster
+        mask = grid <= threshold
+        if not mask.any():
+            results.append((threshold, None, 0))
+            continue
+        geometry = _mask_polygon(mask)
+        geometry = shapely.transform(geometry, lambda xy: samples.to_lonlat((xy + (col0, row0)) * CELL_M))
+        geometry = shapely.simplify(geometry, 0.75 * CELL_M / samples.scale[1])
+        results.append((threshold, geometry, int(np.sum(node_arrival <= threshold))))
+    return results
+
+# compute_isochrones, LRU cached per graph by (start_node, thresholds)
+def get_isochrones(graph, start_node, thresholds):
+    cg = get_compiled_graph(graph)
+    key = (start_node, tuple(sorted(thresholds)))
+    with _cache_lock:
+        result = cg.isochrones.get(key)
+        if result is not None:
+            cg.isochrones.move_to_end(key)
+            ISOCHRONE_CACHE.inc("hit")
+            return result
+
+    ISOCHRONE_CACHE.inc("miss")
+    with ISOCHRONE_SECONDS.time():
+        result = compute_isochrones(cg, start_node, key[1])
+    with _cache_lock:
+        cg.isochrones[key] = result
+        while len(cg.isochrones) > ISOCHRONE_CACHE_SIZE:
+            cg.isochrones.popitem(last=False)
+    return result
+
+# GeoJSON FeatureCollection of get_isochrones output, largest area first (draw order)
+def isochrones_geojson(results):
+    features = []
+    for threshold, geometry, nodes in reversed(results):
+        if geometry is None:
+            continue
+        features.append({
+            "type": "Feature",
+            "properties": {"seconds": threshold, "minutes": threshold / 60, "nodes": nodes},
+            "geometry": shapely.geometry.mapping(shapely.set_precision(geometry, 1e-6))
+        })
+    return {"type": "FeatureCollection", "features": features}
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from simulator.compiled_graph import get_compiled_graph
+
+DEFAULT_LANDMARK_COUNT = 16
+ACTIVE_LANDMARK_COUNT = 4 # landmarks used per query, picked by bound quality
+UNREACHABLE_BOUND = 1e12 # stands in for an infinite lower bound (target unreachable)
+
+# precomputed travel times between landmarks and every node (ALT lower bounds)
+class LandmarkTable:
+    def __init__(self, node_ids, landmarks, from_landmark, to_landmark):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.landmarks = np.asarray(landmarks, dtype=np.int32)
+        self.from_landmark = np.asarray(from_landmark, dtype=np.float64) # [k, n] d(L, v)
+        self.to_landmark = np.asarray(to_landmark, dtype=np.float64) # [k, n] d(v, L)
+
+    # return lower bounds on d(v, target) for every node v
+    def bounds_to(self, target, active):
+        with np.errstate(invalid="ignore"):
+            a = self.from_landmark[active, target][:, None] - self.from_landmark[active]
+            b = self.to_landmark[active] - self.to_landmark[active, target][:, None]
+        return _clean_bounds(np.fmax(a, b).max(axis=0))
+
+    # return lower bounds on d(source, v) for every node v
+    def bounds_from(self, source, active):
+        with np.errstate(invalid="ignore"):
+            a = self.from_landmark[active] - self.from_landmark[active, source][:, None]
+            b = self.to_landmark[active, source][:, None] - self.to_landmark[active]
+        return _clean_bounds(np.fmax(a, b).max(axis=0))
+
+    # return the landmarks giving the tightest source -> target bound
+    def select_active(self, source, target, count=ACTIVE_LANDMARK_COUNT):
+        with np.errstate(invalid="ignore"):
+            a = self.from_landmark[:, target] - self.from_landmark[:, source]
+            b = self.to_landmark[:, source] - self.to_landmark[:, target]
+        quality = np.nan_to_num(np.fmax(a, b), nan=-np.inf)
+        return np.argsort(-quality, kind="stable")[:count]
+
+
+# nan (inf - inf) carries no information, +inf means unreachable
+def _clean_bounds(bounds):
+    bounds = np.nan_to_num(bounds, nan=0.0, posinf=UNREACHABLE_BOUND, neginf=0.0)
+    return np.maximum(bounds, 0.0)
+
+
+# pick landmarks by farthest-point selection on travel time
+def select_landmarks(graph, count=DEFAULT_LANDMARK_COUNT):
+    cg = get_compiled_graph(graph)
+    matrix = cg.as_sparse_matrix()
+    count = min(count, cg.num_nodes())
+
+    # seed with the node farthest from the geographic centre
+    center = np.argmin((cg.lon - cg.lon.mean()) ** 2 + (cg.lat - cg.lat.mean()) ** 2)
+    landmarks = [int(np.argmax(cg.haversine_to(center)))]
+    nearest = np.full(cg.num_nodes(), np.inf)
+    while len(landmarks) < count:
+        d = dijkstra(matrix, directed=False, indices=landmarks[-1])
+        nearest = np.minimum(nearest, d)
+        candidates = np.where(np.isfinite(nearest), nearest, -1.0)
+        landmarks.append(int(np.argmax(candidates)))
+    return landmarks
+
+
+# compute landmark distance tables for graph
+def build_landmarks(graph, count=DEFAULT_LANDMARK_COUNT):
+    cg = get_compiled_graph(graph)
+    landmarks = select_landmarks(cg, count)
+    matrix = cg.as_sparse_matrix()
+    from_landmark = dijkstra(matrix, directed=True, indices=landmarks)
+    to_landmark = dijkstra(matrix.T.tocsr(), directed=True, indices=landmarks)
+    return LandmarkTable(cg.node_ids, landmarks, from_landmark, to_landmark)
+
+
+# sidecar file stored next to the graph file
+def landmarks_path(graph_path):
+    return os.path.splitext(graph_path)[0] + ".landmarks.npz"
+
+def save_landmarks(table, path):
+    with open(path, "wb") as f:
+        np.savez(f, node_ids=table.node_ids, landmarks=table.landmarks,
+                 from_landmark=table.from_landmark, to_landmark=table.to_landmark)
+
+# load landmark tables from path and attach them to graph
+def load_landmarks(graph, path):
+    cg = get_compiled_graph(graph)
+    with np.load(path) as data:
+        table = LandmarkTable(data["node_ids"], data["landmarks"], data["from_landmark"], data["to_landmark"])
+    if not np.array_equal(table.node_ids, cg.node_ids):
+        raise ValueError(f"landmark table does not match graph: {path}")
+    cg.landmarks = table
+    return table
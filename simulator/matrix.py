@@ -0,0 +1,88 @@
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from simulator.compiled_graph import get_compiled_graph
+from simulator import graph_store as gs
+
+SOURCES_PER_CHUNK = 32 # sources searched at once, bounds the [sources, num_nodes] search arrays
+_worker_graph = None # graph loaded by init_worker in pool processes
+
+# process pool initializer, loads the graph once per worker
+# (graph store directories are memory-mapped, so workers share its pages)
+def init_worker(graph_path):
+    global _worker_graph
+    _worker_graph = get_compiled_graph(gs.load_graph(graph_path, compact=True))
+
+def _worker_rows(sources, targets, distances):
+    return one_to_many(_worker_graph, sources, targets, distances)
+
+
+# travel times (and path lengths) from every source to every target node index
+# one dijkstra per source over the whole graph (scipy csgraph), returns (travel_time, distance)
+# arrays of shape [len(sources), len(targets)], inf where unreachable, distance is None unless asked
+def one_to_many(graph, sources, targets, distances=False):
+    cg = get_compiled_graph(graph)
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    matrix = cg.as_sparse_matrix()
+    if not distances:
+        travel_time = dijkstra(matrix, directed=True, indices=sources)
+        return travel_time[:, targets], None
+
+    travel_time, predecessors = dijkstra(matrix, directed=True, indices=sources, return_predecessors=True)
+    length = _tree_path_lengths(cg, sources, travel_time, predecessors)
+    return travel_time[:, targets], length[:, targets]
+
+# length (meters) of every shortest travel time path in the dijkstra trees
+def _tree_path_lengths(cg, sources, travel_time, predecessors):
+    if cg.length is None:
+        raise ValueError("graph has no edge lengths")
+    k, n = predecessors.shape
+    rows = np.arange(k)[:, None]
+
+    # length of the tree edge into each node (edge u -> v is in the tree if pred[v] == u)
+    edge_sources = np.repeat(np.arange(n), np.diff(cg.offsets))
+    parent_length = np.zeros((k, n))
+    in_tree = predecessors[:, cg.targets] == edge_sources
+    tree_rows, tree_edges = np.nonzero(in_tree)
+    parent_length[tree_rows, cg.targets[tree_edges]] = cg.length[tree_edges]
+
+    # pointer jumping on flat indices: after step j every node has summed the 2^j edges above
+    # it, roots (and unreachable nodes) point at themselves and add 0
+    ancestor = np.where(predecessors < 0, np.arange(n)[None, :], predecessors) + rows * n
+    ancestor = ancestor.ravel()
+    total = parent_length.ravel()
+    while True:
+        next_ancestor = ancestor[ancestor]
+        total = total + total[ancestor]
+        if np.array_equal(next_ancestor, ancestor):
+            break
+        ancestor = next_ancestor
+    total = np.where(np.isfinite(travel_time), total.reshape(k, n), np.inf)
+    total[np.arange(k), sources] = 0.0
+    return total
+
+
+# [len(sources), len(targets)] travel time / distance matrices between node indices
+# unique sources are split into chunks (at least `chunks`, at most SOURCES_PER_CHUNK sources
+# each) across executor (a process pool created with init_worker) when one is given, otherwise
+# computed one chunk after the other in this process; every chunk's searches hold
+# [chunk, num_nodes] arrays, which are cut down to the target columns before the next one
+def travel_time_matrix(graph, sources, targets, distances=False, executor=None, chunks=16):
+    cg = get_compiled_graph(graph)
+    unique_sources, source_rows = np.unique(np.asarray(sources, dtype=np.int64), return_inverse=True)
+    targets = np.asarray(targets, dtype=np.int64)
+
+    parts = max(-(-len(unique_sources) // SOURCES_PER_CHUNK), 1)
+    if executor is None or len(unique_sources) < 2:
+        results = [one_to_many(cg, part, targets, distances) for part in np.array_split(unique_sources, parts)]
+    else:
+        parts = np.array_split(unique_sources, min(max(chunks, parts), len(unique_sources)))
+        futures = [executor.submit(_worker_rows, part, targets, distances) for part in parts]
+        results = [f.result() for f in futures]
+    travel_time = np.vstack([r[0] for r in results])
+    length = np.vstack([r[1] for r in results]) if distances else None
+
+    travel_time = travel_time[source_rows]
+    if length is not None:
+        length = length[source_rows]
+    return travel_time, length
@@ -0,0 +1,212 @@
+from contextlib import contextmanager
+from bisect import bisect_left
+import threading
+import time
+import sys
+import os
+
+# latency buckets in seconds (0.1 ms .. 10 s)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# monotonically increasing count, one value per label combination
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {} # label values -> count
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _format_labels(self.labels, k), v) for k, v in self.values.items()]
+
+
+# value read from a callback at scrape time (e.g. live session count)
+class Gauge:
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [(self.name, "", value)]
+
+
+# cumulative bucket counts + sum + count per label combination
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # label values -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            row = self.values.get(label_values)
+            if row is None:
+                row = [0] * (len(self.buckets) + 1) + [0.0]
+                self.values[label_values] = row
+            row[i] += 1
+            row[-1] += value
+
+    # time the block and observe its duration in seconds
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self.lock:
+            rows = [(k, list(v)) for k, v in self.values.items()]
+        samples = []
+        for label_values, row in rows:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", _format_value(bound)))
+                samples.append((self.name + "_bucket", labels, cumulative))
+            labels = _format_labels(self.labels, label_values)
+            samples.append((self.name + "_sum", labels, row[-1]))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+
+# metrics of this process by name
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, callback):
+        with self.lock:
+            self.metrics.pop(name, None) # callbacks are replaced, e.g. on reload
+        return self._register(Gauge(name, help_text, callback))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    # Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+# samples the stacks of all other threads every interval seconds into folded stack counts
+# ("module:function;module:function ..." -> samples), cheap enough to leave running
+class SamplingProfiler:
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.counts = {}
+        self.samples = 0
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.samples = 0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            del frames
+            with self.lock:
+                self.samples += 1
+                for stack in stacks:
+                    self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    # folded stacks (flamegraph.pl / speedscope input), most sampled first
+    def folded(self, limit=None):
+        with self.lock:
+            items = sorted(self.counts.items(), key=lambda kv: -kv[1])
+        if limit is not None:
+            items = items[:limit]
+        return "".join(f"{stack} {count}\n" for stack, count in items)
@@ -0,0 +1,263 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait, as_completed
+import subprocess
+import random
+import json
+import csv
+import os
+import numpy as np
+from simulator.driving_simulator import DrivingSimulator
+from simulator import route_handler as rh
+from simulator import route_cache as rc
+from simulator import graph_registry as gr
+from simulator import graph_store as gs
+from simulator import geo_utils as gu
+
+DEFAULT_SPEED_MPS = 13.4 # ~30 mph
+DEFAULT_TICK_SECONDS = 1.0 # simulated seconds per tick
+DEFAULT_MAX_SECONDS = 6 * 3600.0 # simulated time after which a trip is cut off
+JUNCTION_POLICIES = (None, "route", "random")
+DEFAULT_DETOUR_RATE = 0.1 # share of junctions where the random policy leaves the route
+TRIPS_PER_FILE = 1000
+TRACE_COLUMNS = (("t", np.float64), ("lon", np.float64), ("lat", np.float64), ("bearing", np.float32))
+
+_worker = None # (graph, route_mode) loaded by init_worker in pool processes
+
+# one trip as read by load_trips: start/end are node ids or (lon, lat), choices maps a junction
+# node to the node taken there (the rest of the junctions follow the policy)
+class Trip:
+    def __init__(self, trip_id, start, end, speed=None, choices=None):
+        self.trip_id = str(trip_id)
+        self.start = start
+        self.end = end
+        self.speed = speed
+        self.choices = choices or {}
+
+# result of one replayed trip: status is finished, unreachable, cut_off or error
+# columns hold one row per tick (t in simulated seconds, lon, lat, bearing), path every node driven
+class TripTrace:
+    def __init__(self, trip_id, status, speed, error="", columns=None, path=None, reroutes=0, distance_m=0.0):
+        self.trip_id = trip_id
+        self.status = status
+        self.speed = speed
+        self.error = error
+        self.columns = columns or {name: np.zeros(0, dtype=dtype) for name, dtype in TRACE_COLUMNS}
+        self.path = np.asarray(path if path is not None else [], dtype=np.int64)
+        self.reroutes = reroutes
+        self.distance_m = distance_m
+
+    def ticks(self):
+        return max(len(self.columns["t"]) - 1, 0)
+
+    # simulated travel time, exact (speed is constant) rather than rounded up to whole ticks
+    def duration_s(self):
+        return self.distance_m / self.speed if self.speed else 0.0
+
+    def summary(self):
+        return {
+            "trip_id": self.trip_id,
+            "status": self.status,
+            "error": self.error,
+            "ticks": self.ticks(),
+            "duration_s": self.duration_s(),
+            "distance_m": self.distance_m,
+            "reroutes": self.reroutes
+        }
+
+
+def _parse_point(value):
+    if isinstance(value, (list, tuple)):
+        return (float(value[0]), float(value[1]))
+    return int(value)
+
+# trips from a JSON lines file ({"id", "start", "end", "speed", "choices"} per line, start/end a
+# node id or [lon, lat]) or a CSV file with start_node,end_node or start_lon,start_lat,end_lon,end_lat
+# columns (id and speed optional), ids default to the line number
+def load_trips(path):
+    trips = []
+    if path.endswith(".csv"):
+        with open(path, "r", newline="") as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                if row.get("start_node"):
+                    start, end = int(row["start_node"]), int(row["end_node"])
+                else:
+                    start = (float(row["start_lon"]), float(row["start_lat"]))
+                    end = (float(row["end_lon"]), float(row["end_lat"]))
+                speed = float(row["speed"]) if row.get("speed") else None
+                trips.append(Trip(row.get("id") or i, start, end, speed))
+        return trips
+
+    with open(path, "r") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            choices = {int(node): int(next_node) for node, next_node in data.get("choices", {}).items()}
+            trips.append(Trip(data.get("id", i), _parse_point(data["start"]), _parse_point(data["end"]), data.get("speed"), choices))
+    return trips
+
+def _edge_lengths(graph, path):
+    return sum(gu.get_edge_polyline(graph, u, v).length for u, v in zip(path, path[1:]))
+
+# drive trip to completion at simulated time (no sleeping), stopping at junctions when a
+# policy is given or the trip scripts choices: "route" keeps to the planned route, "random"
+# leaves it with probability detour_rate for a branch that still reaches the end (seeded per
+# trip id), scripted choices go through choose_junction_node as well
+def run_trip(graph, trip, route_mode=None, speed=DEFAULT_SPEED_MPS, tick_interval=DEFAULT_TICK_SECONDS,
+             junctions=None, detour_rate=DEFAULT_DETOUR_RATE, seed=0, snap="node", max_seconds=DEFAULT_MAX_SECONDS):
+    if junctions not in JUNCTION_POLICIES:
+        raise ValueError(f"unknown junction policy: {junctions}")
+    speed = trip.speed or speed
+    try:
+        start_node, end_node = [p if not isinstance(p, tuple) else rh.coords_to_nodes(graph, [p], snap=snap)[0] for p in (trip.start, trip.end)]
+        route = rc.cached_route(graph, start_node, end_node, lambda: rh.calculate_route(graph, start_node, end_node, mode=route_mode))
+        if route is None:
+            return TripTrace(trip.trip_id, "unreachable", speed)
+
+        sim = DrivingSimulator()
+        sim.tick_interval = tick_interval
+        sim.load_route(graph, route)
+        sim.start()
+        sim.set_speed(speed)
+        sim.stop_at_junctions = junctions is not None or bool(trip.choices)
+        rng = random.Random(f"{seed}:{trip.trip_id}")
+
+        rows = []
+        driven = [] # nodes driven before each reroute, the final route is added at the end
+        reroutes = 0
+        t = 0.0
+        status = "finished"
+        while True:
+            lon, lat = sim.current_coords
+            rows.append((t, lon, lat, np.nan if sim.current_bearing is None else sim.current_bearing))
+            if sim.finished:
+                break
+            if t >= max_seconds:
+                status = "cut_off"
+                break
+            sim.tick()
+            t += tick_interval
+            if sim.awaiting_junc_choice:
+                planned = sim.route[sim.current_node_index + 1]
+                next_node = trip.choices.get(sim.current_node)
+                if next_node is None:
+                    next_node = planned
+                    detours = [o["node_id"] for o in sim.junc_options if o["node_id"] != planned and o.get("eta_s") is not None]
+                    if junctions == "random" and detours and rng.random() < detour_rate:
+                        next_node = rng.choice(detours)
+                if next_node != planned:
+                    driven.extend(sim.route[:sim.current_node_index])
+                    reroutes += 1
+                if next_node == planned and all(o["node_id"] != planned for o in sim.junc_options):
+                    # the route turns back to the previous node, which is never offered as a choice
+                    sim.awaiting_junc_choice = False
+                    sim.junc_options = []
+                    sim.resume()
+                else:
+                    sim.choose_junction_node(next_node)
+        path = driven + sim.route[:sim.current_node_index + 2] if status == "cut_off" else driven + sim.route
+    except Exception as e:
+        return TripTrace(trip.trip_id, "error", speed, error=str(e))
+
+    columns = {name: np.array([r[i] for r in rows], dtype=dtype) for i, (name, dtype) in enumerate(TRACE_COLUMNS)}
+    distance_m = _edge_lengths(graph, path) if status == "finished" else speed * t
+    return TripTrace(trip.trip_id, status, speed, columns=columns, path=path, reroutes=reroutes, distance_m=distance_m)
+
+
+# process pool initializer, loads the graph and its landmark/CH sidecars once per worker
+def init_worker(graph_path):
+    global _worker
+    _worker = gr.load_region_graph(graph_path, compact=True)
+
+def _worker_trips(trips, route_mode, options):
+    graph, graph_route_mode = _worker
+    return [run_trip(graph, trip, route_mode=route_mode or graph_route_mode, **options) for trip in trips]
+
+# replay trips on the graph at graph_path, yields TripTrace as trips complete (not in input order
+# with workers): chunks of chunk_size trips are spread over workers processes (0 = this process)
+# and at most 2 chunks per worker are pending, so long runs stay flat in memory
+# options are passed to run_trip (route_mode defaults to the fastest one the graph has sidecars for)
+def replay(graph_path, trips, workers=0, chunk_size=16, route_mode=None, **options):
+    if not gs.is_graph_store(graph_path):
+        try:
+            graph_path = gs.ensure_graph_store(graph_path) # export once, workers map the store
+        except (OSError, subprocess.CalledProcessError): # read-only directory, compacted per process
+            pass
+
+    if workers <= 0:
+        graph, graph_route_mode = gr.load_region_graph(graph_path, compact=True)
+        for trip in trips:
+            yield run_trip(graph, trip, route_mode=route_mode or graph_route_mode, **options)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(graph_path,)) as executor:
+        pending = set()
+        for i in range(0, len(trips), chunk_size):
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(executor.submit(_worker_trips, trips[i:i + chunk_size], route_mode, options))
+        for future in as_completed(pending):
+            yield from future.result()
+
+
+# TripTraces written to directory as columnar npz files of trips_per_file trips each
+# (traces-00000.npz, ...): per trip summary columns, the tick columns of every trip laid end to
+# end with trace_offsets[i]:trace_offsets[i + 1] slicing trip i, and the driven paths likewise
+# through path_offsets; files are written to a temporary name and renamed when complete
+class TraceWriter:
+    def __init__(self, directory, trips_per_file=TRIPS_PER_FILE):
+        self.directory = directory
+        self.trips_per_file = trips_per_file
+        self.buffer = []
+        self.files = []
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, trace):
+        self.buffer.append(trace)
+        if len(self.buffer) >= self.trips_per_file:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        traces, self.buffer = self.buffer, []
+        arrays = {
+            "trip_id": np.array([t.trip_id for t in traces], dtype=str),
+            "status": np.array([t.status for t in traces], dtype=str),
+            "error": np.array([t.error for t in traces], dtype=str),
+            "speed": np.array([t.speed for t in traces], dtype=np.float64),
+            "distance_m": np.array([t.distance_m for t in traces], dtype=np.float64),
+            "reroutes": np.array([t.reroutes for t in traces], dtype=np.int32),
+            "trace_offsets": np.concatenate(([0], np.cumsum([len(t.columns["t"]) for t in traces]))).astype(np.int64),
+            "path_offsets": np.concatenate(([0], np.cumsum([len(t.path) for t in traces]))).astype(np.int64),
+            "path": np.concatenate([t.path for t in traces])
+        }
+        for name, dtype in TRACE_COLUMNS:
+            arrays[name] = np.concatenate([t.columns[name] for t in traces]).astype(dtype)
+
+        path = os.path.join(self.directory, f"traces-{len(self.files):05d}.npz")
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        self.files.append(path)
+
+    def close(self):
+        self.flush()
+        return self.files
+
+# TripTraces of a file written by TraceWriter, in the order they were written
+def read_traces(path):
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    trace_offsets = arrays["trace_offsets"]
+    path_offsets = arrays["path_offsets"]
+    for i in range(len(arrays["trip_id"])):
+        rows = slice(trace_offsets[i], trace_offsets[i + 1])
+        yield TripTrace(
+            str(arrays["trip_id"][i]), str(arrays["status"][i]), float(arrays["speed"][i]), str(arrays["error"][i]),
+            columns={name: arrays[name][rows] for name, _ in TRACE_COLUMNS},
+            path=arrays["path"][path_offsets[i]:path_offsets[i + 1]],
+            reroutes=int(arrays["reroutes"][i]),
+            distance_m=float(arrays["distance_m"][i])
+        )
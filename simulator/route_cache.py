@@ -0,0 +1,135 @@
+from collections import OrderedDict
+import threading
+import time
+from simulator.compiled_graph import get_compiled_graph
+from simulator import metrics
+
+MAX_ENTRIES = 4096 # routes kept per graph, set by configure
+TTL_SECONDS = 3600.0
+SUFFIXES = True
+_cache_lock = threading.Lock() # guards creating the per graph caches
+
+ROUTE_CACHE_LOOKUPS = metrics.counter("route_cache_lookups_total", "Route cache lookups by result (hit, suffix, miss)", ("result",))
+
+def configure(max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS, suffixes=SUFFIXES):
+    global MAX_ENTRIES, TTL_SECONDS, SUFFIXES
+    MAX_ENTRIES = max_entries
+    TTL_SECONDS = ttl_seconds
+    SUFFIXES = suffixes
+
+
+# LRU of routes by (start node, end node) with a ttl, None (unreachable) is cached as well
+# with suffixes a miss whose start lies on a cached route to the same end is answered with that
+# route's suffix, which is a shortest path to that end too
+class RouteCache:
+    def __init__(self, max_entries=4096, ttl_seconds=3600, suffixes=True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.suffixes = suffixes
+        self.entries = OrderedDict() # (start, end) -> (route tuple or None, expires_at)
+        self.ends = {} # end -> {node on a cached route: ((start, end), index in that route)}
+        self.end_counts = {} # end -> cached routes to it, its index is dropped with the last one
+        # (ends and end_counts are only kept with suffixes)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.suffix_hits = 0
+        self.misses = 0
+
+    def _drop(self, key):
+        route, _ = self.entries.pop(key)
+        if route is None or not self.suffixes:
+            return
+        end = key[1]
+        self.end_counts[end] -= 1
+        if self.end_counts[end] == 0:
+            del self.end_counts[end]
+            del self.ends[end]
+
+    def _suffix(self, start_node, end_node):
+        index = self.ends.get(end_node)
+        ref = index.get(start_node) if index is not None else None
+        if ref is None:
+            return None
+        key, position = ref
+        entry = self.entries.get(key)
+        # stale reference: its route expired or was evicted (and maybe cached again differently)
+        if entry is None or entry[0] is None or entry[1] <= time.time() or entry[0][position] != start_node:
+            del index[start_node]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0][position:]
+
+    # (result, route): result is hit, suffix or miss, route a list of node ids (None if end_node
+    # is unreachable or on a miss)
+    def get(self, start_node, end_node):
+        key = (start_node, end_node)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                ROUTE_CACHE_LOOKUPS.inc("hit")
+                return "hit", None if entry[0] is None else list(entry[0])
+            if entry is not None:
+                self._drop(key)
+            route = self._suffix(start_node, end_node) if self.suffixes else None
+            if route is not None:
+                self.suffix_hits += 1
+                ROUTE_CACHE_LOOKUPS.inc("suffix")
+                return "suffix", list(route)
+            self.misses += 1
+            ROUTE_CACHE_LOOKUPS.inc("miss")
+            return "miss", None
+
+    def put(self, start_node, end_node, route):
+        key = (start_node, end_node)
+        route = None if route is None else tuple(route)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (route, time.time() + self.ttl_seconds)
+            if route is not None and self.suffixes:
+                self.end_counts[end_node] = self.end_counts.get(end_node, 0) + 1
+                index = self.ends.setdefault(end_node, {})
+                for position, node in enumerate(route):
+                    index[node] = (key, position) # newest route wins, older refs may be stale
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+
+    # route from start_node to end_node, compute() runs the search on a miss (outside the lock)
+    # stats["cache"] is set to hit, suffix or miss
+    def route(self, start_node, end_node, compute, stats=None):
+        result, route = self.get(start_node, end_node)
+        if stats is not None:
+            stats["cache"] = result
+        if result != "miss":
+            return route
+        route = compute()
+        self.put(start_node, end_node, route)
+        return route
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.ends.clear()
+            self.end_counts.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "suffix_hits": self.suffix_hits, "misses": self.misses}
+
+# RouteCache of graph, kept on its compiled graph: routes live as long as the graph they were
+# searched on, so a reloaded (or evicted and loaded again) graph starts with an empty cache
+def get_route_cache(graph):
+    cg = get_compiled_graph(graph)
+    if cg.route_cache is None:
+        with _cache_lock:
+            if cg.route_cache is None:
+                cg.route_cache = RouteCache(MAX_ENTRIES, TTL_SECONDS, SUFFIXES)
+    return cg.route_cache
+
+# route between node ids through the cache of graph, compute() searches on a miss
+def cached_route(graph, start_node, end_node, compute, stats=None):
+    if not MAX_ENTRIES:
+        return compute()
+    return get_route_cache(graph).route(start_node, end_node, compute, stats)
@@ -1,6 +1,19 @@
 from heapq import heappush, heappop
 from simulator import geo_utils as gu
+from simulator.compiled_graph import CompiledGraph, get_compiled_graph
+from simulator.landmarks import UNREACHABLE_BOUND
+from simulator.spatial_index import get_spatial_index
+from simulator.route_tree import get_route_tree
+from simulator import matrix
+from simulator import metrics
+from scipy.sparse.csgraph import dijkstra
 import osmnx as ox
+import numpy as np
+import math
+import time
+
+MAX_SPEED_MPH = 70 # upper bound on road speed used by the A* heuristic
+MAX_SPEED_MPS = (MAX_SPEED_MPH * 1609.34) / 3600 # m/s
 
 # get graph
 def load_graph_from_file(filepath):
@@ -10,17 +23,36 @@ def load_graph_from_file(filepath):
     ox.add_edge_bearings(graph)
     return graph
 
+SNAP_MODES = ("node", "edge")
+
 # find nearest node to coords
-def coords_to_node(graph, coords):
-    lon, lat = coords
-    return ox.nearest_nodes(graph, X=lon, Y=lat)
+# snap "node": nearest graph node
+# snap "edge": nearest edge, then whichever of its end nodes is closer along the edge
+def coords_to_node(graph, coords, snap="node"):
+    return coords_to_nodes(graph, [coords], snap=snap)[0]
+
+# batch version of coords_to_node, snaps every (lon, lat) in one vectorized query
+def coords_to_nodes(graph, coords_list, snap="node"):
+    index = get_spatial_index(graph)
+    lons = [c[0] for c in coords_list]
+    lats = [c[1] for c in coords_list]
+    if snap == "node":
+        nodes, _ = index.nearest_nodes(lons, lats)
+        return nodes.tolist()
+    if snap == "edge":
+        u, v, fraction, _ = index.nearest_edges(lons, lats)
+        return np.where(fraction < 0.5, u, v).tolist()
+    raise ValueError(f"invalid snap mode: {snap}")
 
 # return array of neighbor nodes
 def get_neighbors(graph, node):
-    return list(graph.neighbors(node))
+    return gu.get_successors(graph, node)
 
 # return travel time between two nodes (seconds)
 def edge_cost_travel_time(graph, node_1, node_2):
+    if isinstance(graph, CompiledGraph):
+        e = graph.edge_index(graph.index_of(node_1), graph.index_of(node_2))
+        return float('inf') if e is None else graph.travel_time_list[e]
     edges = graph.get_edge_data(node_1, node_2)
     if not edges:
         return float('inf')
@@ -33,42 +65,357 @@ def reconstruct_route(came_from, current):
         route.insert(0, current)
     return route
 
-# calculate route (A*) and set route
-def calculate_route(graph, start_node, end_node):
-    max_speed_mph = 70 # mph
-    max_speed_mps = (max_speed_mph * 1609.34) / 3600 # m/s
-    open_set = []
-    start_heuristic = gu.get_geodesic_distance(graph, start_node, end_node) / max_speed_mps
-    heappush(open_set, (start_heuristic, start_node))
-    open_set_lookup = {start_node}
+# "tree" walks the cached reverse shortest path tree of end_node, building it costs one
+# full dijkstra but every later route to the same destination is O(path length)
+ROUTE_MODES = ("astar", "alt", "ch", "tree")
+DEFAULT_ROUTE_MODE = "astar"
+DEADLINE_CHECK_INTERVAL = 256 # settled nodes between deadline checks
+
+NODE_COUNT_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000)
+ROUTE_SECONDS = metrics.histogram("route_search_seconds", "Route search duration", ("mode",))
+ROUTE_EXPANSIONS = metrics.histogram("route_search_expansions", "Nodes settled per route search", ("mode",), NODE_COUNT_BUCKETS)
+ROUTE_HEAP_PUSHES = metrics.histogram("route_search_heap_pushes", "Heap pushes per route search", ("mode",), NODE_COUNT_BUCKETS)
+ROUTE_SEARCHES = metrics.counter("route_searches_total", "Route searches by result (found, unreachable, timeout)", ("mode", "result"))
+
+# calculate route and set route
+# mode "astar": unidirectional A* with a haversine heuristic
+# mode "alt": bidirectional A* with landmark (ALT) potentials, needs landmarks.load_landmarks
+# mode "ch": contraction hierarchy query with shortcuts unpacked, needs contraction.load_ch
+# stats dict (optional) is filled with the number of settled nodes
+# deadline (time.time() value, optional) makes astar/alt searches raise TimeoutError past it
+# returns list of osm node ids or None if end_node is unreachable
+def calculate_route(graph, start_node, end_node, mode=None, stats=None, deadline=None):
+    if stats is None:
+        stats = {}
+    start = time.perf_counter()
+    try:
+        route = _calculate_route(graph, start_node, end_node, mode, stats, deadline)
+    except TimeoutError:
+        stats["duration_ms"] = (time.perf_counter() - start) * 1000
+        record_route_metrics(stats, "timeout")
+        raise
+    stats["duration_ms"] = (time.perf_counter() - start) * 1000
+    record_route_metrics(stats, "unreachable" if route is None else "found")
+    return route
+
+# feed a search's stats into the route metrics (also used for searches run in pool workers)
+def record_route_metrics(stats, result):
+    mode = stats.get("mode", "")
+    ROUTE_SECONDS.observe(stats.get("duration_ms", 0.0) / 1000, mode)
+    if "expansions" in stats:
+        ROUTE_EXPANSIONS.observe(stats["expansions"], mode)
+    if "heap_pushes" in stats:
+        ROUTE_HEAP_PUSHES.observe(stats["heap_pushes"], mode)
+    ROUTE_SEARCHES.inc(mode, result)
+
+def _calculate_route(graph, start_node, end_node, mode, stats, deadline):
+    cg = get_compiled_graph(graph)
+    source = cg.index_of(start_node)
+    target = cg.index_of(end_node)
+    mode = mode or DEFAULT_ROUTE_MODE
+    stats["mode"] = mode
+
+    if mode == "astar":
+        route = _astar(cg, source, target, stats, deadline)
+    elif mode == "alt":
+        route = _bidirectional_alt(cg, source, target, stats, deadline)
+    elif mode == "ch":
+        if cg.ch is None:
+            raise ValueError("contraction hierarchy not loaded for graph")
+        route = cg.ch.query(source, target, stats)
+    elif mode == "tree":
+        route = get_route_tree(cg, target).path_from(source)
+        stats["expansions"] = 0 if route is None else len(route)
+    else:
+        raise ValueError(f"invalid route mode: {mode}")
+
+    if route is None:
+        return None
+    return [cg.node_of(i) for i in route]
+
+def _check_deadline(deadline, settled):
+    if deadline is not None and settled % DEADLINE_CHECK_INTERVAL == 0 and time.time() > deadline:
+        raise TimeoutError(f"route search timed out after {settled} expansions")
+
+def _astar(cg, source, target, stats, deadline=None):
+    offsets = cg.offset_list
+    targets = cg.target_list
+    weights = cg.travel_time_list
+    lon_rad = cg.lon_rad_list
+    lat_rad = cg.lat_rad_list
+    cos_lat = cg.cos_lat_list
+
+    # haversine / max speed (admissible lower bound on remaining travel time)
+    target_lon = lon_rad[target]
+    target_lat = lat_rad[target]
+    target_cos = cos_lat[target]
+    seconds_per_radian = (2 * gu.EARTH_RADIUS_MIN_M) / MAX_SPEED_MPS
+    def heuristic(i):
+        a = (math.sin((lat_rad[i] - target_lat) * 0.5) ** 2
+             + cos_lat[i] * target_cos * math.sin((lon_rad[i] - target_lon) * 0.5) ** 2)
+        return seconds_per_radian * math.asin(math.sqrt(min(a, 1.0)))
+
+    open_set = [(heuristic(source), source)]
+    heap_pushes = 1
     came_from = {}
-    g_score = {start_node: 0}
-    f_score = {start_node: start_heuristic}
+    g_score = {source: 0.0}
+    closed = set()
 
     while open_set:
         _, current = heappop(open_set)
-        open_set_lookup.remove(current)
-        if current == end_node:
-            return reconstruct_route(came_from, current)
-        for neighbor in get_neighbors(graph, current):
-            travel_time = edge_cost_travel_time(graph, current, neighbor)
-            tentative_g = g_score[current] + travel_time
-            if tentative_g < g_score.get(neighbor, float('inf')):
+        if current in closed:
+            continue
+        if current == target:
+            stats["expansions"] = len(closed)
+            stats["heap_pushes"] = heap_pushes
+            route = [current]
+            while current in came_from:
+                current = came_from[current]
+                route.append(current)
+            route.reverse()
+            return route
+        closed.add(current)
+        _check_deadline(deadline, len(closed))
+
+        current_g = g_score[current]
+        for e in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[e]
+            if neighbor in closed:
+                continue
+            tentative_g = current_g + weights[e]
+            if tentative_g < g_score.get(neighbor, math.inf):
                 came_from[neighbor] = current
                 g_score[neighbor] = tentative_g
-                heuristic_time = gu.get_geodesic_distance(graph, neighbor, end_node) / max_speed_mps
-                f_score[neighbor] = tentative_g + heuristic_time
-                if neighbor not in open_set_lookup:
-                    heappush(open_set, (f_score[neighbor], neighbor))
-                    open_set_lookup.add(neighbor)
+                heappush(open_set, (tentative_g + heuristic(neighbor), neighbor))
+                heap_pushes += 1
+    stats["expansions"] = len(closed)
+    stats["heap_pushes"] = heap_pushes
     return None
 
+# return per-node forward potential for a bidirectional search from source to target
+# averages the to-target and from-source bounds so both directions stay consistent
+def _alt_potential(cg, source, target):
+    table = cg.landmarks
+    if table is None:
+        raise ValueError("landmarks not loaded for graph")
+    active = table.select_active(source, target)
+    to_target = np.maximum(table.bounds_to(target, active), cg.haversine_to(target) / MAX_SPEED_MPS)
+    from_source = np.maximum(table.bounds_from(source, active), cg.haversine_to(source) / MAX_SPEED_MPS)
+    return to_target, ((to_target - from_source) * 0.5).tolist()
+
+def _bidirectional_alt(cg, source, target, stats, deadline=None):
+    stats["expansions"] = 0
+    if source == target:
+        return [source]
+    to_target, potential = _alt_potential(cg, source, target)
+    if to_target[source] >= UNREACHABLE_BOUND:
+        return None
+
+    offsets = cg.offset_list
+    targets = cg.target_list
+    weights = cg.travel_time_list
+    reverse_offsets, reverse_sources, reverse_weights = cg.reverse_adjacency()
+
+    dist_f = {source: 0.0}
+    dist_r = {target: 0.0}
+    parent_f = {}
+    parent_r = {}
+    settled_f = set()
+    settled_r = set()
+    heap_f = [(potential[source], source)]
+    heap_r = [(-potential[target], target)]
+    heap_pushes = 2
+    best = math.inf
+    meeting = None
+
+    while heap_f or heap_r:
+        top_f = heap_f[0][0] if heap_f else math.inf
+        top_r = heap_r[0][0] if heap_r else math.inf
+        if top_f + top_r >= best:
+            break
+
+        if top_f <= top_r: # forward step
+            _, u = heappop(heap_f)
+            if u in settled_f:
+                continue
+            settled_f.add(u)
+            _check_deadline(deadline, len(settled_f) + len(settled_r))
+            du = dist_f[u]
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                dv = du + weights[e]
+                if dv < dist_f.get(v, math.inf):
+                    dist_f[v] = dv
+                    parent_f[v] = u
+                    heappush(heap_f, (dv + potential[v], v))
+                    heap_pushes += 1
+                    if v in dist_r and dv + dist_r[v] < best:
+                        best = dv + dist_r[v]
+                        meeting = v
+        else: # reverse step
+            _, u = heappop(heap_r)
+            if u in settled_r:
+                continue
+            settled_r.add(u)
+            _check_deadline(deadline, len(settled_f) + len(settled_r))
+            du = dist_r[u]
+            for e in range(reverse_offsets[u], reverse_offsets[u + 1]):
+                v = reverse_sources[e]
+                dv = du + reverse_weights[e]
+                if dv < dist_r.get(v, math.inf):
+                    dist_r[v] = dv
+                    parent_r[v] = u
+                    heappush(heap_r, (dv - potential[v], v))
+                    heap_pushes += 1
+                    if v in dist_f and dv + dist_f[v] < best:
+                        best = dv + dist_f[v]
+                        meeting = v
+
+    stats["expansions"] = len(settled_f) + len(settled_r)
+    stats["heap_pushes"] = heap_pushes
+    if meeting is None:
+        return None
+    route = [meeting]
+    current = meeting
+    while current in parent_f:
+        current = parent_f[current]
+        route.append(current)
+    route.reverse()
+    current = meeting
+    while current in parent_r:
+        current = parent_r[current]
+        route.append(current)
+    return route
+
+# origin x destination matrices of travel time (seconds) and, with distances, route length (meters)
+# origins/destinations are node ids or (lon, lat) pairs, pairs are snapped like coords_to_nodes
+# returns (origin_nodes, destination_nodes, travel_time, distance), inf where unreachable
+def travel_time_matrix(graph, origins, destinations, distances=False, snap="node", executor=None):
+    cg = get_compiled_graph(graph)
+    origin_nodes = _as_nodes(graph, origins, snap)
+    destination_nodes = _as_nodes(graph, destinations, snap)
+    sources = [cg.index_of(n) for n in origin_nodes]
+    targets = [cg.index_of(n) for n in destination_nodes]
+    travel_time, distance = matrix.travel_time_matrix(cg, sources, targets, distances, executor)
+    return origin_nodes, destination_nodes, travel_time, distance
+
+# nodes within max_time of a bounded search, arrival[i] is the travel time (seconds) from the
+# source to node index i, inf where it is further than max_time
+class Reachability:
+    def __init__(self, graph, source, max_time, arrival):
+        self.graph = graph
+        self.source = source
+        self.max_time = max_time
+        self.arrival = arrival
+
+    # (node indices, arrival times) of the reachable nodes
+    def nodes(self):
+        indices = np.nonzero(np.isfinite(self.arrival))[0]
+        return indices, self.arrival[indices]
+
+    # (edge indices, departure times, arrival times) of the edges entered before max_time,
+    # arrival is past max_time for edges that are only partly driven
+    def edges(self):
+        cg = self.graph
+        departure = self.arrival[np.repeat(np.arange(cg.num_nodes()), np.diff(cg.offsets))]
+        entered = np.nonzero(departure < self.max_time)[0]
+        return entered, departure[entered], departure[entered] + cg.travel_time[entered]
+
+# one-to-all dijkstra from start_node over travel_time that stops at max_time seconds
+# (scipy csgraph, nodes beyond the budget are never settled)
+def bounded_search(graph, start_node, max_time, stats=None):
+    cg = get_compiled_graph(graph)
+    source = cg.index_of(start_node)
+    arrival = dijkstra(cg.as_sparse_matrix(), directed=True, indices=source, limit=max_time)
+    if stats is not None:
+        stats["expansions"] = int(np.isfinite(arrival).sum())
+    return Reachability(cg, source, max_time, arrival)
+
+def _as_nodes(graph, items, snap):
+    coords_at = [i for i, item in enumerate(items) if isinstance(item, (list, tuple))]
+    nodes = list(items)
+    if coords_at:
+        snapped = coords_to_nodes(graph, [items[i] for i in coords_at], snap=snap)
+        for i, node in zip(coords_at, snapped):
+            nodes[i] = node
+    return nodes
+
+# return every outgoing branch at node as (node_id, street, bearing, hint_coords, edge_travel_time),
+# empty if node is not a junction; built once per node and memoized on the compiled graph
+def get_node_junctions(graph, node):
+    cache = get_compiled_graph(graph).junction_cache
+    junctions = cache.get(node)
+    if junctions is not None:
+        return junctions
+
+    junctions = ()
+    successors = gu.get_successors(graph, node)
+    if len(successors) >= 2:
+        branches = []
+        for s in successors:
+            coords = gu.get_edge_geometry_coords(graph, node, s)
+            if len(coords) < 2:
+                continue
+            street = gu.get_edge_name(graph, node, s)
+            bearing = gu.get_bearing(coords[0], coords[1])
+            try:
+                step_m = 8.0
+                hint_coords = gu.interpolate_position(coords[0], step_m, bearing)
+            except Exception:
+                hint_coords = coords[1]
+            branches.append((s, street, bearing, hint_coords, edge_cost_travel_time(graph, node, s)))
+        junctions = tuple(branches)
+    cache[node] = junctions
+    return junctions
+
+# return choices at node when arriving from prev_node (empty if node is not a junction)
+# with end_node each option also gets eta_s, travel time to end_node through it
+# (None if end_node can't be reached that way)
+def get_junction_options(graph, node, prev_node, end_node=None):
+    junctions = get_node_junctions(graph, node)
+    if not junctions:
+        return []
+    tree = None
+    if end_node is not None:
+        cg = get_compiled_graph(graph)
+        tree = get_route_tree(cg, cg.index_of(end_node))
+    options = []
+    for s, street, bearing, hint_coords, travel_time in junctions:
+        if s == prev_node:
+            continue
+        option = {
+            "node_id": s,
+            "street": street,
+            "bearing": bearing,
+            "hint_coords": hint_coords
+        }
+        if tree is not None:
+            s_index = cg.index_of(s)
+            option["eta_s"] = travel_time + tree.dist_list[s_index] if tree.reachable(s_index) else None
+        options.append(option)
+    return options
+
 # route display
+# consecutive edges share their end/start point, it is only kept once
 def get_route_geometry(graph, route):
     if not graph or not route:
         return []
     coords = []
     for i in range(len(route) - 1):
         edge_coords = gu.get_edge_geometry_coords(graph, route[i], route[i + 1])
+        if coords and edge_coords and tuple(coords[-1]) == tuple(edge_coords[0]):
+            edge_coords = edge_coords[1:]
         coords.extend(edge_coords)
-    return coords
\ No newline at end of file
+    return coords
+
+GEOMETRY_ENCODINGS = ("coords", "polyline")
+
+# route geometry as a json-ready payload, simplified to tolerance_m meters
+# "coords": {"geometry": [[lon, lat], ...]}, "polyline": {"polyline": str, "precision": 5}
+def encode_route_geometry(coords, encoding="coords", tolerance_m=0.0):
+    coords = gu.simplify_coords(coords, tolerance_m)
+    if encoding == "coords":
+        return {"geometry": coords}
+    if encoding == "polyline":
+        return {"polyline": gu.encode_polyline(coords), "precision": 5}
+    raise ValueError(f"invalid geometry encoding: {encoding}")
\ No newline at end of file
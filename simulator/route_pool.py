@@ -0,0 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import multiprocessing
+import threading
+import time
+import os
+from simulator import route_handler as rh
+from simulator import landmarks as lm
+from simulator import contraction as ch
+from simulator import graph_store as gs
+
+_worker_graph = None # graph loaded by init_worker in pool processes
+
+# raised by RoutePool.submit when max_pending queries are already queued or running
+class RoutePoolFull(Exception):
+    pass
+
+# process pool initializer, loads the graph and its landmark/CH sidecars once per worker
+def init_worker(graph_path):
+    global _worker_graph
+    _worker_graph = gs.load_graph(graph_path, compact=True)
+    rh.get_compiled_graph(_worker_graph)
+    if os.path.exists(lm.landmarks_path(graph_path)):
+        lm.load_landmarks(_worker_graph, lm.landmarks_path(graph_path))
+    if os.path.exists(ch.ch_path(graph_path)):
+        ch.load_ch(_worker_graph, ch.ch_path(graph_path))
+
+def _worker_route(start_node, end_node, mode, deadline):
+    if deadline is not None and time.time() > deadline: # expired while queued
+        raise TimeoutError("route search timed out in queue")
+    stats = {}
+    route = rh.calculate_route(_worker_graph, start_node, end_node, mode=mode, stats=stats, deadline=deadline)
+    return route, stats
+
+def _ping():
+    return os.getpid()
+
+
+# route queries on a pool of processes that each hold the graph, so long searches don't
+# block request threads; at most max_pending queries are queued or running and each one
+# gets a deadline that the search itself checks
+class RoutePool:
+    def __init__(self, graph_path, workers=2, max_pending=32, timeout=5.0):
+        self.timeout = timeout
+        # fork children before the server starts threads, they inherit nothing they'd deadlock on
+        self.executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker,
+            initargs=(graph_path,)
+        )
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    # start the worker processes now instead of on the first query
+    def warm_up(self):
+        self.executor.submit(_ping).result()
+
+    # queue a query, returns a Future of (route, stats); raises RoutePoolFull when saturated
+    def submit(self, start_node, end_node, mode=None, timeout=None):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise RoutePoolFull("route queue is full")
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        try:
+            future = self.executor.submit(_worker_route, start_node, end_node, mode, deadline)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        with self.lock:
+            self.submitted += 1
+        return future
+
+    # blocking route query, returns (route, stats) or raises TimeoutError/RoutePoolFull
+    # a query still queued at its deadline is cancelled, a running one stops at its deadline
+    def route(self, start_node, end_node, mode=None, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(start_node, end_node, mode, timeout)
+        try:
+            route, stats = future.result(timeout=timeout + 1.0)
+        except (TimeoutError, FutureTimeoutError):
+            future.cancel()
+            with self.lock:
+                self.timed_out += 1
+            rh.ROUTE_SEARCHES.inc(mode or rh.DEFAULT_ROUTE_MODE, "timeout")
+            raise TimeoutError("route search timed out")
+        # worker processes have their own metrics, record the search here
+        rh.record_route_metrics(stats, "unreachable" if route is None else "found")
+        return route, stats
+
+    def stats(self):
+        with self.lock:
+            return {"submitted": self.submitted, "rejected": self.rejected, "timed_out": self.timed_out}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
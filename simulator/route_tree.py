@@ -0,0 +1,73 @@
+import threading
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from simulator.compiled_graph import get_compiled_graph, LIST_ITEM_BYTES
+
+ROUTE_TREE_CACHE_SIZE = 64 # destinations kept per graph at most
+ROUTE_TREE_CACHE_BYTES = 32 * 1024 * 1024 # and fewer where their trees would take more (at least one)
+_cache_lock = threading.Lock()
+
+# shortest path tree towards one destination (reverse dijkstra)
+# dist[i] is the travel time from node index i to target, next_hop[i] the next node
+# index on that path (-1 at the target or if unreachable)
+class RouteTree:
+    def __init__(self, target, dist, next_hop):
+        self.target = target
+        self.dist = dist
+        self.next_hop = next_hop
+        self.dist_list = dist.tolist()
+        self.next_hop_list = next_hop.tolist()
+
+    # arrays plus their list copies
+    def memory_bytes(self):
+        return self.dist.nbytes + self.next_hop.nbytes + 2 * len(self.dist_list) * LIST_ITEM_BYTES
+
+    def reachable(self, index):
+        return self.dist_list[index] != float("inf")
+
+    # return node indices of the path from index to target, None if unreachable
+    def path_from(self, index):
+        if not self.reachable(index):
+            return None
+        path = [index]
+        next_hop = self.next_hop_list
+        while index != self.target:
+            index = next_hop[index]
+            path.append(index)
+        return path
+
+
+# run dijkstra from target over reversed edges
+def build_route_tree(graph, target):
+    cg = get_compiled_graph(graph)
+    reverse_matrix = cg.as_sparse_matrix().T.tocsr()
+    dist, predecessors = dijkstra(reverse_matrix, directed=True, indices=target, return_predecessors=True)
+    next_hop = np.where(predecessors < 0, -1, predecessors).astype(np.int32)
+    return RouteTree(target, dist, next_hop)
+
+# trees kept per graph: ROUTE_TREE_CACHE_SIZE, or fewer on graphs whose trees would take
+# more than ROUTE_TREE_CACHE_BYTES
+def route_tree_cache_size(tree):
+    return max(1, min(ROUTE_TREE_CACHE_SIZE, ROUTE_TREE_CACHE_BYTES // tree.memory_bytes()))
+
+# estimated size of the trees cached on graph, counted by the graph registry
+def route_tree_bytes(graph):
+    cg = get_compiled_graph(graph)
+    with _cache_lock:
+        return sum(tree.memory_bytes() for tree in cg.route_trees.values())
+
+# return RouteTree for target node index (LRU cached on the compiled graph)
+def get_route_tree(graph, target):
+    cg = get_compiled_graph(graph)
+    with _cache_lock:
+        tree = cg.route_trees.get(target)
+        if tree is not None:
+            cg.route_trees.move_to_end(target)
+            return tree
+
+    tree = build_route_tree(cg, target)
+    with _cache_lock:
+        cg.route_trees[target] = tree
+        while len(cg.route_trees) > route_tree_cache_size(tree):
+            cg.route_trees.popitem(last=False)
+    return tree
@@ -0,0 +1,326 @@
+from contextlib import contextmanager
+from simulator.driving_simulator import DrivingSimulator
+import numpy as np
+import threading
+import tempfile
+import glob
+import pickle
+import heapq
+import fcntl
+import time
+import os
+import re
+
+SESSION_SUFFIX = ".sim"
+LOCK_SUFFIX = ".lock"
+ROUTE_SUFFIX = ".route.npy"
+SESSION_KEY_PATTERN = re.compile(r"^[0-9a-fA-F-]{1,64}$")
+TOUCH_SECONDS = 10.0 # read-only sessions push a file's expiry back at most this often
+
+# route_id -> DrivingSimulator store with expiry, stale sessions are dropped in O(log n) each
+# from a heap of (expires_at, key); touching a session doesn't push to the heap, the popped
+# entry is pushed back with the newer expiry instead
+# with a GraphRegistry the region of every sim held by the store is pinned until it's dropped
+class SessionStore:
+    def __init__(self, expiry_seconds=1800, registry=None):
+        self.expiry_seconds = expiry_seconds
+        self.registry = registry
+        self.lock = threading.RLock()
+        self.heap = [] # (expires_at, key), one entry per key
+        self.scheduled = set() # keys in heap
+
+    def _pin(self, sim):
+        if self.registry is not None and sim.region is not None:
+            self.registry.pin(sim.region)
+
+    def _unpin(self, sim):
+        if self.registry is not None and sim.region is not None:
+            self.registry.unpin(sim.region)
+
+    # current expiry of key or None if it's gone
+    def _expires_at(self, key):
+        raise NotImplementedError
+
+    def _remove(self, key):
+        raise NotImplementedError
+
+    # drop what this process still holds for a key removed by another worker
+    def _forget(self, key):
+        pass
+
+    def _schedule(self, key, expires_at):
+        with self.lock:
+            if key not in self.scheduled:
+                self.scheduled.add(key)
+                heapq.heappush(self.heap, (expires_at, key))
+
+    # drop expired sessions, returns how many were removed
+    def cleanup(self, now=None):
+        now = time.time() if now is None else now
+        expired = []
+        gone = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, key = heapq.heappop(self.heap)
+                expires_at = self._expires_at(key)
+                if expires_at is not None and expires_at > now: # touched since it was scheduled
+                    heapq.heappush(self.heap, (expires_at, key))
+                    continue
+                self.scheduled.discard(key)
+                if expires_at is None:
+                    gone.append(key)
+                    continue
+                expired.append(key)
+        for key in gone:
+            self._forget(key)
+        for key in expired:
+            self._remove(key)
+        return len(expired)
+
+    def add(self, key, sim):
+        raise NotImplementedError
+
+    # context manager yielding the sim for key (ValueError if unknown), changes made
+    # inside the block are saved and the session's expiry is pushed back
+    # with write=False the sim must not be changed, stores skip saving it
+    def session(self, key, write=True):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+# sims kept as live objects in this process, for a single worker (or tests)
+# the store lock only guards lookups, every sim has its own lock held while it's in use
+class MemorySessionStore(SessionStore):
+    def __init__(self, expiry_seconds=1800, registry=None):
+        super().__init__(expiry_seconds, registry)
+        self.sessions = {} # key -> DrivingSimulator
+        self.expires = {} # key -> expires_at
+        self.session_locks = {} # key -> threading.Lock
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _expires_at(self, key):
+        return self.expires.get(key)
+
+    def _remove(self, key):
+        with self.lock:
+            sim = self.sessions.pop(key, None)
+            self.expires.pop(key, None)
+            self.session_locks.pop(key, None)
+        if sim is not None:
+            self._unpin(sim)
+
+    def add(self, key, sim):
+        self.cleanup()
+        self._pin(sim)
+        with self.lock:
+            self.sessions[key] = sim
+            self.session_locks[key] = threading.Lock()
+            self.expires[key] = time.time() + self.expiry_seconds
+            self._schedule(key, self.expires[key])
+
+    @contextmanager
+    def session(self, key, write=True):
+        self.cleanup()
+        with self.lock:
+            sim = self.sessions.get(key)
+            if sim is None:
+                raise ValueError("invalid route_id")
+            session_lock = self.session_locks[key]
+            self.expires[key] = time.time() + self.expiry_seconds
+        with session_lock:
+            yield sim
+
+    def delete(self, key):
+        self._remove(key)
+
+
+# sims serialized to one file per session in a directory shared by all workers
+# (DrivingSimulator.to_state, pickled); a session is locked with flock while in use (shared
+# for read-only use), writes are atomic (temp file + os.replace) and the file's mtime is its
+# last use, read-only use only touches it
+# the route goes to its own file (<key>.<n>.route.npy) written when the sim gets a new route,
+# so a tick only rewrites the small pickle of the rest of the state
+# sims are rebuilt on their region's graph from registry (default_region for sims without one),
+# a region stays pinned while this worker holds a decoded sim on it
+class FileSessionStore(SessionStore):
+    def __init__(self, directory, registry, default_region, expiry_seconds=1800):
+        super().__init__(expiry_seconds, registry)
+        self.directory = directory
+        self.default_region = default_region
+        self.decoded = {} # key -> ((inode, mtime_ns), sim), skips unpickling unchanged files
+        self.routes = {} # key -> (route list of the decoded sim, its route file number)
+        os.makedirs(directory, exist_ok=True)
+
+        # sessions left by other/earlier workers, lock files of sessions that are gone
+        now = time.time()
+        for filename in os.listdir(directory):
+            if filename.endswith(SESSION_SUFFIX):
+                key = filename[:-len(SESSION_SUFFIX)]
+                expires_at = self._expires_at(key)
+                if expires_at is not None:
+                    self._schedule(key, min(expires_at, now + self.expiry_seconds))
+            elif filename.endswith(LOCK_SUFFIX):
+                key = filename[:-len(LOCK_SUFFIX)]
+                if SESSION_KEY_PATTERN.match(key) and not os.path.exists(self._path(key)):
+                    self._remove_lock_file(key)
+
+    def __len__(self):
+        return sum(1 for f in os.listdir(self.directory) if f.endswith(SESSION_SUFFIX))
+
+    def _path(self, key, suffix=SESSION_SUFFIX):
+        if not SESSION_KEY_PATTERN.match(key):
+            raise ValueError("invalid route_id")
+        return os.path.join(self.directory, key + suffix)
+
+    def _expires_at(self, key):
+        try:
+            return os.stat(self._path(key)).st_mtime + self.expiry_seconds
+        except FileNotFoundError:
+            return None
+
+    # removing a lock file is only safe once its session file is gone: a worker that opens a new
+    # lock file in its place finds no session and doesn't touch anything
+    def _remove_lock_file(self, key):
+        try:
+            os.remove(self._path(key, LOCK_SUFFIX))
+        except FileNotFoundError:
+            pass
+
+    def _route_path(self, key, number):
+        return self._path(key, f".{number}{ROUTE_SUFFIX}")
+
+    def _remove(self, key):
+        with self._flock(key):
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            for path in glob.glob(self._path(key, f".*{ROUTE_SUFFIX}")):
+                os.remove(path)
+            self._remove_lock_file(key)
+        self._set_decoded(key, None)
+
+    def _forget(self, key):
+        self._set_decoded(key, None)
+
+    @contextmanager
+    def _flock(self, key, shared=False):
+        with open(self._path(key, LOCK_SUFFIX), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # replace the decoded sim of key (None drops it), moving the region pin to the new sim
+    def _set_decoded(self, key, version, sim=None):
+        with self.lock:
+            previous = self.decoded.pop(key, (None, None))[1]
+            if sim is not None:
+                self.decoded[key] = (version, sim)
+            else:
+                self.routes.pop(key, None)
+        if sim is not previous:
+            if sim is not None:
+                self._pin(sim)
+            if previous is not None:
+                self._unpin(previous)
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._set_decoded(key, None)
+            raise ValueError("invalid route_id")
+        version = (st.st_ino, st.st_mtime_ns)
+        with self.lock:
+            cached = self.decoded.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        if cached is None: # added by another worker, expire it from here too
+            self._schedule(key, st.st_mtime + self.expiry_seconds)
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        route_number = state.pop("route_number", None) # None: no route, or inlined by older versions
+        if route_number is not None:
+            state["route"] = np.load(self._route_path(key, route_number))
+        region = state.get("region") or self.default_region
+        with self.registry.use(region) as entry:
+            sim = DrivingSimulator.from_state(entry.graph, state)
+            sim.region = region
+            self._set_decoded(key, version, sim)
+        with self.lock:
+            self.routes[key] = (sim.route, route_number)
+        return sim
+
+    # write data through write(file) to a temp file, then move it to path
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _save(self, key, sim):
+        state = sim.to_state()
+        route = state.pop("route")
+        with self.lock:
+            saved_route, route_number = self.routes.get(key, (None, None))
+        stale_number = None
+        if route is not None and sim.route is not saved_route: # routes are replaced, never changed in place
+            stale_number = route_number
+            route_number = 0 if route_number is None else route_number + 1
+            self._write_atomic(self._route_path(key, route_number), lambda f: np.save(f, route))
+        elif route is None:
+            stale_number, route_number = route_number, None
+        state["route_number"] = route_number
+        self._write_atomic(self._path(key), lambda f: pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL))
+        if stale_number is not None: # no longer referenced by the session file
+            os.remove(self._route_path(key, stale_number))
+        st = os.stat(self._path(key))
+        self._set_decoded(key, (st.st_ino, st.st_mtime_ns), sim)
+        with self.lock:
+            self.routes[key] = (sim.route, route_number)
+
+    # push the expiry of an unchanged session back (at most every TOUCH_SECONDS)
+    def _touch(self, key, sim):
+        path = self._path(key)
+        if os.stat(path).st_mtime > time.time() - TOUCH_SECONDS:
+            return
+        os.utime(path)
+        st = os.stat(path)
+        self._set_decoded(key, (st.st_ino, st.st_mtime_ns), sim)
+
+    def add(self, key, sim):
+        self.cleanup()
+        with self._flock(key):
+            self._save(key, sim)
+        self._schedule(key, time.time() + self.expiry_seconds)
+
+    @contextmanager
+    def session(self, key, write=True):
+        self.cleanup()
+        with self._flock(key, shared=not write):
+            if not os.path.exists(self._path(key)): # unknown or removed while waiting for the lock
+                self._set_decoded(key, None)
+                self._remove_lock_file(key)
+                raise ValueError("invalid route_id")
+            sim = self._load(key)
+            try:
+                yield sim
+            finally:
+                if write:
+                    self._save(key, sim)
+                else:
+                    self._touch(key, sim)
+
+    def delete(self, key):
+        self._remove(key)
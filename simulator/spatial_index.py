@@ -0,0 +1,139 @@
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+from simulator import geo_utils as gu
+from simulator.compiled_graph import get_compiled_graph
+
+MAX_PIECE_M = 50.0 # long edge segments are split so the midpoint tree bounds stay tight
+
+# nearest node / nearest edge lookups over a graph, built once per graph
+# nodes are indexed as unit vectors (chord order == great-circle order)
+# edges are indexed as short projected pieces keyed by their midpoints
+class SpatialIndex:
+    def __init__(self, graph):
+        self.graph = graph
+        self.cg = get_compiled_graph(graph)
+        self.node_tree = cKDTree(_unit_vectors(self.cg.lon, self.cg.lat))
+        self.ref_lat = float(np.radians(self.cg.lat.mean()))
+
+        self._pieces = None # built on first nearest_edges call
+        self.snap_calls = 0
+        self.snap_points = 0
+        self.snap_seconds = 0.0
+
+    def _record(self, start, count):
+        self.snap_calls += 1
+        self.snap_points += count
+        self.snap_seconds += time.perf_counter() - start
+
+    # return snap latency counters
+    def stats(self):
+        mean_ms = (self.snap_seconds / self.snap_calls) * 1000 if self.snap_calls else 0.0
+        return {
+            "calls": self.snap_calls,
+            "points": self.snap_points,
+            "total_ms": self.snap_seconds * 1000,
+            "mean_ms": mean_ms
+        }
+
+    # return (osm node ids, distances in meters) nearest to each (lon, lat)
+    def nearest_nodes(self, lons, lats):
+        start = time.perf_counter()
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        chord, index = self.node_tree.query(_unit_vectors(lons, lats))
+        dists = 2 * gu.EARTH_RADIUS_MEAN_M * np.arcsin(np.minimum(chord / 2, 1.0))
+        nodes = self.cg.node_ids[index]
+        self._record(start, len(lons))
+        return nodes, dists
+
+    # return (u ids, v ids, fraction along edge, distances in meters) of the edge nearest to each (lon, lat)
+    def nearest_edges(self, lons, lats):
+        if self._pieces is None:
+            self._pieces = self._build_pieces()
+        start = time.perf_counter()
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        tree, a, b, edge, offset, edge_length, half_max, edge_u, edge_v = self._pieces
+        points = self._project(lons, lats)
+
+        # any piece closer than the nearest midpoint lies within that distance + half a piece
+        mid_dist, _ = tree.query(points)
+        candidates = tree.query_ball_point(points, mid_dist + half_max)
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.int64, count=len(candidates))
+        query_idx = np.repeat(np.arange(len(points)), counts)
+        piece_idx = np.fromiter((i for c in candidates for i in c), dtype=np.int64, count=counts.sum())
+
+        p = points[query_idx]
+        ab = b[piece_idx] - a[piece_idx]
+        ab_len2 = np.einsum("ij,ij->i", ab, ab)
+        t = np.einsum("ij,ij->i", p - a[piece_idx], ab) / np.where(ab_len2 > 0, ab_len2, 1.0)
+        t = np.clip(t, 0.0, 1.0)
+        closest = a[piece_idx] + ab * t[:, None]
+        d = np.hypot(*(p - closest).T)
+
+        # best candidate per query (candidates are grouped by query)
+        order = np.lexsort((d, query_idx))
+        first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        best = piece_idx[order[first]]
+        best_t = t[order[first]]
+        best_d = d[order[first]]
+
+        e = edge[best]
+        along = offset[best] + best_t * np.sqrt(ab_len2[order[first]])
+        fraction = np.where(edge_length[e] > 0, along / np.where(edge_length[e] > 0, edge_length[e], 1.0), 0.0)
+        self._record(start, len(lons))
+        return edge_u[e], edge_v[e], np.clip(fraction, 0.0, 1.0), best_d
+
+    # local equirectangular projection (meters)
+    def _project(self, lons, lats):
+        x = gu.EARTH_RADIUS_MEAN_M * np.cos(self.ref_lat) * np.radians(lons)
+        y = gu.EARTH_RADIUS_MEAN_M * np.radians(lats)
+        return np.column_stack((x, y))
+
+    def _build_pieces(self):
+        cg = self.cg
+        starts = []
+        ends = []
+        edges = []
+        offsets = []
+        edge_length = np.zeros(cg.num_edges())
+        for u in range(cg.num_nodes()):
+            for e in range(cg.offset_list[u], cg.offset_list[u + 1]):
+                coords = gu.get_edge_geometry_coords(self.graph, cg.node_of(u), cg.node_of(cg.target_list[e]))
+                xy = self._project(*np.asarray(coords, dtype=np.float64).T)
+                seg_len = np.hypot(*np.diff(xy, axis=0).T)
+                along = 0.0
+                for i in range(len(seg_len)):
+                    splits = max(1, int(np.ceil(seg_len[i] / MAX_PIECE_M)))
+                    for k in range(splits):
+                        starts.append(xy[i] + (xy[i + 1] - xy[i]) * (k / splits))
+                        ends.append(xy[i] + (xy[i + 1] - xy[i]) * ((k + 1) / splits))
+                        edges.append(e)
+                        offsets.append(along + seg_len[i] * (k / splits))
+                    along += seg_len[i]
+                edge_length[e] = along
+
+        a = np.asarray(starts)
+        b = np.asarray(ends)
+        half_max = float(np.hypot(*(b - a).T).max()) / 2
+        tree = cKDTree((a + b) / 2)
+        edge_u = cg.node_ids[np.repeat(np.arange(cg.num_nodes()), np.diff(cg.offsets))]
+        edge_v = cg.node_ids[cg.targets]
+        return tree, a, b, np.asarray(edges), np.asarray(offsets), edge_length, half_max, edge_u, edge_v
+
+
+# (lon, lat) degrees -> unit vectors on the sphere
+def _unit_vectors(lons, lats):
+    lon = np.radians(lons)
+    lat = np.radians(lats)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+# return spatial index of graph (built once per graph)
+def get_spatial_index(graph):
+    cg = get_compiled_graph(graph)
+    if cg.spatial_index is None:
+        cg.spatial_index = SpatialIndex(graph)
+    return cg.spatial_index
@@ -0,0 +1,169 @@
+from simulator import metrics
+import threading
+import time
+import uuid
+
+OWNER_TIMEOUT_TICKS = 3 # intervals without a tick after which another scheduler takes a sim over
+
+SCHEDULER_PASS_SECONDS = metrics.histogram("scheduler_pass_seconds", "Duration of one scheduler pass over all streamed sims")
+SIM_TICK_SECONDS = metrics.histogram("sim_tick_seconds", "DrivingSimulator.tick duration", ("source",))
+
+# one streamed simulation: latest published state + subscribers waiting on it
+class _Channel:
+    def __init__(self):
+        self.subscribers = 0
+        self.version = 0
+        self.events = [] # (version, event, payload), newest last
+        self.last_state = None
+        self.closed = False
+
+# advances streamed simulations of a session store on a background thread at a fixed
+# tick interval and hands their state to subscribers (one generator per open stream)
+# a sim streamed by several schedulers (gunicorn workers sharing a file store) is only ticked by
+# the one recorded as its tick_owner, the others publish the state it leaves
+class TickScheduler:
+    def __init__(self, store, interval=0.2, heartbeat=15.0, history=8):
+        self.owner_id = uuid.uuid4().hex
+        self.store = store
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.history = history
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.channels = {} # key -> _Channel
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="tick-scheduler", daemon=True)
+            self._thread.start()
+
+    def is_streaming(self, key):
+        with self.lock:
+            return key in self.channels
+
+    def _publish(self, channel, event, payload):
+        channel.version += 1
+        channel.events.append((channel.version, event, payload))
+        del channel.events[:-self.history]
+
+    def _owns(self, sim, now):
+        if sim.tick_owner in (None, self.owner_id):
+            return True
+        return now - sim.last_ticked > OWNER_TIMEOUT_TICKS * self.interval # its scheduler stopped
+
+    # tick the sim under key if this scheduler owns it (claiming it if it's free), returns
+    # (awaiting a junction choice before the tick or None if it wasn't ticked, state)
+    def _tick(self, key):
+        now = time.time()
+        with self.store.session(key, write=False) as sim:
+            if not self._owns(sim, now):
+                return None, sim.get_state()
+        with self.store.session(key) as sim:
+            if not self._owns(sim, now): # claimed by another scheduler in between
+                return None, sim.get_state()
+            was_awaiting = sim.awaiting_junc_choice
+            with SIM_TICK_SECONDS.time("scheduler"):
+                sim.tick()
+            sim.tick_owner = self.owner_id
+            sim.last_ticked = now
+            sim.last_used = now
+            return was_awaiting, sim.get_state()
+
+    # tick every streamed sim once and publish changed states; sims are ticked outside the
+    # lock, so a slow session doesn't hold up subscribers or other channels' events
+    def tick_all(self):
+        with SCHEDULER_PASS_SECONDS.time():
+            with self.lock:
+                channels = [(key, channel) for key, channel in self.channels.items() if not channel.closed]
+            for key, channel in channels:
+                try:
+                    was_awaiting, state = self._tick(key)
+                except Exception as e:
+                    with self.lock:
+                        if not channel.closed:
+                            self._publish(channel, "sim_error", {"error": str(e)})
+                            channel.closed = True
+                    continue
+
+                with self.lock:
+                    if channel.closed or state == channel.last_state:
+                        continue
+                    if was_awaiting is None:
+                        was_awaiting = channel.last_state is not None and channel.last_state["awaiting_junc_choice"]
+                    channel.last_state = state
+                    self._publish(channel, "state", state)
+                    if state["awaiting_junc_choice"] and not was_awaiting:
+                        self._publish(channel, "junction", {"junc_options": state["junc_options"]})
+                    if state["finished"]:
+                        self._publish(channel, "finished", state)
+                        channel.closed = True
+            with self.lock:
+                self.condition.notify_all()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.channels:
+                    self._thread = None
+                    return
+            self.tick_all()
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic() # fell behind, don't try to catch up
+
+    # generator of (event, payload) for the sim stored under key, runs until the sim
+    # finishes, errors or the consumer stops iterating; a "ping" is yielded every heartbeat
+    def subscribe(self, key):
+        with self.store.session(key, write=False) as sim:
+            initial = sim.get_state()
+        with self.lock:
+            channel = self.channels.get(key)
+            if channel is None or channel.closed:
+                channel = _Channel()
+                self.channels[key] = channel
+            channel.subscribers += 1
+            self._ensure_thread()
+            seen = channel.version
+
+        try:
+            yield "state", initial
+            if initial["finished"]:
+                yield "finished", initial
+                return
+            if initial["awaiting_junc_choice"]:
+                yield "junction", {"junc_options": initial["junc_options"]}
+            while True:
+                with self.lock:
+                    deadline = time.monotonic() + self.heartbeat
+                    while channel.version == seen and not channel.closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    pending = [e for e in channel.events if e[0] > seen]
+                    seen = channel.version
+                    closed = channel.closed
+                if not pending and not closed:
+                    yield "ping", {}
+                for _, event, payload in pending:
+                    yield event, payload
+                if closed:
+                    return
+        finally:
+            with self.lock:
+                channel.subscribers -= 1
+                if channel.subscribers <= 0 and self.channels.get(key) is channel:
+                    del self.channels[key]
+
+    # stop streaming key (e.g. on reset), wakes its subscribers
+    def remove(self, key):
+        with self.lock:
+            channel = self.channels.pop(key, None)
+            if channel is not None:
+                channel.closed = True
+                self.condition.notify_all()
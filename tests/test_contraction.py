@@ -0,0 +1,53 @@
+import random
+import networkx as nx
+import pytest
+from simulator import contraction as ch
+from simulator import geo_utils as gu
+from simulator import route_handler as rh
+from simulator.compiled_graph import get_compiled_graph
+
+# size x size street grid with random speeds, some streets one-way
+def _grid_graph(size=6, seed=1):
+    rng = random.Random(seed)
+    graph = nx.MultiDiGraph()
+    for i in range(size):
+        for j in range(size):
+            graph.add_node(i * size + j, x=0.001 * j, y=0.001 * i)
+    for i in range(size):
+        for j in range(size):
+            u = i * size + j
+            for v in ([u + 1] if j + 1 < size else []) + ([u + size] if i + 1 < size else []):
+                coords_u = (graph.nodes[u]["x"], graph.nodes[u]["y"])
+                coords_v = (graph.nodes[v]["x"], graph.nodes[v]["y"])
+                length = gu.get_geodesic_distance(coords_u, coords_v)
+                speed = rng.uniform(5.0, 20.0)
+                one_way = rng.random() < 0.2
+                graph.add_edge(u, v, length=length, travel_time=length / speed)
+                if not one_way:
+                    graph.add_edge(v, u, length=length, travel_time=length / speed)
+    return graph
+
+def _cost(cg, route):
+    return sum(cg.travel_time_list[cg.edge_index(cg.index_of(u), cg.index_of(v))] for u, v in zip(route, route[1:]))
+
+def _assert_matches_astar(graph):
+    cg = get_compiled_graph(graph)
+    cg.ch = ch.build_ch(graph)
+    for start in graph.nodes:
+        for end in graph.nodes:
+            expected = rh.calculate_route(graph, start, end, mode="astar")
+            route = rh.calculate_route(graph, start, end, mode="ch")
+            if expected is None:
+                assert route is None
+                continue
+            assert route[0] == start and route[-1] == end
+            assert _cost(cg, route) == pytest.approx(_cost(cg, expected))
+
+def test_ch_routes_cost_the_same_as_astar():
+    _assert_matches_astar(_grid_graph())
+
+# capped witness searches miss witnesses and add redundant shortcuts, routes stay exact
+def test_ch_with_tight_witness_limits_stays_exact(monkeypatch):
+    for name in ("WITNESS_SETTLE_LIMIT", "WITNESS_HOP_LIMIT", "PRIORITY_SETTLE_LIMIT", "PRIORITY_HOP_LIMIT"):
+        monkeypatch.setattr(ch, name, 1)
+    _assert_matches_astar(_grid_graph(seed=2))
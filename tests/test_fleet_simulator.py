@@ -0,0 +1,83 @@
+import networkx as nx
+import pytest
+from simulator import geo_utils as gu
+from simulator import route_handler as rh
+from simulator.driving_simulator import DrivingSimulator
+from simulator.fleet_simulator import FleetSimulator
+
+ROUTE = [1, 2, 3, 4, 5, 6]
+
+# a straight street 1 -> 6 (3 -> 4 has zero length) with a side street leaving every inner node
+def _street_graph():
+    graph = nx.MultiDiGraph()
+    coords = {1: (0.0, 0.0), 2: (0.001, 0.0), 3: (0.002, 0.0), 4: (0.002, 0.0), 5: (0.003, 0.0), 6: (0.004, 0.0),
+              20: (0.001, 0.001), 30: (0.002, 0.001), 40: (0.002, -0.001), 50: (0.003, 0.001)}
+    for node, (x, y) in coords.items():
+        graph.add_node(node, x=x, y=y)
+    for u, v in list(zip(ROUTE, ROUTE[1:])) + [(2, 20), (3, 30), (4, 40), (5, 50)]:
+        length = gu.get_geodesic_distance(coords[u], coords[v])
+        graph.add_edge(u, v, length=length, travel_time=length / 10.0)
+    return graph
+
+# tick a DrivingSimulator and a fleet vehicle on the same route side by side, staying on the
+# route at every junction, and compare their states after each tick
+def _compare(graph, speed):
+    sim = DrivingSimulator()
+    sim.tick_interval = 1.0
+    sim.load_route(graph, list(ROUTE))
+    sim.start()
+    sim.set_speed(speed)
+    sim.stop_at_junctions = True
+    fleet = FleetSimulator(graph, tick_interval=1.0)
+    v = fleet.add_vehicle(ROUTE, speed=speed, stop_at_junctions=True)
+
+    stops = []
+    for _ in range(100):
+        sim.tick()
+        fleet.tick()
+        expected = sim.get_state()
+        state = fleet.get_state(v)
+        assert state["finished"] == expected["finished"]
+        assert state["awaiting_junc_choice"] == expected["awaiting_junc_choice"]
+        assert gu.get_geodesic_distance(state["coords"], expected["coords"]) < 1e-6
+        assert [o["node_id"] for o in state["junc_options"]] == [o["node_id"] for o in expected["junc_options"]]
+        if expected["finished"]:
+            return stops
+        if expected["awaiting_junc_choice"]:
+            stops.append(sim.current_node)
+            next_node = sim.route[sim.current_node_index + 1]
+            sim.choose_junction_node(next_node)
+            fleet.choose_junction_node(v, next_node)
+    assert False, "route not finished"
+
+@pytest.mark.parametrize("speed", [50.0, 150.0, 250.0, 500.0])
+def test_fleet_matches_driving_simulator_at_junctions(speed):
+    assert _compare(_street_graph(), speed) == [2, 3, 4, 5]
+
+# junctions without options are passed and the rest of the tick is driven after them,
+# possibly up to the next junction
+@pytest.mark.parametrize("speed", [50.0, 150.0, 250.0, 500.0])
+def test_fleet_carries_distance_past_junctions_without_options(speed, monkeypatch):
+    get_junction_options = rh.get_junction_options
+    monkeypatch.setattr(rh, "get_junction_options", lambda graph, node, *args: [] if node in (2, 4) else get_junction_options(graph, node, *args))
+    assert _compare(_street_graph(), speed) == [3, 5]
+
+def test_fleet_reroutes_reuse_vertex_buffer():
+    graph = _street_graph()
+    graph.add_edge(30, 4, length=111.0, travel_time=11.1)
+    fleet = FleetSimulator(graph, tick_interval=1.0)
+    vehicles = fleet.add_vehicles([ROUTE] * 4, speed=200.0, stop_at_junctions=True)
+    capacity = len(fleet.v_cum)
+    for _ in range(20):
+        fleet.tick()
+        for v in vehicles:
+            if fleet.awaiting_junc_choice[v]:
+                route = fleet.routes[v]
+                if route[fleet._junction_node_index(v)] == 3:
+                    fleet.choose_junction_node(v, 30) # off the route, back onto it at 4
+                else:
+                    fleet.choose_junction_node(v, route[fleet._junction_node_index(v) + 1])
+    assert all(fleet.finished)
+    assert all(fleet.route_changed)
+    assert len(fleet.v_cum) == capacity # appended in place, no reallocation
+    assert fleet.vertex_count <= capacity
@@ -0,0 +1,33 @@
+from simulator.route_cache import RouteCache
+
+def test_eviction_without_suffixes():
+    cache = RouteCache(max_entries=2, suffixes=False)
+    cache.put(1, 9, [1, 2, 9])
+    cache.put(3, 9, [3, 2, 9])
+    cache.put(4, 9, [4, 9]) # evicts (1, 9)
+    assert list(cache.entries) == [(3, 9), (4, 9)]
+    assert cache.get(1, 9) == ("miss", None)
+    assert cache.get(3, 9) == ("hit", [3, 2, 9])
+    assert cache.ends == {} and cache.end_counts == {}
+
+def test_expiry_without_suffixes():
+    cache = RouteCache(ttl_seconds=-1, suffixes=False)
+    cache.put(1, 9, [1, 2, 9])
+    assert cache.get(1, 9) == ("miss", None)
+    assert cache.get(2, 9) == ("miss", None)
+    assert len(cache.entries) == 0
+
+def test_suffix_and_eviction():
+    cache = RouteCache(max_entries=1)
+    cache.put(1, 9, [1, 2, 3, 9])
+    assert cache.get(2, 9) == ("suffix", [2, 3, 9])
+    cache.put(5, 7, [5, 7]) # evicts (1, 9) and its suffix index
+    assert cache.get(2, 9) == ("miss", None)
+    assert 9 not in cache.ends and 9 not in cache.end_counts
+
+def test_expiry_with_suffixes():
+    cache = RouteCache(ttl_seconds=-1)
+    cache.put(1, 9, [1, 2, 9])
+    assert cache.get(2, 9) == ("miss", None)
+    assert cache.get(1, 9) == ("miss", None)
+    assert cache.ends == {} and cache.end_counts == {}
@@ -0,0 +1,100 @@
+import threading
+import pytest
+import time
+import os
+from simulator import session_store as ss
+from simulator import graph_registry as gr
+from simulator import route_handler as rh
+from simulator.driving_simulator import DrivingSimulator
+
+GRAPH_PATH = os.path.join(os.path.dirname(__file__), "..", "graphs", "Manhattan_New_York_USA_drive.pkl")
+
+class FakeSim:
+    region = None
+
+def test_memory_sessions_lock_independently():
+    store = ss.MemorySessionStore()
+    store.add("a", FakeSim())
+    store.add("b", FakeSim())
+    entered = threading.Event()
+    release = threading.Event()
+
+    def hold_a():
+        with store.session("a"):
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold_a)
+    thread.start()
+    entered.wait(5)
+    start = time.time()
+    with store.session("b"): # not blocked by the open session on "a"
+        pass
+    assert time.time() - start < 1
+    release.set()
+    thread.join()
+
+def test_file_session_read_only_skips_save(tmp_path):
+    registry = gr.GraphRegistry()
+    region = registry.register(GRAPH_PATH)
+    graph = registry.pin(region)
+    node_ids = graph.node_id_list[:1] # compact registry graphs are compiled graphs
+    sim = DrivingSimulator()
+    sim.region = region
+    sim.load_route(graph, node_ids)
+    sim.start()
+
+    store = ss.FileSessionStore(str(tmp_path), registry, region)
+    store.add("a1", sim)
+    path = store._path("a1")
+    before = os.stat(path)
+    with store.session("a1", write=False) as loaded:
+        loaded.get_state()
+    after = os.stat(path)
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+
+    with store.session("a1") as loaded:
+        loaded.set_speed(5)
+    assert os.stat(path).st_ino != before.st_ino
+    with store.session("a1", write=False) as loaded:
+        assert loaded.current_speed == 5
+
+def test_file_session_unknown_key_leaves_no_lock_file(tmp_path):
+    store = ss.FileSessionStore(str(tmp_path), gr.GraphRegistry(), None)
+    with pytest.raises(ValueError):
+        with store.session("0a1b"):
+            pass
+    assert os.listdir(tmp_path) == []
+
+def test_file_session_writes_route_once(tmp_path):
+    registry = gr.GraphRegistry()
+    region = registry.register(GRAPH_PATH)
+    graph = registry.pin(region)
+    node_ids = graph.node_id_list
+    sim = DrivingSimulator()
+    sim.region = region
+    sim.load_route(graph, rh.calculate_route(graph, node_ids[0], node_ids[len(node_ids) // 2]))
+    sim.start()
+    sim.set_speed(10)
+
+    store = ss.FileSessionStore(str(tmp_path), registry, region)
+    store.add("a1", sim)
+    route_files = [f for f in os.listdir(tmp_path) if f.endswith(ss.ROUTE_SUFFIX)]
+    assert len(route_files) == 1
+    route_stat = os.stat(os.path.join(tmp_path, route_files[0]))
+    for _ in range(3):
+        with store.session("a1") as loaded:
+            loaded.tick()
+    assert os.stat(os.path.join(tmp_path, route_files[0])).st_mtime_ns == route_stat.st_mtime_ns
+
+    store.decoded.clear() # as seen by another worker
+    store.routes.clear()
+    with store.session("a1", write=False) as loaded:
+        assert loaded.route == sim.route
+        assert loaded.distance_along_edge == sim.distance_along_edge
+
+    with store.session("a1") as loaded:
+        loaded.load_route(graph, loaded.route[:2]) # a new route replaces the old file
+    assert [f for f in os.listdir(tmp_path) if f.endswith(ss.ROUTE_SUFFIX)] == ["a1.1" + ss.ROUTE_SUFFIX]
+    store.delete("a1")
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,45 @@
+import os
+from simulator import session_store as ss
+from simulator import graph_registry as gr
+from simulator import route_handler as rh
+from simulator import tick_scheduler as ts
+from simulator.driving_simulator import DrivingSimulator
+
+GRAPH_PATH = os.path.join(os.path.dirname(__file__), "..", "graphs", "Manhattan_New_York_USA_drive.pkl")
+
+def _progress(store, key):
+    with store.session(key, write=False) as sim:
+        return (sim.current_node_index, sim.distance_along_edge)
+
+def test_shared_sim_is_ticked_by_one_scheduler(tmp_path):
+    registry = gr.GraphRegistry()
+    region = registry.register(GRAPH_PATH)
+    graph = registry.pin(region)
+    node_ids = graph.node_id_list
+    route = rh.calculate_route(graph, node_ids[0], node_ids[len(node_ids) // 2])
+    sim = DrivingSimulator()
+    sim.region = region
+    sim.load_route(graph, route)
+    sim.start()
+    sim.set_speed(10)
+
+    store = ss.FileSessionStore(str(tmp_path), registry, region)
+    store.add("a1", sim)
+    first = ts.TickScheduler(store, interval=60)
+    second = ts.TickScheduler(store, interval=60)
+    for scheduler in (first, second):
+        scheduler.channels["a1"] = ts._Channel() # streamed by both, without the background threads
+
+    first.tick_all()
+    after_first = _progress(store, "a1")
+    second.tick_all() # owned by first, only publishes
+    assert _progress(store, "a1") == after_first
+    assert second.channels["a1"].last_state == first.channels["a1"].last_state
+    first.tick_all()
+    assert _progress(store, "a1") != after_first
+
+    with store.session("a1") as loaded:
+        loaded.last_ticked -= ts.OWNER_TIMEOUT_TICKS * 60 + 1 # first stopped ticking
+    second.tick_all()
+    with store.session("a1", write=False) as loaded:
+        assert loaded.tick_owner == second.owner_id